@@ -0,0 +1,345 @@
+"""
+Admission control in front of the shared upstream providers
+
+Two layers:
+
+- Token buckets per (user, route). Each user gets RATE_LIMITS requests
+  per minute per route, with a burst allowance. Over the limit, the route
+  answers 429 with Retry-After. A user who has burned through half of
+  their burst is moved to the bulk lane, as is any request sent with
+  `X-Request-Priority: bulk`.
+
+- Priority gates per provider (Groq, JigsawStack, gTTS, Google STT). Each
+  gate caps concurrent upstream calls. Bulk work may use at most half of
+  the slots and never jumps ahead of waiting interactive calls, so a
+  batch job or noisy neighbour cannot starve tutor chats. A call that
+  cannot get a slot within its lane's wait budget is rejected with 429.
+  The lane lives in a contextvar; work handed to a thread pool must go
+  through submit() to keep it.
+
+Provider quota headers (x-ratelimit-*, retry-after) are recorded after
+every upstream response. A provider that reports an exhausted quota, or
+answers 429, is not called again until its reset time. Bulk calls also
+stop once less than QUOTA_RESERVE of the quota is left.
+
+All state is per process: with several workers each one enforces the
+limits on its own share of the traffic.
+"""
+import contextvars
+import functools
+import os
+import re
+import threading
+import time
+from contextlib import contextmanager
+
+INTERACTIVE = 'interactive'
+BULK = 'bulk'
+LANES = (INTERACTIVE, BULK)
+
+def _parse_limits(spec, defaults):
+    """'translate=30:10,tts=120:30' -> {'translate': (30.0, 10), ...} over the defaults"""
+    limits = dict(defaults)
+    for item in filter(None, (part.strip() for part in spec.split(','))):
+        name, _, value = item.partition('=')
+        first, _, second = value.partition(':')
+        limits[name.strip()] = (float(first), int(second or first))
+    return limits
+
+# Per user and route: (requests per minute, burst)
+RATE_LIMITS = _parse_limits(os.getenv('RATE_LIMITS', ''), {
+    'translate': (30, 10),
+    'tutor_chat': (20, 5),
+    'tts': (120, 30),
+    'transcribe': (20, 5),
+})
+# Per provider: (max concurrent calls, of which bulk may use)
+UPSTREAM_LIMITS = _parse_limits(os.getenv('UPSTREAM_LIMITS', ''), {
+    'groq': (4, 2),
+    'jigsawstack': (8, 4),
+    'gtts': (4, 2),
+    'google_stt': (4, 2),
+})
+# Seconds a call may queue for an upstream slot before it is rejected
+LANE_WAIT = {INTERACTIVE: float(os.getenv('ADMISSION_WAIT', '10')), BULK: 60.0}
+# Fraction of a provider's quota kept for interactive calls
+QUOTA_RESERVE = 0.1
+
+class Overloaded(Exception):
+    """Raised when a request is over its rate limit or no upstream capacity is left"""
+
+    def __init__(self, message, retry_after=1):
+        super().__init__(message)
+        self.retry_after = max(1, int(retry_after + 0.999))
+
+# --- Lanes ---
+
+_lane = contextvars.ContextVar('admission_lane', default=INTERACTIVE)
+
+def current_lane():
+    return _lane.get()
+
+@contextmanager
+def lane(name):
+    """Run the block in a priority lane (e.g. prewarm jobs run as BULK)"""
+    token = _lane.set(name)
+    try:
+        yield
+    finally:
+        _lane.reset(token)
+
+def submit(executor, fn, *args, context=None):
+    """executor.submit that keeps the caller's lane; pool threads don't inherit contextvars
+
+    Pass a context captured earlier (contextvars.copy_context()) to submit
+    from code that outlives the block that set the lane, e.g. a streamed body.
+    """
+    context = (context or contextvars.copy_context()).copy()
+    return executor.submit(context.run, fn, *args)
+
+# --- Token buckets ---
+
+class TokenBucket:
+    def __init__(self, per_minute, burst):
+        self.rate = per_minute / 60.0
+        self.burst = burst
+        self.tokens = float(burst)
+        self.updated = time.monotonic()
+
+    def _refill(self, now):
+        self.tokens = min(self.burst, self.tokens + (now - self.updated) * self.rate)
+        self.updated = now
+
+    def take(self):
+        """Return (allowed, seconds until a token is available, tokens left)"""
+        now = time.monotonic()
+        self._refill(now)
+        if self.tokens >= 1:
+            self.tokens -= 1
+            return True, 0, self.tokens
+        return False, (1 - self.tokens) / self.rate if self.rate else 60, self.tokens
+
+    def idle(self, now):
+        return self.tokens + (now - self.updated) * self.rate >= self.burst
+
+_buckets = {}
+_buckets_lock = threading.Lock()
+_rejected = {}
+PRUNE_EVERY = 1000
+_takes = 0
+
+def take_token(user_id, route):
+    """Charge one request to the user's bucket for route"""
+    global _takes
+    per_minute, burst = RATE_LIMITS[route]
+    with _buckets_lock:
+        bucket = _buckets.get((user_id, route))
+        if bucket is None:
+            bucket = _buckets[(user_id, route)] = TokenBucket(per_minute, burst)
+        allowed, retry_after, tokens = bucket.take()
+        if not allowed:
+            _rejected[route] = _rejected.get(route, 0) + 1
+        _takes += 1
+        if _takes % PRUNE_EVERY == 0:
+            # Full buckets carry no state worth keeping
+            now = time.monotonic()
+            for key in [k for k, b in _buckets.items() if b.idle(now)]:
+                del _buckets[key]
+    return allowed, retry_after, tokens / burst
+
+def rate_limited(route):
+    """Decorator for a login_required view: per-user token bucket plus lane selection"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            from flask import request
+            from flask_login import current_user
+
+            allowed, retry_after, fill = take_token(current_user.id, route)
+            if not allowed:
+                raise Overloaded(f"Rate limit exceeded for {route}", retry_after)
+            bulk = request.headers.get('X-Request-Priority', '').lower() == BULK or fill < 0.5
+            with lane(BULK if bulk else INTERACTIVE):
+                return view(*args, **kwargs)
+        return wrapper
+    return decorator
+
+# --- Upstream gates ---
+
+class PriorityGate:
+    """Concurrency limit for one provider with an interactive and a bulk lane"""
+
+    def __init__(self, name, capacity, bulk_capacity):
+        self.name = name
+        self.capacity = capacity
+        self.bulk_capacity = min(bulk_capacity, capacity)
+        self.active = dict.fromkeys(LANES, 0)
+        self.waiting = dict.fromkeys(LANES, 0)
+        self.rejected = dict.fromkeys(LANES, 0)
+        self._cond = threading.Condition()
+
+    def _can_enter(self, lane_name):
+        if sum(self.active.values()) >= self.capacity:
+            return False
+        if lane_name == BULK:
+            return self.active[BULK] < self.bulk_capacity and not self.waiting[INTERACTIVE]
+        return True
+
+    def acquire(self, lane_name, timeout):
+        deadline = time.monotonic() + timeout
+        with self._cond:
+            self.waiting[lane_name] += 1
+            try:
+                while not self._can_enter(lane_name):
+                    remaining = deadline - time.monotonic()
+                    if remaining <= 0:
+                        self.rejected[lane_name] += 1
+                        raise Overloaded(f"{self.name} is busy, try again shortly", retry_after=2)
+                    self._cond.wait(remaining)
+                self.active[lane_name] += 1
+            finally:
+                self.waiting[lane_name] -= 1
+
+    def release(self, lane_name):
+        with self._cond:
+            self.active[lane_name] -= 1
+            self._cond.notify_all()
+
+    def stats(self):
+        with self._cond:
+            return {
+                'capacity': self.capacity,
+                'bulk_capacity': self.bulk_capacity,
+                'active': dict(self.active),
+                'queued': dict(self.waiting),
+                'rejected': dict(self.rejected),
+            }
+
+_gates = {}
+_quotas = {}
+_gates_lock = threading.Lock()
+
+def get_gate(provider):
+    gate = _gates.get(provider)
+    if gate is None:
+        with _gates_lock:
+            gate = _gates.get(provider)
+            if gate is None:
+                capacity, bulk_capacity = UPSTREAM_LIMITS.get(provider, (4, 2))
+                gate = _gates[provider] = PriorityGate(provider, int(capacity), bulk_capacity)
+    return gate
+
+def _check_quota(provider, lane_name):
+    quota = _quotas.get(provider)
+    if not quota:
+        return
+    wait = quota.get('blocked_until', 0) - time.time()
+    if wait > 0:
+        raise Overloaded(f"{provider} quota exhausted", wait)
+    remaining, limit = quota.get('remaining'), quota.get('limit')
+    if lane_name == BULK and remaining is not None and limit and remaining < limit * QUOTA_RESERVE:
+        raise Overloaded(f"{provider} quota reserved for interactive use",
+                         max(1, quota.get('reset_at', 0) - time.time()))
+
+@contextmanager
+def upstream(provider):
+    """Hold an upstream slot for provider in the current lane for the duration of the call"""
+    lane_name = current_lane()
+    _check_quota(provider, lane_name)
+    gate = get_gate(provider)
+    gate.acquire(lane_name, LANE_WAIT[lane_name])
+    try:
+        yield
+    finally:
+        gate.release(lane_name)
+
+_DURATION = re.compile(r'(\d+(?:\.\d+)?)(ms|h|m|s)')
+_UNITS = {'h': 3600, 'm': 60, 's': 1, 'ms': 0.001}
+
+def parse_duration(value):
+    """Seconds from '12', '7.66s', '2m59.56s' or '1h2m'; None if unparseable"""
+    if value is None:
+        return None
+    value = str(value).strip()
+    try:
+        return float(value)
+    except ValueError:
+        pass
+    parts = _DURATION.findall(value)
+    if not parts:
+        return None
+    return sum(float(number) * _UNITS[unit] for number, unit in parts)
+
+def record_quota(provider, headers, status_code=200):
+    """Remember the provider's advertised request quota from its response headers"""
+    def header(*names):
+        for name in names:
+            if headers.get(name) is not None:
+                return headers.get(name)
+        return None
+
+    now = time.time()
+    quota = {'updated_at': now}
+    remaining = header('x-ratelimit-remaining-requests', 'x-ratelimit-remaining')
+    limit = header('x-ratelimit-limit-requests', 'x-ratelimit-limit')
+    reset = parse_duration(header('x-ratelimit-reset-requests', 'x-ratelimit-reset'))
+    retry_after = parse_duration(header('retry-after'))
+    try:
+        quota['remaining'] = int(float(remaining)) if remaining is not None else None
+        quota['limit'] = int(float(limit)) if limit is not None else None
+    except ValueError:
+        quota['remaining'] = quota['limit'] = None
+    if reset is not None:
+        quota['reset_at'] = now + reset
+    if status_code == 429:
+        quota['blocked_until'] = now + (retry_after or reset or 5)
+    elif quota['remaining'] == 0 and reset:
+        quota['blocked_until'] = now + reset
+    if len(quota) > 1 or status_code == 429:
+        _quotas[provider] = quota
+
+def check_response(provider, response):
+    """Record quota headers of a requests.Response and turn a provider 429 into Overloaded"""
+    record_quota(provider, response.headers, response.status_code)
+    if response.status_code == 429:
+        retry_after = parse_duration(response.headers.get('retry-after')) or 5
+        raise Overloaded(f"{provider} rate limit reached", retry_after)
+
+# --- Reporting ---
+
+def stats():
+    """Queue depths, rejections and quota state for the admin API"""
+    now = time.time()
+    with _buckets_lock:
+        buckets = {'tracked': len(_buckets), 'rejected': dict(_rejected)}
+    return {
+        'rate_limits': {route: {'per_minute': pm, 'burst': burst} for route, (pm, burst) in RATE_LIMITS.items()},
+        'buckets': buckets,
+        'upstreams': {name: gate.stats() for name, gate in sorted(_gates.items())},
+        'quotas': {name: {
+            'remaining': q.get('remaining'),
+            'limit': q.get('limit'),
+            'resets_in': round(q['reset_at'] - now, 1) if q.get('reset_at') else None,
+            'blocked_for': round(max(0, q.get('blocked_until', 0) - now), 1),
+        } for name, q in sorted(_quotas.items())},
+    }
+
+def reset():
+    """Forget all buckets, gates and quotas (used by tests)"""
+    with _buckets_lock:
+        _buckets.clear()
+        _rejected.clear()
+    with _gates_lock:
+        _gates.clear()
+    _quotas.clear()
+
+def init_app(app):
+    """Answer Overloaded with 429 and Retry-After"""
+    from flask import jsonify
+
+    @app.errorhandler(Overloaded)
+    def overloaded(e):
+        response = jsonify({'error': str(e), 'retry_after': e.retry_after})
+        response.status_code = 429
+        response.headers['Retry-After'] = str(e.retry_after)
+        return response
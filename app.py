@@ -4,40 +4,85 @@ Voice Translator with Groq AI German Tutor
 Uses FREE Groq API for 99% accurate German corrections
 """
 from dotenv import load_dotenv
-from flask import Flask, redirect, url_for
+from flask import Flask
 from flask_login import LoginManager
 import os
+import threading
 import history_db
+import tutor_db
+import profiling
+import admission
 
 # Load environment variables
 load_dotenv()
 
-app = Flask(__name__)
-
-# Security: Load secret key from env or fallback (for dev only)
-app.secret_key = os.getenv('FLASK_SECRET_KEY', 'your-secret-key-here')
-
 # Login Manager Setup
 login_manager = LoginManager()
-login_manager.init_app(app)
 login_manager.login_view = 'auth.login'
 
 @login_manager.user_loader
 def load_user(user_id):
     return history_db.get_user_by_id(user_id)
 
-# Register Blueprints
-from routes.auth import auth_bp
-from routes.main import main_bp
-from routes.api import api_bp
+def create_app(config=None):
+    """
+    Build the Flask app. Heavy audio/TTS libraries are not imported here;
+    routes.api loads them on first use (or in the background if WARM_UP is set).
+    """
+    app = Flask(__name__)
+
+    # Security: Load secret key from env or fallback (for dev only)
+    app.secret_key = os.getenv('FLASK_SECRET_KEY', 'your-secret-key-here')
+    app.config['WARM_UP'] = os.getenv('WARM_UP', '0').lower() in ('1', 'true', 'yes')
+    # Largest body any route accepts: an audio upload plus multipart overhead.
+    # Werkzeug stops reading past this instead of spooling the whole body.
+    import audio_preprocess
+    app.config['MAX_CONTENT_LENGTH'] = audio_preprocess.MAX_AUDIO_BYTES + 64 * 1024
+    if config:
+        app.config.update(config)
+
+    login_manager.init_app(app)
+
+    # Register Blueprints
+    from routes.auth import auth_bp
+    from routes.main import main_bp
+    from routes.api import api_bp, warm_up
+    from routes.stream import stream_bp
+
+    app.register_blueprint(auth_bp)
+    app.register_blueprint(main_bp)
+    app.register_blueprint(api_bp)
+    app.register_blueprint(stream_bp)
+
+    # Rate limits and upstream overload surface as 429 + Retry-After
+    admission.init_app(app)
 
-app.register_blueprint(auth_bp)
-app.register_blueprint(main_bp)
-app.register_blueprint(api_bp)
+    # Admin-armed request profiling; a no-op check per request until armed
+    profiling.init_app(app)
+
+    # Make sure tables exist under WSGI servers too, not only under __main__
+    history_db.init_db()
+    tutor_db.init_db()
+
+    if app.config['WARM_UP']:
+        threading.Thread(target=warm_up, name='warm-up', daemon=True).start()
+
+    return app
+
+_app = None
+
+def __getattr__(name):
+    # Keeps `gunicorn app:app` working without building the app on plain import
+    global _app
+    if name == 'app':
+        if _app is None:
+            _app = create_app()
+        return _app
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
 
 if __name__ == '__main__':
     os.makedirs('templates', exist_ok=True)
-    history_db.init_db()
+    app = create_app()
     
     print("\n" + "="*60)
     print("🌍 Voice Translator with AI German Tutor")
@@ -0,0 +1,120 @@
+"""
+Cheap checks and trimming on 16 kHz mono s16le PCM before recognition
+
+Less audio sent to the recognizer means faster results and no wasted
+requests on clips that only contain silence.
+"""
+import math
+import os
+import sys
+import warnings
+from array import array
+
+try:
+    with warnings.catch_warnings():
+        warnings.simplefilter('ignore', DeprecationWarning)
+        import audioop
+except ImportError:  # removed in Python 3.13
+    audioop = None
+
+MAX_AUDIO_BYTES = int(os.getenv('MAX_AUDIO_BYTES', str(10 * 1024 * 1024)))
+MAX_AUDIO_SECONDS = float(os.getenv('MAX_AUDIO_SECONDS', '60'))
+MAX_SEGMENT_SECONDS = float(os.getenv('MAX_SEGMENT_SECONDS', '15'))
+# Floor for the voice threshold, same scale as Recognizer.energy_threshold
+MIN_ENERGY_THRESHOLD = int(os.getenv('VAD_MIN_ENERGY', '300'))
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+FRAME_MS = 20
+FRAME_BYTES = SAMPLE_RATE * SAMPLE_WIDTH * FRAME_MS // 1000
+
+def _rms(frame):
+    if audioop:
+        return audioop.rms(frame, SAMPLE_WIDTH)
+    samples = array('h', frame[:len(frame) - len(frame) % SAMPLE_WIDTH])
+    if sys.byteorder == 'big':
+        samples.byteswap()
+    if not samples:
+        return 0
+    return int(math.sqrt(sum(s * s for s in samples) / len(samples)))
+
+def frame_energies(pcm):
+    """RMS energy of each FRAME_MS frame"""
+    return [_rms(pcm[i:i + FRAME_BYTES]) for i in range(0, len(pcm), FRAME_BYTES)]
+
+def energy_threshold(energies):
+    """
+    Voice threshold adapted to the clip's noise floor (its quietest 10% of
+    frames), capped at a third of its loud level (90th percentile) so a
+    clip with no silence at all still counts as speech.
+    """
+    if not energies:
+        return MIN_ENERGY_THRESHOLD
+    ordered = sorted(energies)
+    floor = ordered[len(ordered) // 10]
+    loud = ordered[len(ordered) * 9 // 10]
+    return max(MIN_ENERGY_THRESHOLD, min(int(floor * 2.5), loud // 3))
+
+def is_silent(pcm, threshold=MIN_ENERGY_THRESHOLD):
+    return not any(e > threshold for e in frame_energies(pcm))
+
+def trim_silence(pcm, padding_ms=200):
+    """Drop leading and trailing silence, keeping a little padding; b'' if all silent"""
+    energies = frame_energies(pcm)
+    threshold = energy_threshold(energies)
+    voiced = [i for i, e in enumerate(energies) if e > threshold]
+    if not voiced:
+        return b''
+    pad = padding_ms // FRAME_MS
+    start = max(0, voiced[0] - pad) * FRAME_BYTES
+    end = min(len(energies), voiced[-1] + 1 + pad) * FRAME_BYTES
+    return pcm[start:end]
+
+def find_pauses(pcm, min_pause_ms=300):
+    """Return (start, end) byte offsets of silent runs at least min_pause_ms long"""
+    energies = frame_energies(pcm)
+    threshold = energy_threshold(energies)
+    min_frames = max(1, min_pause_ms // FRAME_MS)
+    pauses = []
+    run_start = None
+    for i, energy in enumerate(energies + [threshold + 1]):
+        if energy <= threshold:
+            if run_start is None:
+                run_start = i
+        elif run_start is not None:
+            if i - run_start >= min_frames:
+                pauses.append((run_start * FRAME_BYTES, min(i * FRAME_BYTES, len(pcm))))
+            run_start = None
+    return pauses
+
+def last_pause_offset(pcm, min_pause_ms=300):
+    """Byte offset in the middle of the last pause, or None"""
+    pauses = find_pauses(pcm, min_pause_ms)
+    if not pauses:
+        return None
+    start, end = pauses[-1]
+    middle = (start + end) // 2
+    return middle - middle % SAMPLE_WIDTH
+
+def split_at_pauses(pcm, max_segment_seconds=MAX_SEGMENT_SECONDS, min_pause_ms=300):
+    """
+    Split a recording into segments no longer than max_segment_seconds,
+    cutting in the middle of pauses where possible so no word is split.
+    Silent segments are dropped.
+    """
+    max_bytes = int(max_segment_seconds * SAMPLE_RATE) * SAMPLE_WIDTH
+    threshold = energy_threshold(frame_energies(pcm))
+    cuts = [(start + end) // 2 for start, end in find_pauses(pcm, min_pause_ms)]
+    cuts = [c - c % SAMPLE_WIDTH for c in cuts]
+
+    segments = []
+    position = 0
+    while len(pcm) - position > max_bytes:
+        candidates = [c for c in cuts if position < c <= position + max_bytes]
+        # No pause in reach: hard cut at the limit
+        cut = candidates[-1] if candidates else position + max_bytes
+        segments.append(pcm[position:cut])
+        position = cut
+    segments.append(pcm[position:])
+
+    return [s for s in segments if s and not is_silent(s, threshold)]
@@ -0,0 +1,95 @@
+#!/usr/bin/env python3
+"""
+Login-throughput benchmark
+
+Simulates a class signing in at once: --users accounts log in over
+--threads concurrent clients against one app instance, while a bystander
+keeps fetching a cheap page. Runs once with hashing inline on the request
+threads (PASSWORD_HASH_WORKERS=0) and once with the process pool, each in
+a fresh interpreter, and reports login throughput, login latency and how
+much the burst slows the bystander down.
+
+    python benchmarks/bench_login.py --users 40 --threads 8 --workers 4
+"""
+import argparse
+import json
+import os
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = '''
+import json, os, statistics, sys, threading, time
+from concurrent.futures import ThreadPoolExecutor
+import app, passwords
+users, threads = int(sys.argv[1]), int(sys.argv[2])
+flask_app = app.create_app({"TESTING": True})
+passwords.start_pool()
+import history_db
+for i in range(users):
+    history_db.create_user(f"student{i}", "pw")
+
+def login(i):
+    client = flask_app.test_client()
+    start = time.perf_counter()
+    response = client.post("/login", data={"username": f"student{i}", "password": "pw"})
+    assert response.status_code == 302, response.status_code
+    return time.perf_counter() - start
+
+done = threading.Event()
+bystander = []
+def watch():
+    client = flask_app.test_client()
+    while not done.is_set():
+        start = time.perf_counter()
+        client.get("/login")
+        bystander.append(time.perf_counter() - start)
+        time.sleep(0.005)
+
+watcher = threading.Thread(target=watch)
+watcher.start()
+t0 = time.perf_counter()
+with ThreadPoolExecutor(threads) as pool:
+    latencies = sorted(pool.map(login, range(users)))
+elapsed = time.perf_counter() - t0
+done.set()
+watcher.join()
+bystander.sort()
+pct = lambda values, p: values[min(len(values) - 1, int(len(values) * p))]
+print(json.dumps({
+    "logins_per_s": users / elapsed,
+    "login_p50": pct(latencies, 0.5), "login_p95": pct(latencies, 0.95),
+    "bystander_p50": pct(bystander, 0.5), "bystander_p95": pct(bystander, 0.95),
+}))
+'''
+
+def run_probe(users, threads, workers, method):
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ, PYTHONPATH=ROOT, WARM_UP='0', PASSWORD_HASH_WORKERS=str(workers),
+                   LOGIN_CONCURRENCY=str(threads), LOGIN_WAIT='600')
+        if method:
+            env['PASSWORD_HASH_METHOD'] = method
+        out = subprocess.run([sys.executable, '-c', PROBE, str(users), str(threads)], cwd=workdir, env=env,
+                             capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--users', type=int, default=40)
+    parser.add_argument('--threads', type=int, default=8)
+    parser.add_argument('--workers', type=int, default=min(4, os.cpu_count() or 1))
+    parser.add_argument('--method', default='', help="PASSWORD_HASH_METHOD, e.g. pbkdf2:sha256:600000")
+    args = parser.parse_args()
+
+    print(f"\nLogin benchmark ({args.users} users, {args.threads} concurrent, method {args.method or 'default'})")
+    print("=" * 72)
+    print(f"{'':<18} {'logins/s':>9} {'login p50':>11} {'login p95':>11} {'other p50':>10} {'other p95':>10}")
+    for label, workers in (('inline', 0), (f'pool ({args.workers})', args.workers)):
+        r = run_probe(args.users, args.threads, workers, args.method)
+        print(f"{label:<18} {r['logins_per_s']:9.1f} {r['login_p50'] * 1000:8.0f} ms {r['login_p95'] * 1000:8.0f} ms "
+              f"{r['bystander_p50'] * 1000:7.1f} ms {r['bystander_p95'] * 1000:7.1f} ms")
+
+if __name__ == '__main__':
+    main()
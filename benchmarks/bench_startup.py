@@ -0,0 +1,54 @@
+#!/usr/bin/env python3
+"""
+Startup-time benchmark
+
+Measures, in fresh interpreters, how long a worker takes to import the app
+and build it with create_app(), and how much the lazily loaded audio/TTS
+stack adds when it is finally needed (warm_up()).
+
+    python benchmarks/bench_startup.py --runs 5
+"""
+import argparse
+import json
+import os
+import statistics
+import subprocess
+import sys
+import tempfile
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+
+PROBE = '''
+import json, sys, time
+t0 = time.perf_counter()
+import app
+flask_app = app.create_app()
+t1 = time.perf_counter()
+from routes.api import warm_up
+warm_up()
+t2 = time.perf_counter()
+print(json.dumps({"create_app": t1 - t0, "warm_up": t2 - t1}))
+'''
+
+def run_probe():
+    with tempfile.TemporaryDirectory() as workdir:
+        env = dict(os.environ, PYTHONPATH=ROOT, WARM_UP='0')
+        out = subprocess.run([sys.executable, '-c', PROBE], cwd=workdir, env=env,
+                             capture_output=True, text=True, check=True)
+    return json.loads(out.stdout.strip().splitlines()[-1])
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--runs', type=int, default=5)
+    args = parser.parse_args()
+
+    results = [run_probe() for _ in range(args.runs)]
+
+    print(f"\nStartup benchmark ({args.runs} runs, median)")
+    print("=" * 44)
+    for key, label in (('create_app', 'import app + create_app()'), ('warm_up', 'lazy audio/TTS stack')):
+        values = [r[key] * 1000 for r in results]
+        print(f"{label:<28} {statistics.median(values):8.1f} ms  (min {min(values):.1f})")
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,541 @@
+#!/usr/bin/env python3
+"""
+Soak test with resource-leak detection
+
+Starts the app in a child process, wired to local stand-ins for every
+external API: Groq and JigsawStack are served by a small HTTP server in
+this process (GROQ_URL, JIGSAWSTACK_URL), and speech uses TTS_BACKEND=local
+and STT_BACKEND=local. --learners simulated learners register, log in, and
+then loop until --duration is up. Each round is one of:
+- a multi-turn tutor session that plays every reply's audio_url;
+- a translation followed by TTS playback of the result;
+- a voice upload streamed as PCM over the WebSocket, plus /api/transcribe
+  when ffmpeg is installed.
+
+Translate and chat calls carry an Idempotency-Key. A connection error is
+retried with the same key, and a --retry-rate share of the calls is sent
+twice to check that the second answer is a replay.
+
+Every --interval seconds the child process is sampled for RSS, open file
+descriptors and threads. Each sample also records the size of its TMPDIR
+and TTS cache, how long it takes to get the SQLite write lock on each
+database, and the p95 latency per action in that window. The first sample
+after --warmup is the baseline. The run exits with status 1 if, by the
+end, any growth, the lock wait, the latency drift or the error rate is
+past its threshold, or if the app died. 429s are honoured (Retry-After)
+and counted as throttled, not as errors.
+
+    python benchmarks/soak.py --learners 50 --duration 2h --report soak.json
+
+Resource sampling reads /proc, so it needs Linux.
+"""
+import argparse
+import glob
+import json
+import os
+import random
+import shutil
+import sqlite3
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+
+ROOT = os.path.dirname(os.path.dirname(os.path.abspath(__file__)))
+sys.path.insert(0, ROOT)
+
+from admission import parse_duration  # noqa: E402
+
+APP = '''
+import sys
+from werkzeug.serving import make_server
+import app
+server = make_server("127.0.0.1", 0, app.create_app(), threaded=True)
+with open("port", "w") as f:
+    f.write(str(server.server_port))
+server.serve_forever()
+'''
+
+PHRASES = [
+    "Good morning, how are you?", "Where is the train station?", "I would like a coffee, please.",
+    "How much does this cost?", "My name is Sam and I am a student.", "Can you help me?",
+    "I am learning German.", "What time is it?", "The weather is nice today.", "See you tomorrow!",
+]
+STUDENT_LINES = [
+    "Hallo! Wie geht es dir?", "Ich habe gestern ins Kino gegangen.", "Ich möchte ein Brot kaufen.",
+    "Wo ist der Bahnhof?", "Mein Hobby ist Fußball spielen.", "Ich bin müde heute.",
+]
+TUTOR_REPLIES = [
+    {"german_response": "Sehr gut! Was hast du heute noch vor?",
+     "english_translation": "Very good! What else are you doing today?", "has_error": False, "correction": None},
+    {"german_response": "Fast richtig. Man sagt: Ich bin gestern ins Kino gegangen. Welchen Film hast du gesehen?",
+     "english_translation": "Almost. One says: I went to the cinema yesterday. Which film did you see?",
+     "has_error": True, "correction": "Verb: gehen takes sein in the Perfekt"},
+    {"german_response": "Das klingt toll! Erzähl mir mehr darüber.",
+     "english_translation": "That sounds great! Tell me more about it.", "has_error": False, "correction": None},
+]
+ACTIONS = ['tutor', 'translate', 'voice']
+WEIGHTS = [3, 4, 2]
+
+# --- Provider stand-ins ---
+
+class StandInHandler(BaseHTTPRequestHandler):
+    """Answers like Groq chat completions and JigsawStack translate, after a simulated delay"""
+    protocol_version = 'HTTP/1.1'
+
+    def do_POST(self):
+        body = json.loads(self.rfile.read(int(self.headers.get('Content-Length') or 0)) or b'{}')
+        time.sleep(self.server.latency * random.uniform(0.5, 1.5))
+        if self.path.endswith('/chat/completions'):
+            payload = {'choices': [{'message': {'content': json.dumps(random.choice(TUTOR_REPLIES))}}]}
+        elif self.path.endswith('/translate'):
+            payload = {'translated_text': f"[{body.get('target_language')}] {body.get('text', '')}"}
+        else:
+            self.send_error(404)
+            return
+        data = json.dumps(payload).encode('utf-8')
+        self.send_response(200)
+        self.send_header('Content-Type', 'application/json')
+        self.send_header('Content-Length', str(len(data)))
+        self.send_header('x-ratelimit-limit-requests', '1000000')
+        self.send_header('x-ratelimit-remaining-requests', '999999')
+        self.send_header('x-ratelimit-reset-requests', '60s')
+        self.end_headers()
+        self.wfile.write(data)
+
+    def log_message(self, format, *args):
+        pass
+
+def start_stand_ins(latency):
+    server = ThreadingHTTPServer(('127.0.0.1', 0), StandInHandler)
+    server.daemon_threads = True
+    server.latency = latency
+    threading.Thread(target=server.serve_forever, name='stand-ins', daemon=True).start()
+    return server
+
+# --- App under test ---
+
+def start_app(workdir, provider_url, env_overrides):
+    tmpdir = os.path.join(workdir, 'tmp')
+    os.makedirs(tmpdir)
+    env = dict(os.environ, PYTHONPATH=ROOT, TMPDIR=tmpdir,
+               TTS_BACKEND='local', STT_BACKEND='local', TTS_CACHE_DIR=os.path.join(workdir, 'tts_cache'),
+               GROQ_API_KEY='soak', GROQ_URL=f"{provider_url}/openai/v1/chat/completions",
+               JIGSAWSTACK_API_KEY='soak', JIGSAWSTACK_URL=f"{provider_url}/api/v1/ai/translate",
+               FLASK_SECRET_KEY='soak', WARM_UP='1', **env_overrides)
+    log = open(os.path.join(workdir, 'app.log'), 'w')
+    proc = subprocess.Popen([sys.executable, '-c', APP], cwd=workdir, env=env, stdout=log, stderr=subprocess.STDOUT)
+    port_file = os.path.join(workdir, 'port')
+    deadline = time.monotonic() + 60
+    while not os.path.exists(port_file) or not open(port_file).read():
+        if proc.poll() is not None or time.monotonic() > deadline:
+            raise SystemExit(f"❌ App did not start, see {log.name}")
+        time.sleep(0.1)
+    return proc, int(open(port_file).read()), log
+
+# --- Learners ---
+
+class Recorder:
+    """Latencies and outcomes per action for the current sampling window"""
+
+    def __init__(self):
+        self._lock = threading.Lock()
+        self._window = {}
+        self.totals = {'ok': 0, 'errors': 0, 'throttled': 0}
+        self.last_errors = []
+
+    def record(self, action, seconds, outcome, detail=None):
+        with self._lock:
+            if outcome == 'ok':
+                self._window.setdefault(action, []).append(seconds)
+            self.totals[outcome] += 1
+            if outcome == 'errors':
+                self.last_errors = (self.last_errors + [f"{action}: {detail}"])[-5:]
+
+    def take_window(self):
+        with self._lock:
+            window, self._window = self._window, {}
+        return window
+
+class Throttled(Exception):
+    def __init__(self, retry_after):
+        self.retry_after = retry_after
+
+class Learner(threading.Thread):
+
+    def __init__(self, index, base_url, recorder, stop, think, start_delay, transcribe_upload, retry_rate):
+        super().__init__(name=f'learner-{index}', daemon=True)
+        import requests
+        self.requests = requests
+        self.index = index
+        self.base_url = base_url
+        self.recorder = recorder
+        self.stop = stop
+        self.think = think
+        self.start_delay = start_delay
+        self.transcribe_upload = transcribe_upload
+        self.retry_rate = retry_rate
+        self.rng = random.Random(index)
+        self.http = requests.Session()
+
+    def pause(self, scale=1.0):
+        self.stop.wait(self.rng.uniform(0.5, 1.5) * self.think * scale)
+
+    def call(self, method, path, expect=200, **kwargs):
+        """One HTTP call; raises Throttled on 429 and RuntimeError on any other unexpected status"""
+        kwargs.setdefault('timeout', 60)
+        response = self.http.request(method, self.base_url + path, **kwargs)
+        if response.status_code == 429:
+            raise Throttled(float(response.headers.get('Retry-After', 1)))
+        if response.status_code != expect:
+            raise RuntimeError(f"{method} {path} -> {response.status_code} {response.text[:120]!r}")
+        return response
+
+    def timed(self, action, fn, *args):
+        start = time.perf_counter()
+        try:
+            result = fn(*args)
+        except Throttled as e:
+            self.recorder.record(action, 0, 'throttled')
+            self.stop.wait(e.retry_after)
+            return None
+        except Exception as e:
+            self.recorder.record(action, 0, 'errors', e)
+            self.pause()
+            return None
+        self.recorder.record(action, time.perf_counter() - start, 'ok')
+        return result
+
+    def sign_in(self):
+        form = {'username': f'learner{self.index}', 'password': 'soak-password'}
+        self.call('POST', '/register', data=dict(form, confirm_password=form['password']), allow_redirects=False,
+                  expect=302)
+        self.call('POST', '/login', data=form, allow_redirects=False, expect=302)
+
+    def post_json(self, path, body, attempts=3):
+        """POST with an Idempotency-Key, retried with the same key on connection errors"""
+        headers = {'Idempotency-Key': uuid.uuid4().hex}
+        for attempt in range(attempts):
+            try:
+                response = self.call('POST', path, json=body, headers=headers)
+                break
+            except (self.requests.ConnectionError, self.requests.Timeout):
+                if attempt == attempts - 1:
+                    raise
+                self.pause(0.5)
+        if self.rng.random() < self.retry_rate:
+            # A client that never saw the answer and sends it again: must be a replay
+            again = self.call('POST', path, json=body, headers=headers)
+            if again.headers.get('Idempotent-Replayed') != 'true' or again.content != response.content:
+                raise RuntimeError(f"POST {path}: retry with the same Idempotency-Key was not replayed")
+        return response.json()
+
+    def tutor_turn(self, session_id):
+        reply = self.post_json('/api/tutor/chat', {'message': self.rng.choice(STUDENT_LINES), 'session_id': session_id})
+        self.call('GET', reply['audio_url']).content
+        return reply
+
+    def tutor_session(self):
+        session_id = self.timed('tutor_init', lambda: self.call('POST', '/api/tutor/init', json={}).json()['session_id'])
+        for _ in range(self.rng.randint(2, 5)):
+            if session_id is None or self.stop.is_set():
+                return
+            self.timed('tutor_chat', self.tutor_turn, session_id)
+            self.pause()
+
+    def translate_and_listen(self):
+        text = self.rng.choice(PHRASES)
+        if self.rng.random() < 0.3:
+            text = f"{text} ({self.rng.randint(1, 10 ** 6)})"  # a cache miss
+        result = self.timed('translate', self.post_json, '/api/translate', {'text': text, 'target_lang': 'de'})
+        if result:
+            self.timed('tts', self.listen, result['translation'])
+
+    def listen(self, text):
+        """What the UI's play button does: register the text, then stream it by id"""
+        url = self.call('POST', '/api/text-to-speech/stream', json={'text': text, 'lang': 'de'}).json()['audio_url']
+        return self.call('GET', url).content
+
+    def stream_voice(self, pcm):
+        import simple_websocket
+        url = self.base_url.replace('http://', 'ws://') + '/api/transcribe/stream?format=pcm16&lang=de'
+        cookie = '; '.join(f"{c.name}={c.value}" for c in self.http.cookies)
+        ws = simple_websocket.Client.connect(url, headers={'Cookie': cookie})
+        try:
+            for offset in range(0, len(pcm), 16000):
+                ws.send(pcm[offset:offset + 16000])
+            ws.send('end')
+            while True:
+                event = json.loads(ws.receive(timeout=60))
+                if event['type'] == 'final':
+                    return event['text']
+                if event['type'] == 'error':
+                    if 'retry_after' in event:
+                        raise Throttled(event['retry_after'])
+                    raise RuntimeError(event['error'])
+        finally:
+            ws.close()
+
+    def upload_voice(self, wav):
+        files = {'audio': ('clip.wav', wav, 'audio/wav')}
+        return self.call('POST', '/api/transcribe', files=files, data={'source_lang': 'de'}).json()
+
+    def voice(self):
+        seconds = self.rng.uniform(1, 4)
+        pcm = speech_like_pcm(seconds, self.rng)
+        self.timed('voice_stream', self.stream_voice, pcm)
+        if self.transcribe_upload:
+            self.timed('voice_upload', self.upload_voice, wav_bytes(pcm))
+
+    def run(self):
+        if self.stop.wait(self.start_delay):
+            return
+        while not self.stop.is_set():
+            try:
+                self.sign_in()
+                break
+            except Throttled as e:
+                self.stop.wait(e.retry_after)
+            except Exception as e:
+                self.recorder.record('sign_in', 0, 'errors', e)
+                self.pause(5)
+        rounds = {'tutor': self.tutor_session, 'translate': self.translate_and_listen, 'voice': self.voice}
+        while not self.stop.is_set():
+            rounds[self.rng.choices(ACTIONS, WEIGHTS)[0]]()
+            self.pause()
+
+def speech_like_pcm(seconds, rng):
+    """16 kHz s16le: bursts of noise loud enough to count as speech, with short pauses"""
+    frames = bytearray()
+    for i in range(int(seconds * 4)):
+        loud = i % 4 != 3
+        amplitude = 6000 if loud else 0
+        for _ in range(4000):
+            frames += int(rng.uniform(-amplitude, amplitude)).to_bytes(2, 'little', signed=True)
+    return bytes(frames)
+
+def wav_bytes(pcm):
+    import io
+    import wave
+    buffer = io.BytesIO()
+    with wave.open(buffer, 'wb') as wav:
+        wav.setnchannels(1)
+        wav.setsampwidth(2)
+        wav.setframerate(16000)
+        wav.writeframes(pcm)
+    return buffer.getvalue()
+
+# --- Sampling ---
+
+def proc_status(pid):
+    values = {}
+    with open(f'/proc/{pid}/status') as f:
+        for line in f:
+            key, _, value = line.partition(':')
+            if key in ('VmRSS', 'Threads'):
+                values[key] = int(value.split()[0])
+    return values['VmRSS'] / 1024, values['Threads']
+
+def dir_usage(path):
+    files = size = 0
+    for dirpath, _, names in os.walk(path):
+        for name in names:
+            try:
+                size += os.path.getsize(os.path.join(dirpath, name))
+                files += 1
+            except FileNotFoundError:
+                pass
+    return files, size / (1024 * 1024)
+
+def lock_wait(workdir, timeout):
+    """Longest time, over the app's databases, to take the SQLite write lock (timeout if it never came)"""
+    worst = 0.0
+    for path in glob.glob(os.path.join(workdir, '*.db')):
+        conn = sqlite3.connect(path, timeout=timeout, isolation_level=None)
+        start = time.perf_counter()
+        try:
+            conn.execute('BEGIN IMMEDIATE')
+            conn.execute('ROLLBACK')
+            worst = max(worst, time.perf_counter() - start)
+        except sqlite3.OperationalError:
+            worst = max(worst, timeout)
+        finally:
+            conn.close()
+    return worst
+
+def percentile(values, p):
+    values = sorted(values)
+    return values[min(len(values) - 1, int(len(values) * p))] if values else None
+
+def take_sample(proc, workdir, recorder, started, lock_timeout):
+    rss, threads = proc_status(proc.pid)
+    tmp_files, tmp_mb = dir_usage(os.path.join(workdir, 'tmp'))
+    _, tts_mb = dir_usage(os.path.join(workdir, 'tts_cache'))
+    window = recorder.take_window()
+    return {
+        'elapsed': round(time.monotonic() - started, 1),
+        'rss_mb': round(rss, 1),
+        'fds': len(os.listdir(f'/proc/{proc.pid}/fd')),
+        'threads': threads,
+        'tmp_files': tmp_files,
+        'tmp_mb': round(tmp_mb, 2),
+        'tts_cache_mb': round(tts_mb, 2),
+        'lock_wait_ms': round(lock_wait(workdir, lock_timeout) * 1000, 1),
+        'p95_ms': {action: round(percentile(times, 0.95) * 1000, 1) for action, times in sorted(window.items())},
+        'requests': sum(len(times) for times in window.values()),
+        **recorder.totals,
+    }
+
+# --- Verdict ---
+
+def evaluate(samples, args):
+    """Return (name, observed, limit) for every threshold that was crossed"""
+    if len(samples) < 2:
+        return [('samples', len(samples), 'at least 2 after warm-up')]
+    base, tail = samples[0], samples[-3:]
+    # A leak stays high, so judge growth by the lowest of the last few samples
+    low = {key: min(s[key] for s in tail) for key in ('rss_mb', 'fds', 'threads', 'tmp_mb', 'tmp_files')}
+    breaches = []
+
+    def check(name, observed, limit):
+        if observed > limit:
+            breaches.append((name, round(observed, 2), limit))
+
+    check('rss growth (MB)', low['rss_mb'] - base['rss_mb'], args.max_rss_growth)
+    check('open fd growth', low['fds'] - base['fds'], args.max_fd_growth)
+    check('thread growth', low['threads'] - base['threads'], args.max_thread_growth)
+    check('temp dir growth (MB)', low['tmp_mb'] - base['tmp_mb'], args.max_tmp_growth)
+    check('temp file growth', low['tmp_files'] - base['tmp_files'], args.max_tmp_files)
+    check('TTS cache (MB)', max(s['tts_cache_mb'] for s in samples), args.tts_cache_mb * 1.5)
+    check('SQLite lock wait p95 (ms)', percentile([s['lock_wait_ms'] for s in samples], 0.95), args.max_lock_wait)
+
+    head = samples[:3]
+    for action in sorted({a for s in samples for a in s['p95_ms']}):
+        before = [s['p95_ms'][action] for s in head if action in s['p95_ms']]
+        after = [s['p95_ms'][action] for s in tail if action in s['p95_ms']]
+        if before and after:
+            before, after = statistics.median(before), statistics.median(after)
+            # Ignore drift within a few milliseconds; it is noise, not a trend
+            if after - before > 50:
+                check(f'{action} p95 drift (x)', after / max(before, 1), args.max_latency_drift)
+
+    last = samples[-1]
+    done = last['ok'] + last['errors'] - (base['ok'] + base['errors'])
+    if done:
+        check('error rate', (last['errors'] - base['errors']) / done, args.max_error_rate)
+    return breaches
+
+def print_sample(sample):
+    p95 = ' '.join(f"{action}={ms:.0f}" for action, ms in sample['p95_ms'].items())
+    print(f"[{sample['elapsed']:>7.0f}s] rss {sample['rss_mb']:7.1f} MB  fds {sample['fds']:4}  "
+          f"threads {sample['threads']:3}  tmp {sample['tmp_files']:3} files/{sample['tmp_mb']:.1f} MB  "
+          f"lock {sample['lock_wait_ms']:6.1f} ms  reqs {sample['requests']:5}  "
+          f"err {sample['errors']}  429 {sample['throttled']}  p95 ms: {p95}")
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__, formatter_class=argparse.RawDescriptionHelpFormatter)
+    parser.add_argument('--learners', type=int, default=20)
+    parser.add_argument('--duration', default='10m', help="e.g. 600, 45m or 2h")
+    parser.add_argument('--warmup', default='60s', help="ignored for thresholds; the next sample is the baseline")
+    parser.add_argument('--interval', default='30s', help="seconds between samples")
+    parser.add_argument('--ramp', type=float, default=10, help="seconds over which learners join")
+    parser.add_argument('--think', type=float, default=2.0, help="mean seconds a learner pauses between steps")
+    parser.add_argument('--retry-rate', type=float, default=0.05,
+                        help="share of translate/chat calls a learner repeats with the same Idempotency-Key")
+    parser.add_argument('--provider-latency', type=float, default=0.2, help="mean stand-in response time")
+    parser.add_argument('--tts-cache-mb', type=int, default=64, help="TTS_CACHE_MAX_MB for the app")
+    parser.add_argument('--env', action='append', default=[], metavar='NAME=VALUE',
+                        help="extra environment for the app, e.g. CACHE_BACKEND=sqlite")
+    parser.add_argument('--max-rss-growth', type=float, default=150, help="MB")
+    parser.add_argument('--max-fd-growth', type=int, default=50)
+    parser.add_argument('--max-thread-growth', type=int, default=50)
+    parser.add_argument('--max-tmp-growth', type=float, default=50, help="MB")
+    parser.add_argument('--max-tmp-files', type=int, default=100)
+    parser.add_argument('--max-lock-wait', type=float, default=1000, help="ms, p95 over all samples")
+    parser.add_argument('--max-latency-drift', type=float, default=2.0, help="end vs start p95 ratio")
+    parser.add_argument('--max-error-rate', type=float, default=0.01)
+    parser.add_argument('--report', help="write all samples and the verdict to this JSON file")
+    parser.add_argument('--keep', action='store_true', help="keep the app's working directory")
+    args = parser.parse_args()
+
+    if not os.path.isdir('/proc/self/fd'):
+        raise SystemExit("❌ The soak test samples /proc and needs Linux")
+    duration, warmup, interval = (parse_duration(v) for v in (args.duration, args.warmup, args.interval))
+    env_overrides = dict(item.split('=', 1) for item in args.env)
+    env_overrides.setdefault('TTS_CACHE_MAX_MB', str(args.tts_cache_mb))
+
+    workdir = tempfile.mkdtemp(prefix='soak-')
+    stand_ins = start_stand_ins(args.provider_latency)
+    provider_url = f"http://127.0.0.1:{stand_ins.server_port}"
+    proc, port, log = start_app(workdir, provider_url, env_overrides)
+    base_url = f"http://127.0.0.1:{port}"
+    transcribe_upload = shutil.which('ffmpeg') is not None
+    print(f"🧪 Soak: {args.learners} learners for {args.duration} against {base_url} (workdir {workdir})")
+    if not transcribe_upload:
+        print("   ffmpeg not found: voice is streamed as PCM only, /api/transcribe is skipped")
+
+    recorder = Recorder()
+    stop = threading.Event()
+    learners = [Learner(i, base_url, recorder, stop, args.think, args.ramp * i / max(1, args.learners),
+                        transcribe_upload, args.retry_rate) for i in range(args.learners)]
+    for learner in learners:
+        learner.start()
+
+    started = time.monotonic()
+    samples = []
+    died = False
+    try:
+        while time.monotonic() - started < duration:
+            stop.wait(min(interval, max(0, duration - (time.monotonic() - started))))
+            if proc.poll() is not None:
+                died = True
+                break
+            sample = take_sample(proc, workdir, recorder, started, lock_timeout=5)
+            print_sample(sample)
+            if sample['elapsed'] >= warmup:
+                samples.append(sample)
+    except KeyboardInterrupt:
+        print("\n⏹️  Interrupted, judging what was collected")
+    finally:
+        stop.set()
+        for learner in learners:
+            learner.join(timeout=10)
+        if proc.poll() is None:
+            proc.terminate()
+            proc.wait(timeout=10)
+        log.close()
+        stand_ins.shutdown()
+
+    breaches = evaluate(samples, args)
+    if died:
+        breaches.insert(0, ('app exited', proc.returncode, 'running'))
+    if recorder.last_errors:
+        print("\nLast errors:")
+        for error in recorder.last_errors:
+            print(f"   {error}")
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({'args': vars(args), 'samples': samples,
+                       'breaches': [{'check': n, 'observed': o, 'limit': l} for n, o, l in breaches]}, f, indent=2)
+        print(f"\n📄 Report written to {args.report}")
+
+    if breaches:
+        print("\n❌ Soak test failed:")
+        for name, observed, limit in breaches:
+            print(f"   {name}: {observed} (limit {limit})")
+    else:
+        print(f"\n✅ Soak test passed: {len(samples)} samples, no threshold crossed")
+
+    if args.keep or breaches:
+        print(f"   App working directory (databases, app.log): {workdir}")
+    else:
+        shutil.rmtree(workdir, ignore_errors=True)
+    sys.exit(1 if breaches else 0)
+
+if __name__ == '__main__':
+    main()
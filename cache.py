@@ -0,0 +1,308 @@
+"""
+Pluggable caches for translations, TTS metadata, users and tutor profiles
+
+Two backends share one interface:
+- "memory": an in-process LRU, fastest but private to each worker
+- "sqlite": a single SQLite file shared by every worker on the box, so a
+  value computed by one gunicorn worker is a hit for all of them
+
+Pick one with CACHE_BACKEND=memory|sqlite (and CACHE_PATH for the file).
+Values must be JSON-serializable; both backends hand out copies.
+"""
+import hashlib
+import json
+import os
+import sqlite3
+import threading
+import time
+from collections import OrderedDict
+
+CACHE_BACKEND = os.getenv('CACHE_BACKEND', 'memory')
+CACHE_PATH = os.getenv('CACHE_PATH', 'cache.db')
+
+def make_key(*parts):
+    """Stable fixed-length key for arbitrary (possibly long) text parts"""
+    raw = '\x1f'.join(str(p) for p in parts)
+    return hashlib.sha256(raw.encode('utf-8')).hexdigest()
+
+class CacheBackend:
+    """Common interface and hit/miss accounting"""
+    backend = 'base'
+
+    def __init__(self, namespace, max_entries=1024, default_ttl=None):
+        self.namespace = namespace
+        self.max_entries = max_entries
+        self.default_ttl = default_ttl
+        self.hits = 0
+        self.misses = 0
+        self._stats_lock = threading.Lock()
+
+    def _record(self, hit):
+        with self._stats_lock:
+            if hit:
+                self.hits += 1
+            else:
+                self.misses += 1
+
+    def _expires_at(self, ttl):
+        ttl = self.default_ttl if ttl is None else ttl
+        return time.time() + ttl if ttl else None
+
+    def get(self, key, default=None):
+        raise NotImplementedError
+
+    def set(self, key, value, ttl=None):
+        raise NotImplementedError
+
+    def add(self, key, value, ttl=None):
+        """Store value only if key is absent; return True if it was stored"""
+        raise NotImplementedError
+
+    def delete(self, key):
+        raise NotImplementedError
+
+    def size(self):
+        raise NotImplementedError
+
+    def stats(self):
+        total = self.hits + self.misses
+        return {
+            'namespace': self.namespace,
+            'backend': self.backend,
+            'hits': self.hits,
+            'misses': self.misses,
+            'hit_rate': round(self.hits / total, 3) if total else None,
+            'size': self.size(),
+        }
+
+class LRUCache(CacheBackend):
+    """In-process LRU with optional TTL"""
+    backend = 'memory'
+
+    def __init__(self, namespace, max_entries=1024, default_ttl=None):
+        super().__init__(namespace, max_entries, default_ttl)
+        self._data = OrderedDict()
+        self._lock = threading.Lock()
+
+    def get(self, key, default=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and entry[0] is not None and entry[0] < time.time():
+                del self._data[key]
+                entry = None
+            if entry is not None:
+                self._data.move_to_end(key)
+        self._record(entry is not None)
+        return json.loads(entry[1]) if entry is not None else default
+
+    def _store(self, key, value, ttl):
+        self._data[key] = (self._expires_at(ttl), json.dumps(value))
+        self._data.move_to_end(key)
+        while len(self._data) > self.max_entries:
+            self._data.popitem(last=False)
+
+    def set(self, key, value, ttl=None):
+        with self._lock:
+            self._store(key, value, ttl)
+
+    def add(self, key, value, ttl=None):
+        with self._lock:
+            entry = self._data.get(key)
+            if entry is not None and (entry[0] is None or entry[0] >= time.time()):
+                return False
+            self._store(key, value, ttl)
+            return True
+
+    def delete(self, key):
+        with self._lock:
+            self._data.pop(key, None)
+
+    def size(self):
+        return len(self._data)
+
+class SQLiteCache(CacheBackend):
+    """
+    Cross-process cache in one SQLite file (WAL, memory-mapped reads).
+
+    Each write is a single atomic statement. Recency is refreshed at most
+    once per ACCESS_RESOLUTION seconds per entry so reads rarely write, and
+    eviction of expired / least-recently-used rows runs every EVICT_EVERY
+    writes. Hit counters are flushed to the file periodically so stats()
+    can report the hit rate across all workers.
+    """
+    backend = 'sqlite'
+    ACCESS_RESOLUTION = 60
+    EVICT_EVERY = 64
+    STATS_FLUSH_SECONDS = 5
+
+    def __init__(self, namespace, path=None, max_entries=10000, default_ttl=None):
+        super().__init__(namespace, max_entries, default_ttl)
+        self.path = path or CACHE_PATH
+        self._local = threading.local()
+        self._writes = 0
+        self._pending = [0, 0]  # hits, misses not yet flushed
+        self._last_flush = time.time()
+        self._init_schema()
+
+    def _conn(self):
+        conn = getattr(self._local, 'conn', None)
+        if conn is None:
+            conn = sqlite3.connect(self.path, timeout=10, isolation_level=None, check_same_thread=False)
+            conn.execute('PRAGMA journal_mode = WAL')
+            conn.execute('PRAGMA synchronous = NORMAL')
+            conn.execute('PRAGMA mmap_size = 67108864')
+            self._local.conn = conn
+        return conn
+
+    def _init_schema(self):
+        conn = self._conn()
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache_entries (
+                namespace TEXT NOT NULL,
+                key TEXT NOT NULL,
+                value TEXT NOT NULL,
+                expires_at REAL,
+                accessed_at REAL NOT NULL,
+                PRIMARY KEY (namespace, key)
+            )
+        ''')
+        conn.execute('CREATE INDEX IF NOT EXISTS idx_cache_lru ON cache_entries (namespace, accessed_at)')
+        conn.execute('''
+            CREATE TABLE IF NOT EXISTS cache_stats (
+                namespace TEXT PRIMARY KEY,
+                hits INTEGER NOT NULL DEFAULT 0,
+                misses INTEGER NOT NULL DEFAULT 0
+            )
+        ''')
+
+    def _record(self, hit):
+        super()._record(hit)
+        with self._stats_lock:
+            self._pending[0 if hit else 1] += 1
+            due = time.time() - self._last_flush >= self.STATS_FLUSH_SECONDS
+        if due:
+            self.flush_stats()
+
+    def flush_stats(self):
+        with self._stats_lock:
+            hits, misses = self._pending
+            self._pending = [0, 0]
+            self._last_flush = time.time()
+        if hits or misses:
+            self._conn().execute('''
+                INSERT INTO cache_stats (namespace, hits, misses) VALUES (?, ?, ?)
+                ON CONFLICT(namespace) DO UPDATE SET hits = hits + excluded.hits, misses = misses + excluded.misses
+            ''', (self.namespace, hits, misses))
+
+    def get(self, key, default=None):
+        conn = self._conn()
+        now = time.time()
+        row = conn.execute(
+            'SELECT value, expires_at, accessed_at FROM cache_entries WHERE namespace = ? AND key = ?',
+            (self.namespace, key)
+        ).fetchone()
+        if row is None or (row[1] is not None and row[1] < now):
+            self._record(False)
+            return default
+        if now - row[2] > self.ACCESS_RESOLUTION:
+            conn.execute('UPDATE cache_entries SET accessed_at = ? WHERE namespace = ? AND key = ?',
+                         (now, self.namespace, key))
+        self._record(True)
+        return json.loads(row[0])
+
+    def set(self, key, value, ttl=None):
+        self._conn().execute('''
+            INSERT OR REPLACE INTO cache_entries (namespace, key, value, expires_at, accessed_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (self.namespace, key, json.dumps(value), self._expires_at(ttl), time.time()))
+        self._after_write()
+
+    def add(self, key, value, ttl=None):
+        now = time.time()
+        conn = self._conn()
+        # Drop an expired holder first so the INSERT below can claim the key
+        conn.execute('DELETE FROM cache_entries WHERE namespace = ? AND key = ? AND expires_at < ?',
+                     (self.namespace, key, now))
+        cursor = conn.execute('''
+            INSERT OR IGNORE INTO cache_entries (namespace, key, value, expires_at, accessed_at)
+            VALUES (?, ?, ?, ?, ?)
+        ''', (self.namespace, key, json.dumps(value), self._expires_at(ttl), now))
+        if cursor.rowcount:
+            self._after_write()
+        return cursor.rowcount == 1
+
+    def delete(self, key):
+        self._conn().execute('DELETE FROM cache_entries WHERE namespace = ? AND key = ?', (self.namespace, key))
+
+    def _after_write(self):
+        with self._stats_lock:
+            self._writes += 1
+            due = self._writes % self.EVICT_EVERY == 0
+        if due:
+            self.evict()
+
+    def evict(self):
+        conn = self._conn()
+        conn.execute('DELETE FROM cache_entries WHERE namespace = ? AND expires_at < ?',
+                     (self.namespace, time.time()))
+        overflow = self.size() - self.max_entries
+        if overflow > 0:
+            conn.execute('''
+                DELETE FROM cache_entries WHERE namespace = ? AND key IN (
+                    SELECT key FROM cache_entries WHERE namespace = ? ORDER BY accessed_at LIMIT ?
+                )
+            ''', (self.namespace, self.namespace, overflow))
+
+    def size(self):
+        return self._conn().execute('SELECT COUNT(*) FROM cache_entries WHERE namespace = ?',
+                                    (self.namespace,)).fetchone()[0]
+
+    def stats(self):
+        self.flush_stats()
+        result = super().stats()
+        row = self._conn().execute('SELECT hits, misses FROM cache_stats WHERE namespace = ?',
+                                   (self.namespace,)).fetchone()
+        hits, misses = row if row else (0, 0)
+        result['shared_hits'] = hits
+        result['shared_misses'] = misses
+        result['shared_hit_rate'] = round(hits / (hits + misses), 3) if hits + misses else None
+        return result
+
+BACKENDS = {
+    'memory': LRUCache,
+    'sqlite': SQLiteCache,
+}
+
+# Per-namespace sizing: (max_entries, default_ttl in seconds)
+NAMESPACES = {
+    'translations': (10000, 30 * 24 * 3600),
+    'tts': (5000, 30 * 24 * 3600),
+    'users': (2000, 300),
+    'tutor_profiles': (2000, 300),
+    'idempotency': (5000, 600),
+    'speech': (5000, 3600),
+}
+
+_caches = {}
+_caches_lock = threading.Lock()
+
+def get_cache(namespace):
+    """Return the process-wide cache for a namespace, creating it on first use"""
+    cache = _caches.get(namespace)
+    if cache is None:
+        with _caches_lock:
+            cache = _caches.get(namespace)
+            if cache is None:
+                max_entries, ttl = NAMESPACES.get(namespace, (1024, None))
+                backend = BACKENDS.get(CACHE_BACKEND, LRUCache)
+                cache = backend(namespace, max_entries=max_entries, default_ttl=ttl)
+                _caches[namespace] = cache
+    return cache
+
+def all_stats():
+    return [cache.stats() for _, cache in sorted(_caches.items())]
+
+def reset_caches():
+    """Forget every cache instance (used by tests and when reconfiguring)"""
+    with _caches_lock:
+        _caches.clear()
@@ -0,0 +1,31 @@
+import gzip
+
+try:
+    import brotli
+except ImportError:  # optional: pip install brotli
+    brotli = None
+
+MIN_COMPRESS_BYTES = 1024
+COMPRESSIBLE_TYPES = ('application/json', 'text/')
+
+def compress_response(response, request):
+    """Compress a buffered JSON/text response with brotli or gzip if the client accepts it"""
+    if (response.direct_passthrough or response.is_streamed
+            or response.status_code != 200
+            or 'Content-Encoding' in response.headers
+            or not response.mimetype.startswith(COMPRESSIBLE_TYPES)):
+        return response
+    
+    response.vary.add('Accept-Encoding')
+    data = response.get_data()
+    if len(data) < MIN_COMPRESS_BYTES:
+        return response
+    
+    accepted = request.accept_encodings
+    if brotli is not None and accepted['br']:
+        response.set_data(brotli.compress(data, quality=5))
+        response.headers['Content-Encoding'] = 'br'
+    elif accepted['gzip']:
+        response.set_data(gzip.compress(data, compresslevel=6))
+        response.headers['Content-Encoding'] = 'gzip'
+    return response
@@ -0,0 +1,400 @@
+#!/usr/bin/env python3
+"""
+Database maintenance for translation_history.db and tutor.db
+
+Every command works in small steps (rowid-range counts, streamed GROUP BY
+cursors, paged backups) so it is safe to run against a live server.
+
+    python db_maintenance.py stats
+    python db_maintenance.py explain --strict
+    python db_maintenance.py analyze
+    python db_maintenance.py vacuum --pages 500
+    python db_maintenance.py checkpoint --mode TRUNCATE
+    python db_maintenance.py backup backups/
+    STORAGE_SHARDS=8 python db_maintenance.py shard-migrate
+
+With STORAGE_SHARDS set every command also runs on each shard file.
+"""
+import argparse
+import os
+import sqlite3
+import sys
+import time
+from datetime import datetime
+
+import history_db
+import sharding
+import tutor_db
+
+# Hot-path queries from history_db / tutor_db, checked with EXPLAIN QUERY PLAN
+QUERY_CHECKS = {
+    'history': [
+        ('get_user_by_username', 'SELECT * FROM users WHERE username = ?', ('x',)),
+        ('get_user_by_id', 'SELECT * FROM users WHERE id = ?', (1,)),
+        ('get_user_history', 'SELECT * FROM history WHERE user_id = ? ORDER BY id DESC', (1,)),
+        ('iter_user_history',
+         'SELECT id FROM history WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?', (1, 0, 500)),
+        ('clear_user_history', 'DELETE FROM history WHERE user_id = ?', (1,)),
+        ('get_history_version', 'SELECT version FROM history_versions WHERE user_id = ?', (1,)),
+    ],
+    'tutor': [
+        ('get_profile', 'SELECT * FROM user_profiles WHERE user_id = ?', (1,)),
+        ('get_active_session',
+         'SELECT * FROM tutor_sessions WHERE user_id = ? AND is_active = 1 ORDER BY id DESC LIMIT 1', (1,)),
+        ('get_session_history',
+         'SELECT * FROM tutor_messages WHERE session_id = ? ORDER BY id DESC LIMIT ?', (1, 20)),
+    ],
+}
+
+# Per-user breakdowns, streamed straight from the cursor
+USER_STATS_QUERIES = {
+    'history': '''
+        SELECT user_id, COUNT(*) AS rows,
+               SUM(LENGTH(original_text) + LENGTH(translated_text)) AS text_bytes
+        FROM history GROUP BY user_id ORDER BY user_id
+    ''',
+    'tutor': '''
+        SELECT s.user_id, COUNT(m.id) AS rows, COALESCE(SUM(LENGTH(m.content)), 0) AS text_bytes
+        FROM tutor_sessions s LEFT JOIN tutor_messages m ON m.session_id = s.id
+        GROUP BY s.user_id ORDER BY s.user_id
+    ''',
+}
+
+def database_files():
+    """Return (label, path) for every database file the app writes"""
+    files = []
+    for label, base in (('history', history_db.DB_NAME), ('tutor', tutor_db.DB_NAME)):
+        files.append((label, base))
+        if sharding.is_sharded():
+            files.extend((f"{label}/shard{shard:02d}", sharding.shard_path(base, shard))
+                         for shard in range(sharding.shard_count()))
+    return files
+
+def base_label(label):
+    """'history/shard03' -> 'history'"""
+    return label.split('/')[0]
+
+def connect(path, readonly=False):
+    if readonly:
+        conn = sqlite3.connect(f'file:{path}?mode=ro', uri=True, timeout=30)
+    else:
+        conn = sqlite3.connect(path, timeout=30)
+    conn.row_factory = sqlite3.Row
+    return conn
+
+def list_tables(conn):
+    rows = conn.execute(
+        "SELECT name FROM sqlite_master WHERE type = 'table' AND name NOT LIKE 'sqlite_%' ORDER BY name"
+    ).fetchall()
+    return [row['name'] for row in rows]
+
+def chunked_count(conn, table, chunk_size=50000):
+    """Count rows in rowid ranges so no single statement scans the whole table"""
+    lo, hi = conn.execute(f'SELECT MIN(rowid), MAX(rowid) FROM "{table}"').fetchone()
+    if lo is None:
+        return 0
+    total = 0
+    for start in range(lo, hi + 1, chunk_size):
+        total += conn.execute(
+            f'SELECT COUNT(*) FROM "{table}" WHERE rowid >= ? AND rowid < ?',
+            (start, start + chunk_size)
+        ).fetchone()[0]
+    return total
+
+def table_sizes(conn):
+    """Bytes on disk per table/index, or None if SQLite lacks the dbstat table"""
+    try:
+        rows = conn.execute('SELECT name, SUM(pgsize) AS bytes FROM dbstat GROUP BY name').fetchall()
+    except sqlite3.OperationalError:
+        return None
+    return {row['name']: row['bytes'] for row in rows}
+
+def format_bytes(size):
+    for unit in ('B', 'KB', 'MB', 'GB'):
+        if size < 1024:
+            return f"{size:.0f} {unit}" if unit == 'B' else f"{size:.1f} {unit}"
+        size /= 1024
+    return f"{size:.1f} TB"
+
+# --- Commands ---
+
+def cmd_stats(label, path, args):
+    conn = connect(path, readonly=True)
+    try:
+        page_size = conn.execute('PRAGMA page_size').fetchone()[0]
+        page_count = conn.execute('PRAGMA page_count').fetchone()[0]
+        freelist = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        print(f"  file size: {format_bytes(page_size * page_count)} "
+              f"({freelist} free pages, journal={conn.execute('PRAGMA journal_mode').fetchone()[0]})")
+
+        sizes = table_sizes(conn)
+        for table in list_tables(conn):
+            count = chunked_count(conn, table, args.chunk_size)
+            size = format_bytes(sizes[table]) if sizes and table in sizes else 'n/a'
+            print(f"  {table:<20} {count:>10} rows  {size:>10}")
+
+        query = USER_STATS_QUERIES.get(base_label(label))
+        if query and not args.no_users:
+            print("  per user:")
+            try:
+                rows = conn.execute(query).fetchall()
+            except sqlite3.OperationalError as e:
+                rows = []
+                print(f"    [{e}]")
+            for row in rows:
+                print(f"    user {row['user_id']:<8} {row['rows']:>10} rows  "
+                      f"{format_bytes(row['text_bytes'] or 0):>10} text")
+    finally:
+        conn.close()
+    return True
+
+def cmd_explain(label, path, args):
+    conn = connect(path, readonly=True)
+    ok = True
+    try:
+        tables = set(list_tables(conn))
+        for name, sql, params in QUERY_CHECKS.get(base_label(label), []):
+            try:
+                plan = conn.execute(f'EXPLAIN QUERY PLAN {sql}', params).fetchall()
+            except sqlite3.OperationalError:
+                # e.g. users only lives in the main file, not in history shards
+                if tables:
+                    print(f"  -  {name} (table not in this file)")
+                continue
+            details = [row['detail'] for row in plan]
+            full_scan = any(d.startswith('SCAN') and 'USING' not in d for d in details)
+            marker = '⚠️ ' if full_scan else '✅'
+            print(f"  {marker} {name}")
+            for detail in details:
+                print(f"       {detail}")
+            if full_scan:
+                ok = False
+    finally:
+        conn.close()
+    return ok or not args.strict
+
+def cmd_analyze(label, path, args):
+    conn = connect(path)
+    try:
+        started = time.time()
+        conn.execute('ANALYZE')
+        conn.execute('PRAGMA optimize')
+        conn.commit()
+        print(f"  analyzed in {time.time() - started:.2f}s")
+    finally:
+        conn.close()
+    return True
+
+def cmd_vacuum(label, path, args):
+    conn = connect(path)
+    try:
+        mode = conn.execute('PRAGMA auto_vacuum').fetchone()[0]
+        if mode != 2:
+            if not args.full:
+                print("  auto_vacuum is not INCREMENTAL; run with --full once to convert (locks the file)")
+                return False
+            conn.execute('PRAGMA auto_vacuum = INCREMENTAL')
+            conn.execute('VACUUM')
+            print("  converted to incremental auto_vacuum with a full VACUUM")
+            return True
+
+        before = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        conn.execute(f'PRAGMA incremental_vacuum({int(args.pages)})')
+        after = conn.execute('PRAGMA freelist_count').fetchone()[0]
+        print(f"  released {before - after} pages ({after} free pages left)")
+    finally:
+        conn.close()
+    return True
+
+def cmd_checkpoint(label, path, args):
+    conn = connect(path)
+    try:
+        busy, log_frames, checkpointed = conn.execute(f'PRAGMA wal_checkpoint({args.mode})').fetchone()
+        if log_frames == -1:
+            print("  not in WAL mode, nothing to checkpoint")
+        else:
+            print(f"  {args.mode}: {checkpointed}/{log_frames} frames checkpointed"
+                  f"{' (busy, retry later)' if busy else ''}")
+    finally:
+        conn.close()
+    return not busy
+
+def cmd_backup(label, path, args):
+    os.makedirs(args.dest, exist_ok=True)
+    stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+    base = os.path.splitext(os.path.basename(path))[0]
+    dest_path = os.path.join(args.dest, f"{base}_{stamp}.db")
+
+    def progress(status, remaining, total):
+        print(f"\r  copied {total - remaining}/{total} pages", end='', flush=True)
+
+    src = connect(path, readonly=True)
+    dest = sqlite3.connect(dest_path)
+    try:
+        # Copy in steps so writers can get the lock between them
+        src.backup(dest, pages=args.pages, progress=progress, sleep=0.01)
+    finally:
+        dest.close()
+        src.close()
+    print(f"\n  backup written to {dest_path}")
+    return True
+
+def _batches(conn, table, batch_size=1000):
+    """Yield rows of a table in keyset-paginated batches by id"""
+    last_id = 0
+    while True:
+        rows = conn.execute(f'SELECT * FROM "{table}" WHERE id > ? ORDER BY id LIMIT ?',
+                            (last_id, batch_size)).fetchall()
+        if not rows:
+            return
+        yield rows
+        last_id = rows[-1]['id']
+
+def cmd_shard_migrate(label, path, args):
+    """Move rows of the single-file layout into the shard files"""
+    if not sharding.is_sharded():
+        print("  STORAGE_SHARDS is not set above 1, nothing to do")
+        return False
+    if label not in ('history', 'tutor'):
+        return True
+
+    module = history_db if label == 'history' else tutor_db
+    module.init_db()
+    src = connect(path)
+    shards = [connect(p) for p in sharding.shard_paths(path)]
+    try:
+        def dest_for_user(user_id):
+            return shards[sharding.shard_for_user(user_id)]
+
+        if label == 'history':
+            copied = _migrate_history(src, dest_for_user)
+        else:
+            copied = _migrate_tutor(src, dest_for_user)
+        for conn in shards:
+            conn.commit()
+        src.commit()
+        print(f"  moved {copied} rows into {len(shards)} shards")
+    finally:
+        for conn in shards:
+            conn.close()
+        src.close()
+    return True
+
+def _migrate_history(src, dest_for_user):
+    copied = 0
+    for rows in _batches(src, 'history'):
+        for row in rows:
+            dest_for_user(row['user_id']).execute('''
+                INSERT INTO history (user_id, timestamp, source_lang, target_lang, original_text, translated_text)
+                VALUES (?, ?, ?, ?, ?, ?)
+            ''', (row['user_id'], row['timestamp'], row['source_lang'], row['target_lang'],
+                  row['original_text'], row['translated_text']))
+            copied += 1
+
+    # Entry ids change, so bump every version past what clients hold and
+    # mark it as a clear: their next sync is a full reload
+    versions = dict(src.execute('SELECT user_id, version FROM history_versions').fetchall())
+    for (user_id,) in src.execute('SELECT DISTINCT user_id FROM history').fetchall():
+        versions.setdefault(user_id, 0)
+    now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    for user_id, version in versions.items():
+        dest_for_user(user_id).execute(
+            'INSERT OR REPLACE INTO history_versions (user_id, version, cleared_version, updated_at) VALUES (?, ?, ?, ?)',
+            (user_id, version + 1, version + 1, now))
+
+    src.execute('DELETE FROM history')
+    src.execute('DELETE FROM history_versions')
+    return copied
+
+def _migrate_tutor(src, dest_for_user):
+    copied = 0
+    for row in src.execute('SELECT * FROM user_profiles').fetchall():
+        dest_for_user(row['user_id']).execute(
+            'INSERT OR REPLACE INTO user_profiles (user_id, level, weaknesses, goals, last_active) VALUES (?, ?, ?, ?, ?)',
+            (row['user_id'], row['level'], row['weaknesses'], row['goals'], row['last_active']))
+        copied += 1
+
+    # Sessions get new shard-local ids; remember where each one went for its messages
+    moved_sessions = {}
+    for rows in _batches(src, 'tutor_sessions'):
+        for row in rows:
+            dest = dest_for_user(row['user_id'])
+            cur = dest.execute(
+                'INSERT INTO tutor_sessions (user_id, start_time, task_type, is_active, summary) VALUES (?, ?, ?, ?, ?)',
+                (row['user_id'], row['start_time'], row['task_type'], row['is_active'], row['summary']))
+            moved_sessions[row['id']] = (dest, cur.lastrowid)
+            copied += 1
+
+    for rows in _batches(src, 'tutor_messages'):
+        for row in rows:
+            if row['session_id'] not in moved_sessions:
+                continue  # orphaned message
+            dest, session_id = moved_sessions[row['session_id']]
+            dest.execute('''
+                INSERT INTO tutor_messages (session_id, role, content, correction_json, timestamp)
+                VALUES (?, ?, ?, ?, ?)
+            ''', (session_id, row['role'], row['content'], row['correction_json'], row['timestamp']))
+            copied += 1
+
+    src.execute('DELETE FROM tutor_messages')
+    src.execute('DELETE FROM tutor_sessions')
+    src.execute('DELETE FROM user_profiles')
+    return copied
+
+COMMANDS = {
+    'stats': cmd_stats,
+    'explain': cmd_explain,
+    'analyze': cmd_analyze,
+    'vacuum': cmd_vacuum,
+    'checkpoint': cmd_checkpoint,
+    'backup': cmd_backup,
+    'shard-migrate': cmd_shard_migrate,
+}
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Maintenance for the history and tutor databases")
+    parser.add_argument('--db', choices=['history', 'tutor', 'all'], default='all')
+    sub = parser.add_subparsers(dest='command', required=True)
+
+    stats = sub.add_parser('stats', help='row counts and size per table and user')
+    stats.add_argument('--chunk-size', type=int, default=50000)
+    stats.add_argument('--no-users', action='store_true', help='skip the per-user breakdown')
+
+    explain = sub.add_parser('explain', help='check index usage of hot queries')
+    explain.add_argument('--strict', action='store_true', help='exit non-zero on full table scans')
+
+    sub.add_parser('analyze', help='refresh planner statistics')
+
+    vacuum = sub.add_parser('vacuum', help='incremental vacuum')
+    vacuum.add_argument('--pages', type=int, default=1000, help='max free pages to release')
+    vacuum.add_argument('--full', action='store_true', help='convert to incremental mode with a full VACUUM')
+
+    checkpoint = sub.add_parser('checkpoint', help='checkpoint the WAL')
+    checkpoint.add_argument('--mode', choices=['PASSIVE', 'FULL', 'RESTART', 'TRUNCATE'], default='PASSIVE')
+
+    backup = sub.add_parser('backup', help='online backup via the sqlite backup API')
+    backup.add_argument('dest', help='directory to write backups to')
+    backup.add_argument('--pages', type=int, default=256, help='pages copied per step')
+
+    sub.add_parser('shard-migrate', help='move single-file data into the STORAGE_SHARDS shard files')
+
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    command = COMMANDS[args.command]
+
+    ok = True
+    for label, path in database_files():
+        if args.db not in ('all', base_label(label)):
+            continue
+        print(f"\n=== {label}: {path} ===")
+        if not os.path.exists(path):
+            print("  [missing, skipped]")
+            continue
+        ok = command(label, path, args) and ok
+
+    return 0 if ok else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
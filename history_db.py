@@ -1,29 +1,68 @@
 import sqlite3
 import os
+import heapq
 from datetime import datetime
-from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
+import cache
+import passwords
+import sharding
 
 DB_NAME = "translation_history.db"
 
 class User(UserMixin):
-    def __init__(self, id, username, role, password_hash):
+    def __init__(self, id, username, role=None, password_hash=None):
         self.id = id
         self.username = username
-        self.role = role
-        self.password_hash = password_hash
+        self._role = role
+        self._password_hash = password_hash
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
+    def _load_credentials(self):
+        # Read fresh from the database, never from the shared users cache, so a
+        # password change or demotion is seen by every worker at once
+        conn = get_db_connection()
+        row = conn.execute('SELECT role, password_hash FROM users WHERE id = ?', (self.id,)).fetchone()
+        conn.close()
+        self._role, self._password_hash = (row['role'], row['password_hash']) if row else ('', '')
+
+    @property
+    def role(self):
+        if self._role is None:
+            self._load_credentials()
+        return self._role
+
+    @property
+    def password_hash(self):
+        if self._password_hash is None:
+            self._load_credentials()
+        return self._password_hash
+
+def _connect(path):
+    conn = sqlite3.connect(path)
     conn.row_factory = sqlite3.Row
     return conn
 
+def get_db_connection():
+    return _connect(DB_NAME)
+
+def get_shard_connection(shard):
+    """Connection to the file holding history for one shard (the main file if unsharded)"""
+    if sharding.is_sharded():
+        return _connect(sharding.shard_path(DB_NAME, shard))
+    return get_db_connection()
+
+def get_history_connection(user_id):
+    return get_shard_connection(sharding.shard_for_user(user_id))
+
 def init_db():
     conn = get_db_connection()
     c = conn.cursor()
     
     # Enable foreign keys
     c.execute("PRAGMA foreign_keys = ON")
+    # Only takes effect on a fresh file; db_maintenance.py vacuum --full converts old ones
+    c.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    # WAL lets readers (exports, maintenance) run alongside writers
+    c.execute("PRAGMA journal_mode = WAL")
     
     # Create Users Table
     c.execute('''
@@ -36,8 +75,28 @@ def init_db():
         )
     ''')
     
+    _create_history_tables(c, with_foreign_key=True)
+    conn.commit()
+    conn.close()
+    
+    # In sharded mode each shard file gets its own history tables
+    if sharding.is_sharded():
+        for shard in range(sharding.shard_count()):
+            conn = get_shard_connection(shard)
+            c = conn.cursor()
+            c.execute("PRAGMA auto_vacuum = INCREMENTAL")
+            c.execute("PRAGMA journal_mode = WAL")
+            _create_history_tables(c, with_foreign_key=False)
+            conn.commit()
+            conn.close()
+
+def _create_history_tables(c, with_foreign_key):
+    # Shards hold no users table, so they can't reference it
+    foreign_key = (",\n            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE"
+                   if with_foreign_key else "")
+    
     # Create History Table with user_id
-    c.execute('''
+    c.execute(f'''
         CREATE TABLE IF NOT EXISTS history (
             id INTEGER PRIMARY KEY AUTOINCREMENT,
             user_id INTEGER NOT NULL,
@@ -45,12 +104,20 @@ def init_db():
             source_lang TEXT NOT NULL,
             target_lang TEXT NOT NULL,
             original_text TEXT NOT NULL,
-            translated_text TEXT NOT NULL,
-            FOREIGN KEY (user_id) REFERENCES users (id) ON DELETE CASCADE
+            translated_text TEXT NOT NULL{foreign_key}
+        )
+    ''')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_history_user_id ON history (user_id, id)')
+
+    # Per-user change counter for ETags and delta sync
+    c.execute('''
+        CREATE TABLE IF NOT EXISTS history_versions (
+            user_id INTEGER PRIMARY KEY,
+            version INTEGER NOT NULL,
+            cleared_version INTEGER NOT NULL DEFAULT 0,
+            updated_at TEXT NOT NULL
         )
     ''')
-    conn.commit()
-    conn.close()
 
 # --- USER MANAGEMENT ---
 
@@ -65,7 +132,7 @@ def create_user(username, password, role='user'):
     if count == 0:
         role = 'admin'  # First user is ALWAYS admin
     
-    password_hash = generate_password_hash(password)
+    password_hash = passwords.hash_password(password)
     created_at = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     
     try:
@@ -90,26 +157,42 @@ def get_user_by_username(username):
     return None
 
 def get_user_by_id(user_id):
-    conn = get_db_connection()
-    c = conn.cursor()
-    c.execute('SELECT * FROM users WHERE id = ?', (user_id,))
-    row = c.fetchone()
-    conn.close()
+    # Called by the login manager on every request, so keep it cached. Only
+    # the identity is cached; role and password hash load on first use.
+    users_cache = cache.get_cache('users')
+    row = users_cache.get(str(user_id))
+    
+    if row is None:
+        conn = get_db_connection()
+        c = conn.cursor()
+        c.execute('SELECT id, username FROM users WHERE id = ?', (user_id,))
+        found = c.fetchone()
+        conn.close()
+        if found:
+            row = dict(found)
+            users_cache.set(str(user_id), row)
     
     if row:
-        return User(row['id'], row['username'], row['role'], row['password_hash'])
+        return User(row['id'], row['username'])
     return None
 
 def verify_password(user, password):
-    return check_password_hash(user.password_hash, password)
+    if not passwords.check_password(user.password_hash, password):
+        return False
+    if passwords.needs_rehash(user.password_hash):
+        # Made under an older cost policy: upgrade it while we know the password
+        _set_password_hash(user.id, passwords.rehash_password(password))
+    return True
 
-def update_password(user_id, new_password):
+def _set_password_hash(user_id, password_hash):
     conn = get_db_connection()
     c = conn.cursor()
-    new_hash = generate_password_hash(new_password)
-    c.execute('UPDATE users SET password_hash = ? WHERE id = ?', (new_hash, user_id))
+    c.execute('UPDATE users SET password_hash = ? WHERE id = ?', (password_hash, user_id))
     conn.commit()
     conn.close()
+
+def update_password(user_id, new_password):
+    _set_password_hash(user_id, passwords.hash_password(new_password))
     return True
 
 def get_all_users():
@@ -120,23 +203,40 @@ def get_all_users():
     conn.close()
     return [dict(row) for row in rows]
 
-def get_user_stats():
+def get_usernames():
+    """Map user id -> username, used to label rows read from shards"""
     conn = get_db_connection()
     c = conn.cursor()
-    c.execute('''
-        SELECT u.username, COUNT(h.id) as translation_count 
-        FROM users u 
-        LEFT JOIN history h ON u.id = h.user_id 
-        GROUP BY u.id
-    ''')
+    c.execute('SELECT id, username FROM users')
     rows = c.fetchall()
     conn.close()
-    return [dict(row) for row in rows]
+    return {row['id']: row['username'] for row in rows}
+
+def get_user_stats():
+    conn = get_db_connection()
+    c = conn.cursor()
+    c.execute('SELECT id, username FROM users ORDER BY id')
+    users = c.fetchall()
+    conn.close()
+    
+    def count_shard(shard):
+        conn = get_shard_connection(shard)
+        c = conn.cursor()
+        c.execute('SELECT user_id, COUNT(*) FROM history GROUP BY user_id')
+        counts = dict(c.fetchall())
+        conn.close()
+        return counts
+    
+    counts = {}
+    for shard_counts in sharding.fan_out(count_shard):
+        counts.update(shard_counts)
+    
+    return [{'username': row['username'], 'translation_count': counts.get(row['id'], 0)} for row in users]
 
 # --- HISTORY MANAGEMENT ---
 
 def add_entry(user_id, source_lang, target_lang, original_text, translated_text):
-    conn = get_db_connection()
+    conn = get_history_connection(user_id)
     c = conn.cursor()
     timestamp = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     c.execute('''
@@ -144,7 +244,8 @@ def add_entry(user_id, source_lang, target_lang, original_text, translated_text)
         VALUES (?, ?, ?, ?, ?, ?)
     ''', (user_id, timestamp, source_lang, target_lang, original_text, translated_text))
     
-    entry_id = c.lastrowid
+    entry_id = sharding.encode_id(c.lastrowid, sharding.shard_for_user(user_id))
+    _bump_version(c, user_id, timestamp)
     conn.commit()
     conn.close()
     
@@ -157,54 +258,129 @@ def add_entry(user_id, source_lang, target_lang, original_text, translated_text)
         'translated_text': translated_text
     }
 
-def get_user_history(user_id):
-    conn = get_db_connection()
+def _bump_version(c, user_id, timestamp, cleared=False):
+    """Advance the user's history version inside the caller's transaction"""
+    c.execute('''
+        INSERT INTO history_versions (user_id, version, cleared_version, updated_at)
+        VALUES (?, 1, ?, ?)
+        ON CONFLICT(user_id) DO UPDATE SET
+            version = version + 1,
+            cleared_version = CASE WHEN ? THEN version + 1 ELSE cleared_version END,
+            updated_at = excluded.updated_at
+    ''', (user_id, 1 if cleared else 0, timestamp, cleared))
+
+def get_history_version(user_id):
+    """Return version info for a user's history; version 0 means never written"""
+    conn = get_history_connection(user_id)
     c = conn.cursor()
-    c.execute('SELECT * FROM history WHERE user_id = ? ORDER BY id DESC', (user_id,))
-    rows = c.fetchall()
+    c.execute('SELECT version, cleared_version, updated_at FROM history_versions WHERE user_id = ?', (user_id,))
+    row = c.fetchone()
     conn.close()
-    
-    history = []
-    for row in rows:
-        history.append({
-            'id': row['id'],
-            'timestamp': row['timestamp'],
-            'source_lang': row['source_lang'],
-            'target_lang': row['target_lang'],
-            'original_text': row['original_text'],
-            'translated_text': row['translated_text']
-        })
-    return history
 
-def get_all_history_admin():
-    conn = get_db_connection()
+    if row:
+        return dict(row)
+    return {'version': 0, 'cleared_version': 0, 'updated_at': None}
+
+def _entry(row, shard):
+    return {
+        'id': sharding.encode_id(row['id'], shard),
+        'timestamp': row['timestamp'],
+        'source_lang': row['source_lang'],
+        'target_lang': row['target_lang'],
+        'original_text': row['original_text'],
+        'translated_text': row['translated_text']
+    }
+
+def get_user_history(user_id, since_id=None):
+    shard = sharding.shard_for_user(user_id)
+    conn = get_shard_connection(shard)
     c = conn.cursor()
-    # Join with users table to get usernames
-    c.execute('''
-        SELECT h.*, u.username 
-        FROM history h 
-        JOIN users u ON h.user_id = u.id 
-        ORDER BY h.id DESC
-    ''')
+    if since_id is None:
+        c.execute('SELECT * FROM history WHERE user_id = ? ORDER BY id DESC', (user_id,))
+    else:
+        _, local_since_id = sharding.decode_id(since_id)
+        c.execute('SELECT * FROM history WHERE user_id = ? AND id > ? ORDER BY id DESC', (user_id, local_since_id))
     rows = c.fetchall()
     conn.close()
     
-    history = []
-    for row in rows:
-        history.append({
-            'id': row['id'],
-            'username': row['username'],
-            'timestamp': row['timestamp'],
-            'source_lang': row['source_lang'],
-            'target_lang': row['target_lang'],
-            'original_text': row['original_text'],
-            'translated_text': row['translated_text']
-        })
-    return history
+    return [_entry(row, shard) for row in rows]
+
+def get_all_history_admin():
+    usernames = get_usernames()
+    
+    def load_shard(shard):
+        conn = get_shard_connection(shard)
+        c = conn.cursor()
+        c.execute('SELECT * FROM history ORDER BY id DESC')
+        rows = c.fetchall()
+        conn.close()
+        
+        history = []
+        for row in rows:
+            # Rows of deleted users are skipped, as the old JOIN did
+            if row['user_id'] in usernames:
+                entry = _entry(row, shard)
+                entry['username'] = usernames[row['user_id']]
+                history.append(entry)
+        return history
+    
+    per_shard = sharding.fan_out(load_shard)
+    if len(per_shard) == 1:
+        return per_shard[0]
+    return list(heapq.merge(*per_shard, key=lambda e: (e['timestamp'], e['id']), reverse=True))
+
+def _iter_shard(shard, user_id=None, batch_size=500):
+    """Yield history rows of one shard oldest-first in keyset-paginated batches.
+
+    No read lock is held between batches and memory stays bounded by
+    batch_size. Ids are returned in their global (encoded) form.
+    """
+    conn = get_shard_connection(shard)
+    try:
+        c = conn.cursor()
+        last_id = 0
+        while True:
+            if user_id is None:
+                c.execute('''
+                    SELECT id, user_id, timestamp, source_lang, target_lang, original_text, translated_text
+                    FROM history WHERE id > ? ORDER BY id LIMIT ?
+                ''', (last_id, batch_size))
+            else:
+                c.execute('''
+                    SELECT id, user_id, timestamp, source_lang, target_lang, original_text, translated_text
+                    FROM history WHERE user_id = ? AND id > ? ORDER BY id LIMIT ?
+                ''', (user_id, last_id, batch_size))
+            rows = c.fetchall()
+            if not rows:
+                break
+            for row in rows:
+                entry = _entry(row, shard)
+                entry['user_id'] = row['user_id']
+                yield entry
+            last_id = rows[-1]['id']
+    finally:
+        conn.close()
+
+def iter_user_history(user_id, batch_size=500):
+    """Yield a user's history rows oldest-first without loading them all"""
+    for entry in _iter_shard(sharding.shard_for_user(user_id), user_id, batch_size):
+        del entry['user_id']
+        yield entry
+
+def iter_all_history_admin(batch_size=500):
+    """Yield every history row with its username, oldest-first, merged across shards"""
+    usernames = get_usernames()
+    streams = [_iter_shard(shard, batch_size=batch_size) for shard in range(sharding.shard_count())]
+    for entry in heapq.merge(*streams, key=lambda e: (e['timestamp'], e['id'])):
+        username = usernames.get(entry.pop('user_id'))
+        if username is not None:
+            entry['username'] = username
+            yield entry
 
 def clear_user_history(user_id):
-    conn = get_db_connection()
+    conn = get_history_connection(user_id)
     c = conn.cursor()
     c.execute('DELETE FROM history WHERE user_id = ?', (user_id,))
+    _bump_version(c, user_id, datetime.now().strftime('%Y-%m-%d %H:%M:%S'), cleared=True)
     conn.commit()
     conn.close()
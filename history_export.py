@@ -0,0 +1,78 @@
+import csv
+import io
+import json
+import zlib
+from flask import Response
+
+USER_EXPORT_FIELDS = ['id', 'timestamp', 'source_lang', 'target_lang', 'original_text', 'translated_text']
+ADMIN_EXPORT_FIELDS = ['id', 'username'] + USER_EXPORT_FIELDS[1:]
+
+EXPORT_FORMATS = {
+    'ndjson': ('application/x-ndjson', 'ndjson'),
+    'csv': ('text/csv', 'csv'),
+}
+
+def ndjson_lines(rows):
+    """Encode each row as one JSON line"""
+    for row in rows:
+        yield json.dumps(row, ensure_ascii=False) + '\n'
+
+def csv_lines(rows, fields):
+    """Encode rows as CSV, one line per yield, header first"""
+    buffer = io.StringIO()
+    writer = csv.DictWriter(buffer, fieldnames=fields, extrasaction='ignore')
+
+    writer.writeheader()
+    yield buffer.getvalue()
+
+    for row in rows:
+        buffer.seek(0)
+        buffer.truncate(0)
+        writer.writerow(row)
+        yield buffer.getvalue()
+
+def encode_chunks(lines, flush_size=64 * 1024):
+    """Turn text lines into UTF-8 byte chunks of roughly flush_size"""
+    pending = []
+    size = 0
+    for line in lines:
+        data = line.encode('utf-8')
+        pending.append(data)
+        size += len(data)
+        if size >= flush_size:
+            yield b''.join(pending)
+            pending = []
+            size = 0
+    if pending:
+        yield b''.join(pending)
+
+def gzip_chunks(chunks, level=6):
+    """Compress a byte stream into a single gzip member on the fly"""
+    compressor = zlib.compressobj(level, zlib.DEFLATED, 16 + zlib.MAX_WBITS)
+    for chunk in chunks:
+        data = compressor.compress(chunk)
+        if data:
+            yield data
+    yield compressor.flush()
+
+def export_response(rows, fmt, fields, filename, compress=False):
+    """Build a streaming Response exporting rows as NDJSON or CSV"""
+    mimetype, extension = EXPORT_FORMATS[fmt]
+
+    if fmt == 'csv':
+        lines = csv_lines(rows, fields)
+    else:
+        lines = ndjson_lines(rows)
+
+    body = encode_chunks(lines)
+    download_name = f"{filename}.{extension}"
+
+    if compress:
+        body = gzip_chunks(body)
+        mimetype = 'application/gzip'
+        download_name += '.gz'
+
+    response = Response(body, mimetype=mimetype)
+    response.headers['Content-Disposition'] = f'attachment; filename="{download_name}"'
+    response.headers['Cache-Control'] = 'no-store'
+    return response
@@ -0,0 +1,130 @@
+"""
+Idempotency keys for endpoints that call paid upstream APIs
+
+A client that may retry (e.g. on a flaky mobile connection) sends the same
+`Idempotency-Key` header with every attempt. The first request runs and
+its response is stored for IDEMPOTENCY_TTL seconds. A retry that arrives
+while the first is still running waits for it. A retry after that gets
+the stored response back, marked with `Idempotent-Replayed: true`, without
+another upstream call or database write.
+
+Keys are scoped per user and endpoint and live in the 'idempotency' cache
+namespace. With CACHE_BACKEND=sqlite, a retry that lands on another worker
+is deduplicated too. Reusing a key with a different body gets a 422.
+5xx responses are not stored, so those may be retried for real. Neither
+are 200s that only carry a fallback after a provider failure: the view
+calls dont_store() for those.
+"""
+import functools
+import os
+import threading
+import time
+
+import cache
+
+IDEMPOTENCY_TTL = int(os.getenv('IDEMPOTENCY_TTL', '600'))
+# How long a retry waits for the original request before giving up with 409
+IDEMPOTENCY_WAIT = float(os.getenv('IDEMPOTENCY_WAIT', '30'))
+# A pending marker outlives a crashed worker only this long
+PENDING_TTL = int(os.getenv('IDEMPOTENCY_PENDING_TTL', '120'))
+POLL_INTERVAL = 0.1
+MAX_KEY_LENGTH = 255
+
+_stats = {'requests': 0, 'with_key': 0, 'replayed': 0, 'waited': 0, 'conflicts': 0, 'mismatches': 0}
+_stats_lock = threading.Lock()
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+def stats():
+    with _stats_lock:
+        result = dict(_stats)
+    result['duplicate_rate'] = (round(result['replayed'] / result['with_key'], 3)
+                                if result['with_key'] else None)
+    return result
+
+def _replay(record):
+    from flask import Response
+    response = Response(record['body'], status=record['status'], mimetype=record['mimetype'])
+    response.headers['Idempotent-Replayed'] = 'true'
+    return response
+
+def _error(message, status, retry_after=None):
+    from flask import jsonify
+    response = jsonify({'error': message})
+    response.status_code = status
+    if retry_after:
+        response.headers['Retry-After'] = str(retry_after)
+    return response
+
+def dont_store():
+    """Mark the current response as a fallback that a retry should redo, not replay"""
+    from flask import g, has_request_context
+    if has_request_context():
+        g.idempotency_dont_store = True
+
+def _run_and_store(view, args, kwargs, store, key, fingerprint):
+    from flask import g, make_response
+    try:
+        response = make_response(view(*args, **kwargs))
+    except BaseException:
+        store.delete(key)
+        raise
+    if response.status_code >= 500 or response.is_streamed or g.pop('idempotency_dont_store', False):
+        store.delete(key)
+    else:
+        store.set(key, {
+            'state': 'done',
+            'fingerprint': fingerprint,
+            'status': response.status_code,
+            'mimetype': response.mimetype,
+            'body': response.get_data(as_text=True),
+        }, ttl=IDEMPOTENCY_TTL)
+    return response
+
+def idempotent(scope):
+    """Decorator for a login_required view; `scope` names the endpoint in the key"""
+    def decorator(view):
+        @functools.wraps(view)
+        def wrapper(*args, **kwargs):
+            from flask import request
+            from flask_login import current_user
+
+            _count('requests')
+            client_key = request.headers.get('Idempotency-Key')
+            if not client_key:
+                return view(*args, **kwargs)
+            if len(client_key) > MAX_KEY_LENGTH:
+                return _error('Idempotency-Key is too long', 400)
+
+            _count('with_key')
+            store = cache.get_cache('idempotency')
+            key = cache.make_key(current_user.id, scope, client_key)
+            fingerprint = cache.make_key(request.get_data())
+
+            deadline = time.monotonic() + IDEMPOTENCY_WAIT
+            waited = False
+            while True:
+                if store.add(key, {'state': 'pending', 'fingerprint': fingerprint}, ttl=PENDING_TTL):
+                    return _run_and_store(view, args, kwargs, store, key, fingerprint)
+
+                # Someone already used this key: wait for or replay its result
+                record = store.get(key)
+                if record is None:
+                    continue  # the original failed or expired meanwhile; run it ourselves
+                if record['fingerprint'] != fingerprint:
+                    _count('mismatches')
+                    return _error('Idempotency-Key was already used for a different request', 422)
+                if record['state'] == 'done':
+                    _count('replayed')
+                    return _replay(record)
+                if time.monotonic() >= deadline:
+                    _count('conflicts')
+                    return _error('A request with this Idempotency-Key is still in progress', 409, retry_after=1)
+                if not waited:
+                    _count('waited')
+                    waited = True
+                time.sleep(POLL_INTERVAL)
+        return wrapper
+    return decorator
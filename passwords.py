@@ -0,0 +1,127 @@
+"""
+Password hashing off the request thread
+
+Werkzeug's password hashes cost hundreds of milliseconds of CPU each. Run
+inline, a class logging in at once stalls every other request in the
+worker. Here hashing and checking run in a small process pool
+(PASSWORD_HASH_WORKERS processes; 0 hashes inline), and at most
+LOGIN_CONCURRENCY logins or registrations may be hashing at a time. The
+rest queue for up to LOGIN_WAIT seconds and are then turned away with
+Overloaded (429).
+
+PASSWORD_HASH_METHOD is the cost policy, in Werkzeug's method syntax
+(e.g. `scrypt:32768:8:1` or `pbkdf2:sha256:600000`). Empty means Werkzeug's
+default. Hashes made with another method or cost are flagged by
+`needs_rehash` and replaced on the user's next successful login.
+"""
+import multiprocessing
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor
+from concurrent.futures.process import BrokenProcessPool
+from contextlib import contextmanager
+
+from werkzeug.security import check_password_hash, generate_password_hash
+
+from admission import Overloaded
+
+PASSWORD_HASH_METHOD = os.getenv('PASSWORD_HASH_METHOD', '')
+PASSWORD_HASH_WORKERS = int(os.getenv('PASSWORD_HASH_WORKERS', str(min(4, os.cpu_count() or 1))))
+LOGIN_CONCURRENCY = int(os.getenv('LOGIN_CONCURRENCY', str(max(2, PASSWORD_HASH_WORKERS * 2))))
+# Seconds a login may wait for a hashing slot before it is turned away
+LOGIN_WAIT = float(os.getenv('LOGIN_WAIT', '5'))
+
+_pool = None
+_pool_lock = threading.Lock()
+_policy_prefix = None
+_slots = threading.BoundedSemaphore(LOGIN_CONCURRENCY)
+_stats = {'hashed': 0, 'checked': 0, 'rehashed': 0, 'rejected': 0, 'inline': 0}
+_stats_lock = threading.Lock()
+
+def _count(name):
+    with _stats_lock:
+        _stats[name] += 1
+
+def _hash(password, method):
+    return generate_password_hash(password, method) if method else generate_password_hash(password)
+
+def get_pool():
+    """The shared hashing pool, started on first use; None when hashing inline"""
+    global _pool
+    if PASSWORD_HASH_WORKERS <= 0:
+        return None
+    if _pool is None:
+        with _pool_lock:
+            if _pool is None:
+                # spawn: forking a threaded server process can deadlock the child
+                _pool = ProcessPoolExecutor(PASSWORD_HASH_WORKERS,
+                                            mp_context=multiprocessing.get_context('spawn'))
+    return _pool
+
+def start_pool():
+    """Start the worker processes ahead of the first login"""
+    pool = get_pool()
+    if pool is not None:
+        list(pool.map(abs, range(PASSWORD_HASH_WORKERS)))
+
+def shutdown():
+    global _pool
+    with _pool_lock:
+        pool, _pool = _pool, None
+    if pool is not None:
+        pool.shutdown(wait=True)
+
+def _run(fn, *args):
+    global _pool
+    pool = get_pool()
+    if pool is not None:
+        try:
+            return pool.submit(fn, *args).result()
+        except BrokenProcessPool:
+            # A worker died (e.g. OOM-killed); start a fresh pool next time
+            with _pool_lock:
+                if _pool is pool:
+                    _pool = None
+    _count('inline')
+    return fn(*args)
+
+def hash_password(password):
+    """Hash with the current policy"""
+    _count('hashed')
+    return _run(_hash, password, PASSWORD_HASH_METHOD)
+
+def rehash_password(password):
+    """hash_password for an outdated hash found at login"""
+    _count('rehashed')
+    return hash_password(password)
+
+def check_password(pwhash, password):
+    _count('checked')
+    return _run(check_password_hash, pwhash, password)
+
+def policy_prefix():
+    """The 'method:params' part of a hash made under the current policy"""
+    global _policy_prefix
+    if _policy_prefix is None:
+        _policy_prefix = _run(_hash, '', PASSWORD_HASH_METHOD).split('$', 1)[0]
+    return _policy_prefix
+
+def needs_rehash(pwhash):
+    return pwhash.split('$', 1)[0] != policy_prefix()
+
+@contextmanager
+def login_slot():
+    """Hold one of the LOGIN_CONCURRENCY hashing slots for a login or registration"""
+    if not _slots.acquire(timeout=LOGIN_WAIT):
+        _count('rejected')
+        raise Overloaded('Too many sign-ins at once, please try again in a moment', retry_after=2)
+    try:
+        yield
+    finally:
+        _slots.release()
+
+def stats():
+    with _stats_lock:
+        result = dict(_stats)
+    result.update(method=policy_prefix(), workers=PASSWORD_HASH_WORKERS, login_concurrency=LOGIN_CONCURRENCY)
+    return result
@@ -0,0 +1,225 @@
+#!/usr/bin/env python3
+"""
+Pre-warm the translation and TTS caches from a curriculum file
+
+Runs every lesson phrase through the same translation_service / tts_service
+paths the app uses, so the first learners of a term hit warm caches.
+Phrases that are already cached are skipped without calling a provider, so
+after a failure the command can simply be run again to resume.
+
+    python prewarm.py curriculum.json --workers 4
+    python prewarm.py curriculum.json --report-only --report coverage.json
+
+Curriculum format (JSON):
+
+    {
+      "pairs": [["en", "de"], ["de", "en"]],
+      "tts": ["de"],
+      "lessons": [
+        {"name": "Lesson 1", "phrases": ["Good morning", "How are you?"]}
+      ]
+    }
+
+A top-level "phrases" list may be used instead of "lessons". For each
+pair the translation is spoken if its target language is listed in "tts",
+and the phrase itself if its source language is. Speech is warmed sentence
+by sentence, the way /api/text-to-speech/stream requests it.
+
+Translations only outlive this process with CACHE_BACKEND=sqlite.
+"""
+import argparse
+import json
+import sys
+import time
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor, FIRST_COMPLETED, wait
+
+from dotenv import load_dotenv
+
+# Before the service imports: they read API keys and CACHE_BACKEND at import time
+load_dotenv()
+
+import admission  # noqa: E402
+import cache  # noqa: E402
+import translation_service  # noqa: E402
+import tts_service  # noqa: E402
+
+def load_curriculum(path):
+    """Return (pairs, tts_langs, lessons) with lessons as [(name, [phrases])]"""
+    with open(path, encoding='utf-8') as f:
+        data = json.load(f)
+
+    pairs = [tuple(pair) for pair in data.get('pairs', [])]
+    if not pairs or any(len(pair) != 2 for pair in pairs):
+        raise ValueError('curriculum needs "pairs": [[source, target], ...]')
+
+    if 'lessons' in data:
+        lessons = [(lesson.get('name', f"lesson {i + 1}"), lesson.get('phrases', []))
+                   for i, lesson in enumerate(data['lessons'])]
+    else:
+        lessons = [('phrases', data.get('phrases', []))]
+
+    # Drop blanks and duplicates within a lesson, keep order
+    lessons = [(name, list(dict.fromkeys(p.strip() for p in phrases if p and p.strip())))
+               for name, phrases in lessons]
+    return pairs, set(data.get('tts', [])), lessons
+
+def build_tasks(pairs, lessons):
+    """One task per (lesson, phrase, pair)"""
+    return [(name, phrase, source, target)
+            for name, phrases in lessons
+            for phrase in phrases
+            for source, target in pairs]
+
+def speech_items(phrase, translation, source, target, tts_langs):
+    """(text, lang) sentences the UI would request for this phrase"""
+    items = []
+    if source in tts_langs:
+        items.extend((s, source) for s in tts_service.split_sentences(phrase))
+    if target in tts_langs and translation:
+        items.extend((s, target) for s in tts_service.split_sentences(translation))
+    return items
+
+def with_retries(fn, retries, backoff):
+    """Call fn, retrying with exponential backoff; re-raises the last error"""
+    for attempt in range(retries + 1):
+        try:
+            return fn()
+        except Exception:
+            if attempt == retries:
+                raise
+            time.sleep(backoff * 2 ** attempt)
+
+def warm_task(task, tts_langs, retries=2, backoff=1.0):
+    """Warm one phrase for one pair; returns the provider calls made"""
+    # Bulk lane: never takes upstream slots or quota that interactive users are waiting for
+    with admission.lane(admission.BULK):
+        return _warm_task(task, tts_langs, retries, backoff)
+
+def _warm_task(task, tts_langs, retries, backoff):
+    _, phrase, source, target = task
+    calls = {'translations': 0, 'tts': 0}
+
+    translation = translation_service.cached_translation(phrase, source, target)
+    if translation is None:
+        with_retries(lambda: translation_service.translate(phrase, source, target), retries, backoff)
+        translation = translation_service.cached_translation(phrase, source, target)
+        calls['translations'] += 1
+        if translation is None:
+            raise RuntimeError('unexpected translation response (not cached)')
+
+    for text, lang in speech_items(phrase, translation, source, target, tts_langs):
+        if tts_service.cached_path(text, lang) is None:
+            with_retries(lambda: tts_service.synthesize(text, lang), retries, backoff)
+            calls['tts'] += 1
+    return calls
+
+def run_bounded(fn, items, workers):
+    """Yield (item, result, error) with at most `workers` calls in flight"""
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix='prewarm') as executor:
+        queue = deque(items)
+        running = {}
+        while queue or running:
+            while queue and len(running) < workers:
+                item = queue.popleft()
+                running[executor.submit(fn, item)] = item
+            done, _ = wait(running, return_when=FIRST_COMPLETED)
+            for future in done:
+                item = running.pop(future)
+                error = future.exception()
+                yield item, (None if error else future.result()), error
+
+def coverage(tasks, tts_langs):
+    """Per lesson/pair counts of phrases whose translation and speech are cached"""
+    report = {}
+    for name, phrase, source, target in tasks:
+        row = report.setdefault((name, source, target), {
+            'lesson': name, 'pair': f"{source}->{target}",
+            'phrases': 0, 'translated': 0, 'speech_total': 0, 'speech_cached': 0,
+        })
+        row['phrases'] += 1
+        translation = translation_service.cached_translation(phrase, source, target)
+        if translation is not None:
+            row['translated'] += 1
+        items = speech_items(phrase, translation, source, target, tts_langs)
+        # Without a translation its sentences are unknown; count it as one missing clip
+        unknown = 1 if translation is None and target in tts_langs else 0
+        row['speech_total'] += len(items) + unknown
+        row['speech_cached'] += sum(1 for text, lang in items if tts_service.cached_path(text, lang))
+    return list(report.values())
+
+def print_report(rows, failures):
+    print(f"\n{'lesson':<24} {'pair':<8} {'translated':>12} {'speech':>12}")
+    for row in rows:
+        print(f"{row['lesson'][:24]:<24} {row['pair']:<8} "
+              f"{row['translated']:>5}/{row['phrases']:<6} {row['speech_cached']:>5}/{row['speech_total']:<6}")
+    phrases = sum(r['phrases'] for r in rows)
+    translated = sum(r['translated'] for r in rows)
+    speech_total = sum(r['speech_total'] for r in rows)
+    speech_cached = sum(r['speech_cached'] for r in rows)
+    print(f"\n📊 translations: {translated}/{phrases} "
+          f"({translated / phrases * 100 if phrases else 100:.1f}%), "
+          f"speech: {speech_cached}/{speech_total} "
+          f"({speech_cached / speech_total * 100 if speech_total else 100:.1f}%)")
+    for (name, phrase, source, target), error in failures[:20]:
+        print(f"  ❌ [{name}] {source}->{target} {phrase!r}: {error}")
+    if len(failures) > 20:
+        print(f"  ... and {len(failures) - 20} more failures")
+
+def build_parser():
+    parser = argparse.ArgumentParser(description="Pre-warm translation and TTS caches from a curriculum")
+    parser.add_argument('curriculum', help='curriculum JSON file')
+    parser.add_argument('--workers', type=int, default=4, help='concurrent provider calls')
+    parser.add_argument('--retries', type=int, default=2, help='retries per call, with exponential backoff')
+    parser.add_argument('--backoff', type=float, default=1.0, help='first retry delay in seconds')
+    parser.add_argument('--report', help='also write the coverage report as JSON here')
+    parser.add_argument('--report-only', action='store_true', help='only report coverage, call no provider')
+    return parser
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    pairs, tts_langs, lessons = load_curriculum(args.curriculum)
+    tasks = build_tasks(pairs, lessons)
+
+    if cache.CACHE_BACKEND != 'sqlite':
+        print("⚠️  CACHE_BACKEND is not 'sqlite': translations warmed here are lost when this process exits")
+    capacity = cache.NAMESPACES['translations'][0]
+    if len(tasks) > capacity:
+        print(f"⚠️  {len(tasks)} translations exceed the cache capacity of {capacity}; early ones will be evicted")
+
+    failures = []
+    if not args.report_only:
+        print(f"🔥 Warming {len(tasks)} phrase/pair combinations with {args.workers} workers...")
+        calls = {'translations': 0, 'tts': 0}
+        done = 0
+        started = time.time()
+        for task, result, error in run_bounded(
+                lambda t: warm_task(t, tts_langs, args.retries, args.backoff), tasks, args.workers):
+            done += 1
+            if error:
+                failures.append((task, error))
+            else:
+                for key in calls:
+                    calls[key] += result[key]
+            if done % 50 == 0 or done == len(tasks):
+                print(f"\r  {done}/{len(tasks)} done, {len(failures)} failed", end='', flush=True)
+        print(f"\n✅ {calls['translations']} translations and {calls['tts']} TTS clips generated "
+              f"in {time.time() - started:.1f}s (everything else was already cached)")
+
+    rows = coverage(tasks, tts_langs)
+    print_report(rows, failures)
+
+    if args.report:
+        with open(args.report, 'w') as f:
+            json.dump({
+                'lessons': rows,
+                'failures': [{'lesson': t[0], 'phrase': t[1], 'pair': f"{t[2]}->{t[3]}", 'error': str(e)}
+                             for t, e in failures],
+            }, f, indent=2, ensure_ascii=False)
+        print(f"📝 Report written to {args.report}")
+
+    complete = all(r['translated'] == r['phrases'] and r['speech_cached'] == r['speech_total'] for r in rows)
+    return 0 if complete and not failures else 1
+
+if __name__ == '__main__':
+    sys.exit(main())
@@ -0,0 +1,280 @@
+"""
+On-demand cProfile / tracemalloc capture of live requests (admin only)
+
+An admin arms a capture plan for an endpoint and/or a user and a number
+of requests. The plan lives in PROFILE_DIR/armed.json so every worker
+process picks it up. Each matching request (picked with probability
+sample_rate) is profiled. The .pstats file, the optional .tracemalloc
+snapshot, and a JSON summary of the top entries are written to
+PROFILE_DIR. The plan disarms itself once enough captures exist.
+
+While nothing is armed, the request hook only compares a timestamp. The
+plan file is stat'ed at most once per PLAN_CHECK_INTERVAL.
+
+Streamed responses (TTS streaming, history exports) are profiled until
+the server has sent the whole body, not only until the view returns.
+
+cProfile only sees the request thread, so work handed to the TTS/STT pools
+shows up as time spent waiting on futures. tracemalloc is process-wide,
+so other requests running at the same time also add to the snapshot.
+"""
+import cProfile
+import json
+import os
+import pstats
+import random
+import re
+import threading
+import time
+import tracemalloc
+import uuid
+from datetime import datetime
+
+PROFILE_DIR = os.getenv('PROFILE_DIR', 'profiles')
+PROFILE_MAX_CAPTURES = int(os.getenv('PROFILE_MAX_CAPTURES', '50'))
+PLAN_CHECK_INTERVAL = 1.0
+TRACEMALLOC_FRAMES = 10
+
+ARTIFACT_KINDS = ('pstats', 'tracemalloc')
+_NAME_RE = re.compile(r'^[\w.-]+$')
+
+_plan = None
+_plan_mtime = None
+_checked_at = 0.0
+_plan_lock = threading.Lock()
+# cProfile and tracemalloc are process-wide: one capture at a time
+_capture_lock = threading.Lock()
+
+def _plan_path():
+    return os.path.join(PROFILE_DIR, 'armed.json')
+
+# --- Plan ---
+
+def arm(endpoint=None, user_id=None, requests=5, sample_rate=1.0, memory=True, top=25):
+    """Start capturing the next `requests` matching requests"""
+    os.makedirs(PROFILE_DIR, exist_ok=True)
+    plan = {
+        'id': uuid.uuid4().hex[:8],
+        'endpoint': endpoint or None,
+        'user_id': int(user_id) if user_id not in (None, '') else None,
+        'requests': max(1, int(requests)),
+        'sample_rate': min(1.0, max(0.0, float(sample_rate))),
+        'memory': bool(memory),
+        'top': max(1, int(top)),
+        'armed_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+    }
+    tmp_path = f"{_plan_path()}.{os.getpid()}.tmp"
+    with open(tmp_path, 'w') as f:
+        json.dump(plan, f)
+    os.replace(tmp_path, _plan_path())
+    _refresh_plan(force=True)
+    return plan
+
+def disarm():
+    try:
+        os.remove(_plan_path())
+    except FileNotFoundError:
+        pass
+    _refresh_plan(force=True)
+
+def get_plan():
+    return _refresh_plan(force=True)
+
+def _refresh_plan(force=False):
+    """Reload armed.json if it changed, checking the disk at most once per interval"""
+    global _plan, _plan_mtime, _checked_at
+    now = time.monotonic()
+    if not force and now - _checked_at < PLAN_CHECK_INTERVAL:
+        return _plan
+    with _plan_lock:
+        _checked_at = now
+        try:
+            mtime = os.stat(_plan_path()).st_mtime_ns
+        except FileNotFoundError:
+            _plan, _plan_mtime = None, None
+            return None
+        if mtime != _plan_mtime:
+            try:
+                with open(_plan_path()) as f:
+                    _plan = json.load(f)
+                _plan_mtime = mtime
+            except (OSError, ValueError):
+                _plan = None  # half-written or removed meanwhile; retry next interval
+        return _plan
+
+# --- Capture ---
+
+class Capture:
+    """One profiled request"""
+
+    def __init__(self, plan):
+        self.plan = plan
+        self.profile = cProfile.Profile()
+        self.tracing = plan['memory'] and not tracemalloc.is_tracing()
+        if self.tracing:
+            tracemalloc.start(TRACEMALLOC_FRAMES)
+        self.started = time.perf_counter()
+        self.profile.enable()
+
+    def finish(self, endpoint, path, method, user_id, status):
+        self.profile.disable()
+        wall_ms = (time.perf_counter() - self.started) * 1000
+
+        snapshot = None
+        peak = None
+        if self.plan['memory'] and tracemalloc.is_tracing():
+            snapshot = tracemalloc.take_snapshot().filter_traces((
+                tracemalloc.Filter(False, tracemalloc.__file__),
+                tracemalloc.Filter(False, '<frozen importlib._bootstrap>'),
+            ))
+            peak = tracemalloc.get_traced_memory()[1]
+            if self.tracing:
+                tracemalloc.stop()
+
+        os.makedirs(PROFILE_DIR, exist_ok=True)
+        stamp = datetime.now().strftime('%Y%m%d_%H%M%S')
+        name = f"{stamp}_{(endpoint or 'none').replace('.', '-')}_{uuid.uuid4().hex[:6]}"
+        base = os.path.join(PROFILE_DIR, name)
+
+        top = self.plan['top']
+        summary = {
+            'name': name,
+            'plan_id': self.plan['id'],
+            'endpoint': endpoint,
+            'path': path,
+            'method': method,
+            'user_id': user_id,
+            'status': status,
+            'wall_ms': round(wall_ms, 1),
+            'captured_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S'),
+            'top_functions': top_functions(self.profile, top),
+            'artifacts': ['pstats'],
+        }
+        self.profile.dump_stats(f"{base}.pstats")
+
+        if snapshot is not None:
+            summary['memory'] = {'peak_bytes': peak, 'top': top_allocations(snapshot, top)}
+            snapshot.dump(f"{base}.tracemalloc")
+            summary['artifacts'].append('tracemalloc')
+
+        with open(f"{base}.json", 'w') as f:
+            json.dump(summary, f)
+        return summary
+
+def top_functions(profile, limit):
+    """Top functions by cumulative time"""
+    stats = pstats.Stats(profile).stats
+    rows = sorted(stats.items(), key=lambda item: item[1][3], reverse=True)[:limit]
+    return [{
+        'function': f"{os.path.basename(filename)}:{line}({func})",
+        'calls': calls,
+        'tottime_ms': round(tottime * 1000, 2),
+        'cumtime_ms': round(cumtime * 1000, 2),
+    } for (filename, line, func), (_, calls, tottime, cumtime, _) in rows]
+
+def top_allocations(snapshot, limit):
+    """Top source lines by memory still allocated at the end of the request"""
+    return [{
+        'location': f"{os.path.basename(stat.traceback[0].filename)}:{stat.traceback[0].lineno}",
+        'size_bytes': stat.size,
+        'count': stat.count,
+    } for stat in snapshot.statistics('lineno')[:limit]]
+
+def _matches(plan, endpoint, user_id):
+    if plan['endpoint'] and plan['endpoint'] != endpoint:
+        return False
+    if plan['user_id'] is not None and plan['user_id'] != user_id:
+        return False
+    return random.random() < plan['sample_rate']
+
+# --- Results ---
+
+def list_captures():
+    """Summaries of stored captures, newest first"""
+    if not os.path.isdir(PROFILE_DIR):
+        return []
+    captures = []
+    for filename in sorted(os.listdir(PROFILE_DIR), reverse=True):
+        if not filename.endswith('.json') or filename == 'armed.json':
+            continue
+        try:
+            with open(os.path.join(PROFILE_DIR, filename)) as f:
+                captures.append(json.load(f))
+        except (OSError, ValueError):
+            continue
+    return captures
+
+def artifact_path(name, kind):
+    """Path of a stored artifact, or None if the name/kind is unknown"""
+    if kind not in ARTIFACT_KINDS or not _NAME_RE.match(name):
+        return None
+    path = os.path.join(PROFILE_DIR, f"{name}.{kind}")
+    return path if os.path.isfile(path) else None
+
+def _after_capture(plan):
+    """Disarm once the plan has enough captures and keep only the newest ones"""
+    captures = list_captures()
+    if sum(1 for c in captures if c.get('plan_id') == plan['id']) >= plan['requests']:
+        current = _refresh_plan(force=True)
+        if current and current['id'] == plan['id']:
+            disarm()
+    for old in captures[PROFILE_MAX_CAPTURES:]:
+        for ext in ('json',) + ARTIFACT_KINDS:
+            try:
+                os.remove(os.path.join(PROFILE_DIR, f"{old['name']}.{ext}"))
+            except FileNotFoundError:
+                pass
+
+# --- Flask hooks ---
+
+def init_app(app):
+    from flask import g, request
+    from flask_login import current_user
+
+    def current_user_id():
+        return current_user.id if current_user.is_authenticated else None
+
+    @app.before_request
+    def start_capture():
+        plan = _refresh_plan()
+        if plan is None:
+            return
+        if not _matches(plan, request.endpoint, current_user_id()):
+            return
+        if not _capture_lock.acquire(blocking=False):
+            return
+        try:
+            g.profiling_capture = Capture(plan)
+        except ValueError:
+            # Another profiler is already active in this process
+            _capture_lock.release()
+
+    def request_info():
+        return request.endpoint, request.path, request.method, current_user_id()
+
+    def stop_capture(capture, info, status):
+        try:
+            capture.finish(*info, status)
+        finally:
+            _capture_lock.release()
+        _after_capture(capture.plan)
+
+    @app.after_request
+    def finish_capture(response):
+        capture = g.pop('profiling_capture', None)
+        if capture is None:
+            return response
+        info = request_info()
+        if response.is_streamed:
+            # The body is generated after this hook; stop once the server has sent it
+            response.call_on_close(lambda: stop_capture(capture, info, response.status_code))
+        else:
+            stop_capture(capture, info, response.status_code)
+        return response
+
+    @app.teardown_request
+    def abort_capture(exc):
+        # Unhandled errors skip after_request
+        capture = g.pop('profiling_capture', None)
+        if capture is not None:
+            stop_capture(capture, request_info(), 500)
@@ -1,31 +1,53 @@
-from flask import Blueprint, request, jsonify, send_file
+from flask import Blueprint, Response, request, jsonify, send_file, url_for
 from flask_login import login_required, current_user
-import speech_recognition as sr
-import requests
-from gtts import gTTS
+from werkzeug.exceptions import RequestEntityTooLarge
 import tempfile
+import itertools
 import os
 import json
 from datetime import datetime
-from pydub import AudioSegment
 import history_db
+import history_export
+import cache
+import translation_service
+import tts_service
+import stt_service
+import audio_preprocess
+import compression
+import idempotency
+import admission
+import passwords
+from idempotency import idempotent
+from admission import rate_limited
+
+# speech_recognition, pydub, gTTS and requests are imported inside the
+# functions that need them so that importing this module stays cheap.
 
 api_bp = Blueprint('api', __name__)
 
 # --- Configuration ---
-JIGSAWSTACK_API_KEY = os.getenv("JIGSAWSTACK_API_KEY")
 GROQ_API_KEY = os.getenv("GROQ_API_KEY")
+GROQ_URL = os.getenv("GROQ_URL", "https://api.groq.com/openai/v1/chat/completions")
 
-recognizer = sr.Recognizer()
-recognizer.energy_threshold = 300
-recognizer.dynamic_energy_threshold = True
+def warm_up():
+    """Import the audio/TTS/HTTP stacks and start the hashing pool ahead of the first request"""
+    import requests  # noqa: F401
+    import pydub  # noqa: F401
+    import gtts  # noqa: F401
+    stt_service.get_recognizer()
+    passwords.start_pool()
 
 # --- API Routes ---
 
 @api_bp.route('/api/transcribe', methods=['POST'])
 @login_required
+@rate_limited('transcribe')
 def transcribe_audio():
     """Transcribe audio from uploaded file"""
+    from pydub import AudioSegment
+    # Reject oversized uploads before Werkzeug parses and spools the body
+    if request.content_length and request.content_length > audio_preprocess.MAX_AUDIO_BYTES:
+        return jsonify({'error': 'Audio file too large'}), 413
     try:
         if 'audio' not in request.files:
             return jsonify({'error': 'No audio file provided'}), 400
@@ -37,32 +59,43 @@ def transcribe_audio():
             audio_file.save(temp_input.name)
             temp_input_path = temp_input.name
         
-        temp_wav_path = temp_input_path.replace('.webm', '.wav')
-        
         try:
-            audio = AudioSegment.from_file(temp_input_path)
-            audio = audio.set_frame_rate(16000).set_channels(1)
-            audio.export(temp_wav_path, format='wav')
+            if os.path.getsize(temp_input_path) > audio_preprocess.MAX_AUDIO_BYTES:
+                return jsonify({'error': 'Audio file too large'}), 413
             
-            with sr.AudioFile(temp_wav_path) as source:
-                audio_data = recognizer.record(source)
-                text = recognizer.recognize_google(audio_data, language=source_lang)
-                
-            return jsonify({'text': text})
+            # Decode at most a second past the limit, so huge clips cost little
+            audio = AudioSegment.from_file(temp_input_path, duration=audio_preprocess.MAX_AUDIO_SECONDS + 1)
+            if audio.duration_seconds > audio_preprocess.MAX_AUDIO_SECONDS:
+                return jsonify({'error': f'Recording longer than {audio_preprocess.MAX_AUDIO_SECONDS:.0f} seconds'}), 413
             
+            audio = audio.set_frame_rate(stt_service.SAMPLE_RATE).set_channels(1).set_sample_width(stt_service.SAMPLE_WIDTH)
         finally:
             if os.path.exists(temp_input_path):
                 os.unlink(temp_input_path)
-            if os.path.exists(temp_wav_path):
-                os.unlink(temp_wav_path)
+        
+        pcm = audio_preprocess.trim_silence(audio.raw_data)
+        segments = audio_preprocess.split_at_pauses(pcm) if pcm else []
+        if not segments:
+            return jsonify({'error': 'No speech detected'}), 400
+        
+        text = stt_service.recognize_segments(segments, source_lang)
+        if not text:
+            return jsonify({'error': 'Could not understand audio'}), 400
+        
+        return jsonify({'text': text})
                 
-    except sr.UnknownValueError:
-        return jsonify({'error': 'Could not understand audio'}), 400
+    except RequestEntityTooLarge:
+        # Chunked upload without Content-Length that ran past MAX_CONTENT_LENGTH
+        return jsonify({'error': 'Audio file too large'}), 413
+    except admission.Overloaded:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @api_bp.route('/api/translate', methods=['POST'])
 @login_required
+@idempotent('translate')
+@rate_limited('translate')
 def translate_text():
     """Translate text using JigsawStack API"""
     try:
@@ -74,33 +107,7 @@ def translate_text():
         if not text:
             return jsonify({'error': 'No text provided'}), 400
         
-        url = "https://jigsawstack.com/api/v1/ai/translate"
-        
-        payload = {
-            "text": text,
-            "source_language": source_lang,
-            "target_language": target_lang
-        }
-        
-        headers = {
-            "Content-Type": "application/json",
-            "x-api-key": JIGSAWSTACK_API_KEY
-        }
-        
-        response = requests.post(url, json=payload, headers=headers)
-        response.raise_for_status()
-        
-        result = response.json()
-        
-        translation = None
-        if isinstance(result, dict):
-            for key in ["translation", "translated_text", "result"]:
-                if key in result:
-                    translation = result[key]
-                    break
-        
-        if not translation:
-            translation = str(result)
+        translation = translation_service.translate(text, source_lang, target_lang)
         
         history_entry = history_db.add_entry(
             user_id=current_user.id,
@@ -115,11 +122,14 @@ def translate_text():
             'history_entry': history_entry
         })
         
+    except admission.Overloaded:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
 @api_bp.route('/api/text-to-speech', methods=['POST'])
 @login_required
+@rate_limited('tts')
 def text_to_speech():
     """Convert text to speech"""
     try:
@@ -130,26 +140,111 @@ def text_to_speech():
         if not text:
             return jsonify({'error': 'No text provided'}), 400
         
-        tts = gTTS(text=text, lang=lang, slow=False)
-        
-        with tempfile.NamedTemporaryFile(delete=False, suffix='.mp3') as temp_audio:
-            tts.save(temp_audio.name)
-            temp_audio_path = temp_audio.name
+        if data.get('audio_id'):
+            tts_service.claim_speculation(data['audio_id'])
+        audio_path = tts_service.synthesize(text, lang)
         
         return send_file(
-            temp_audio_path,
+            audio_path,
             mimetype='audio/mpeg',
             as_attachment=False,
             download_name='translation.mp3'
         )
         
+    except admission.Overloaded:
+        raise
     except Exception as e:
         return jsonify({'error': str(e)}), 500
 
+@api_bp.route('/api/text-to-speech/stream', methods=['POST'])
+@login_required
+def prepare_speech_stream():
+    """Register text for streaming and return the short URL to play it from"""
+    data = request.json
+    text = data.get('text')
+    lang = data.get('lang', 'en')
+    
+    if not text:
+        return jsonify({'error': 'No text provided'}), 400
+    
+    audio_id = tts_service.register_speech(text, lang)
+    return jsonify({'audio_id': audio_id,
+                    'audio_url': url_for('api.stream_text_to_speech', audio_id=audio_id)})
+
+@api_bp.route('/api/text-to-speech/stream/<audio_id>', methods=['GET'])
+@login_required
+@rate_limited('tts')
+def stream_text_to_speech(audio_id):
+    """Stream speech sentence by sentence so playback starts early"""
+    speech = tts_service.registered_speech(audio_id)
+    if speech is None:
+        return jsonify({'error': 'Unknown or expired audio id'}), 404
+    text, lang = speech
+    
+    # Sentences already synthesized speculatively are served as they finish
+    tts_service.claim_speculation(audio_id)
+    chunks = tts_service.stream_speech(text, lang)
+    try:
+        # Synthesize the first sentence up front so failures still get a proper status
+        first = next(chunks)
+    except StopIteration:
+        return jsonify({'error': 'No text provided'}), 400
+    except admission.Overloaded:
+        raise
+    except Exception as e:
+        return jsonify({'error': str(e)}), 500
+    
+    response = Response(itertools.chain([first], chunks), mimetype='audio/mpeg')
+    response.headers['Cache-Control'] = 'no-store'
+    return response
+
+@api_bp.after_request
+def compress_api_response(response):
+    return compression.compress_response(response, request)
+
+def _history_etag(user_id, version):
+    return f"h{user_id}.{version}"
+
+def _client_history_version(user_id):
+    """Version the client last saw, read back from If-None-Match (None if unknown)"""
+    prefix = f"h{user_id}."
+    for etag in request.if_none_match.as_set(include_weak=True):
+        if etag.startswith(prefix) and etag[len(prefix):].isdigit():
+            return int(etag[len(prefix):])
+    return None
+
 @api_bp.route('/api/history', methods=['GET'])
 @login_required
 def get_history():
-    return jsonify({'history': history_db.get_user_history(current_user.id)})
+    """
+    History with conditional GET and delta sync.
+
+    Answers 304 while the user's history version is unchanged. With
+    ?since_id=N, only entries newer than N are returned ("delta": true),
+    unless the history was cleared after the client's version, in which
+    case the full list is sent so the client can replace its copy.
+    """
+    user_id = current_user.id
+    info = history_db.get_history_version(user_id)
+    etag = _history_etag(user_id, info['version'])
+    
+    if request.if_none_match.contains_weak(etag):
+        response = Response(status=304)
+        response.set_etag(etag, weak=True)
+        return response
+    
+    since_id = request.args.get('since_id', type=int)
+    client_version = _client_history_version(user_id)
+    delta = (since_id is not None and client_version is not None
+             and client_version >= info['cleared_version'])
+    
+    history = history_db.get_user_history(user_id, since_id=since_id if delta else None)
+    response = jsonify({'history': history, 'version': info['version'], 'delta': delta})
+    response.set_etag(etag, weak=True)
+    if info['updated_at']:
+        response.last_modified = datetime.strptime(info['updated_at'], '%Y-%m-%d %H:%M:%S').astimezone()
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 @api_bp.route('/api/history/clear', methods=['POST'])
 @login_required
@@ -157,8 +252,62 @@ def clear_history():
     history_db.clear_user_history(current_user.id)
     return jsonify({'message': 'History cleared'})
 
+def _export_options():
+    fmt = request.args.get('format', 'ndjson').lower()
+    compress = request.args.get('gzip', '0').lower() in ('1', 'true', 'yes')
+    return fmt, compress
+
+@api_bp.route('/api/history/export', methods=['GET'])
+@login_required
+def export_history():
+    """Stream the current user's history as NDJSON or CSV"""
+    fmt, compress = _export_options()
+    if fmt not in history_export.EXPORT_FORMATS:
+        return jsonify({'error': f'Unsupported format: {fmt}'}), 400
+
+    rows = history_db.iter_user_history(current_user.id)
+    return history_export.export_response(
+        rows, fmt, history_export.USER_EXPORT_FIELDS,
+        filename=f"history_user_{current_user.id}", compress=compress
+    )
+
+@api_bp.route('/api/admin/history/export', methods=['GET'])
+@login_required
+def export_all_history():
+    """Stream every user's history (admin only)"""
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Admin only'}), 403
+
+    fmt, compress = _export_options()
+    if fmt not in history_export.EXPORT_FORMATS:
+        return jsonify({'error': f'Unsupported format: {fmt}'}), 400
+
+    rows = history_db.iter_all_history_admin()
+    return history_export.export_response(
+        rows, fmt, history_export.ADMIN_EXPORT_FIELDS,
+        filename="history_all_users", compress=compress
+    )
+
+@api_bp.route('/api/admin/cache/stats', methods=['GET'])
+@login_required
+def cache_stats():
+    """Hit rates per cache namespace and backend (admin only)"""
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Admin only'}), 403
+    return jsonify({'backend': cache.CACHE_BACKEND, 'caches': cache.all_stats(),
+                    'speculative_tts': tts_service.speculation_stats(),
+                    'idempotency': idempotency.stats()})
+
 import tutor_db
 
+@api_bp.route('/api/admin/admission', methods=['GET'])
+@login_required
+def admission_stats():
+    """Rate limit rejections, upstream queue depths, provider quotas and password hashing (admin only)"""
+    if current_user.role != 'admin':
+        return jsonify({'error': 'Admin only'}), 403
+    return jsonify(dict(admission.stats(), passwords=passwords.stats()))
+
 @api_bp.route('/api/tutor/init', methods=['POST'])
 @login_required
 def init_tutor_session():
@@ -185,6 +334,8 @@ def init_tutor_session():
 
 @api_bp.route('/api/tutor/chat', methods=['POST'])
 @login_required
+@idempotent('tutor_chat')
+@rate_limited('tutor_chat')
 def chat_with_tutor():
     """Conversational Tutor with Memory"""
     try:
@@ -192,10 +343,16 @@ def chat_with_tutor():
         user_message = data.get('message')
         session_id = data.get('session_id')
         
-        if not user_message or not session_id:
-            desired_task = data.get('task_type', 'free_chat')
-            # Auto-create session if missing (fallback)
-            session_id = tutor_db.create_session(current_user.id, desired_task)
+        if not user_message:
+            return jsonify({'error': 'No message provided'}), 400
+        
+        if not session_id:
+            # Fall back to the active session; only create one if there is none
+            session = tutor_db.get_active_session(current_user.id)
+            if session:
+                session_id = session['id']
+            else:
+                session_id = tutor_db.create_session(current_user.id, data.get('task_type', 'free_chat'))
         
         # 1. Save User Message
         tutor_db.add_message(session_id, 'user', user_message)
@@ -220,8 +377,16 @@ def chat_with_tutor():
         if response_data.get('has_error'):
             update_user_weaknesses(current_user.id, response_data['correction'])
         
+        # 6. Start speaking the reply now; the client plays it via audio_url
+        audio_id = tts_service.register_speech(response_data['german_response'], 'de')
+        tts_service.speculate(response_data['german_response'], 'de')
+        response_data['audio_id'] = audio_id
+        response_data['audio_url'] = url_for('api.stream_text_to_speech', audio_id=audio_id)
+        
         return jsonify(response_data)
 
+    except admission.Overloaded:
+        raise
     except Exception as e:
         print(f"Tutor Error: {e}")
         return jsonify({'error': str(e)}), 500
@@ -234,6 +399,7 @@ def generate_tutor_response(message, history, profile):
     3. Maintains conversation flow
     """
     if not GROQ_API_KEY:
+        idempotency.dont_store()
         return {
             'german_response': "Entschuldigung, mein Gehirn (API Key) fehlt.",
             'english_translation': "Sorry, my brain (API Key) is missing.",
@@ -302,8 +468,8 @@ Teacher JSON:
 }}
 """
 
+    import requests
     try:
-        url = "https://api.groq.com/openai/v1/chat/completions"
         headers = {"Authorization": f"Bearer {GROQ_API_KEY}", "Content-Type": "application/json"}
         
         payload = {
@@ -316,7 +482,9 @@ Teacher JSON:
             "response_format": {"type": "json_object"}
         }
         
-        response = requests.post(url, headers=headers, json=payload, timeout=15)
+        with admission.upstream('groq'):
+            response = requests.post(GROQ_URL, headers=headers, json=payload, timeout=15)
+        admission.check_response('groq', response)
         response.raise_for_status()
         
         result = response.json()
@@ -326,8 +494,11 @@ Teacher JSON:
         # Apply filters
         return refine_tutor_response(parsed_response, message)
         
+    except admission.Overloaded:
+        raise
     except Exception as e:
         print(f"LLM Error: {e}")
+        idempotency.dont_store()
         return {
             'german_response': "Entschuldigung, ich habe das nicht verstanden.",
             'english_translation': "Sorry, I didn't understand that.",
@@ -381,11 +552,6 @@ def update_user_weaknesses(user_id, correction):
     if not correction: 
         return
         
-    profile = tutor_db.get_profile(user_id)
-    weaknesses = json.loads(profile['weaknesses'])
-    
     # very basic: just add the correction text if it's short
     # In reality, you'd want to categorize this (e.g. "Dative Case")
-    if len(weaknesses) < 5: 
-        weaknesses.append(correction[:50]) # keep it short
-        tutor_db.update_profile(user_id, weaknesses=weaknesses)
+    tutor_db.add_weakness(user_id, correction[:50], limit=5) # keep it short
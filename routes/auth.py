@@ -1,9 +1,16 @@
 from flask import Blueprint, render_template, request, redirect, url_for, flash
 from flask_login import login_user, login_required, logout_user, current_user
 import history_db
+import passwords
+from admission import Overloaded
 
 auth_bp = Blueprint('auth', __name__)
 
+def _busy(template, error):
+    """Re-render the form with a 429 when no hashing slot is free"""
+    flash(str(error), 'error')
+    return render_template(template), 429, {'Retry-After': str(error.retry_after)}
+
 @auth_bp.route('/login', methods=['GET', 'POST'])
 def login():
     if request.method == 'POST':
@@ -12,7 +19,13 @@ def login():
         
         user = history_db.get_user_by_username(username)
         
-        if user and history_db.verify_password(user, password):
+        try:
+            with passwords.login_slot():
+                valid = user is not None and history_db.verify_password(user, password)
+        except Overloaded as e:
+            return _busy('login.html', e)
+        
+        if valid:
             login_user(user)
             return redirect(url_for('main.index'))
         else:
@@ -31,7 +44,11 @@ def register():
             flash('Passwords do not match', 'error')
             return render_template('register.html')
         
-        success, message = history_db.create_user(username, password)
+        try:
+            with passwords.login_slot():
+                success, message = history_db.create_user(username, password)
+        except Overloaded as e:
+            return _busy('register.html', e)
         
         if success:
             flash('Registration successful! Please login.', 'success')
@@ -45,7 +62,10 @@ def register():
 @login_required
 def logout():
     logout_user()
-    return redirect(url_for('auth.login'))
+    response = redirect(url_for('auth.login'))
+    # Drop the cached history from the browser too; classroom machines are shared
+    response.headers['Clear-Site-Data'] = '"storage"'
+    return response
 
 @auth_bp.route('/change-password', methods=['GET', 'POST'])
 @login_required
@@ -55,13 +75,17 @@ def change_password():
         new_pw = request.form['new_password']
         confirm_pw = request.form['confirm_password']
         
-        if not history_db.verify_password(current_user, current_pw):
-            flash('Incorrect current password', 'error')
-        elif new_pw != confirm_pw:
-            flash('New passwords do not match', 'error')
-        else:
-            history_db.update_password(current_user.id, new_pw)
-            flash('Password updated successfully!', 'success')
-            return redirect(url_for('main.index'))
+        try:
+            with passwords.login_slot():
+                if not history_db.verify_password(current_user, current_pw):
+                    flash('Incorrect current password', 'error')
+                elif new_pw != confirm_pw:
+                    flash('New passwords do not match', 'error')
+                else:
+                    history_db.update_password(current_user.id, new_pw)
+                    flash('Password updated successfully!', 'success')
+                    return redirect(url_for('main.index'))
+        except Overloaded as e:
+            return _busy('change_password.html', e)
             
     return render_template('change_password.html')
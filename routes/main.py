@@ -1,6 +1,8 @@
-from flask import Blueprint, render_template, redirect, url_for, flash
+from flask import Blueprint, render_template, redirect, url_for, flash, request, send_file, abort, current_app
 from flask_login import login_required, current_user
 import history_db
+import cache
+import profiling
 
 main_bp = Blueprint('main', __name__)
 
@@ -19,5 +21,49 @@ def admin_dashboard():
     stats = history_db.get_user_stats()
     users = history_db.get_all_users()
     global_history = history_db.get_all_history_admin()
+    cache_stats = cache.all_stats()
+    endpoints = sorted({rule.endpoint for rule in current_app.url_map.iter_rules()} - {'static'})
     
-    return render_template('admin.html', stats=stats, users=users, global_history=global_history)
+    return render_template('admin.html', stats=stats, users=users, global_history=global_history,
+                           cache_stats=cache_stats, profiling_plan=profiling.get_plan(),
+                           profiling_captures=profiling.list_captures(), endpoints=endpoints)
+
+@main_bp.route('/admin/profiling', methods=['POST'])
+@login_required
+def arm_profiling():
+    if current_user.role != 'admin':
+        flash('Access denied: Admin only', 'error')
+        return redirect(url_for('main.index'))
+    
+    try:
+        profiling.arm(
+            endpoint=request.form.get('endpoint') or None,
+            user_id=request.form.get('user_id') or None,
+            requests=request.form.get('requests', 5),
+            sample_rate=request.form.get('sample_rate', 1.0),
+            memory=bool(request.form.get('memory')),
+            top=request.form.get('top', 25),
+        )
+    except ValueError:
+        flash('Invalid profiling settings', 'error')
+    return redirect(url_for('main.admin_dashboard'))
+
+@main_bp.route('/admin/profiling/stop', methods=['POST'])
+@login_required
+def stop_profiling():
+    if current_user.role != 'admin':
+        flash('Access denied: Admin only', 'error')
+        return redirect(url_for('main.index'))
+    profiling.disarm()
+    return redirect(url_for('main.admin_dashboard'))
+
+@main_bp.route('/admin/profiling/<name>.<kind>')
+@login_required
+def download_profile(name, kind):
+    """Raw .pstats / .tracemalloc file for offline analysis (snakeviz, pstats, tracemalloc.Snapshot.load)"""
+    if current_user.role != 'admin':
+        abort(403)
+    path = profiling.artifact_path(name, kind)
+    if path is None:
+        abort(404)
+    return send_file(path, as_attachment=True, download_name=f"{name}.{kind}")
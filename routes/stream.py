@@ -0,0 +1,90 @@
+from flask import Blueprint, request
+from flask_login import current_user
+from flask_sock import Sock, ConnectionClosed
+import json
+import admission
+import audio_preprocess
+import stt_service
+
+stream_bp = Blueprint('stream', __name__)
+sock = Sock()
+
+POLL_SECONDS = 0.2
+
+def send_event(ws, event_type, **fields):
+    ws.send(json.dumps({'type': event_type, **fields}))
+
+def is_end_message(message):
+    if message.strip() == 'end':
+        return True
+    try:
+        data = json.loads(message)
+    except ValueError:
+        return False
+    return isinstance(data, dict) and data.get('type') == 'end'
+
+@sock.route('/api/transcribe/stream', bp=stream_bp)
+def transcribe_stream(ws):
+    """
+    Incremental transcription over a WebSocket.
+
+    The client sends binary MediaRecorder chunks (or raw 16 kHz s16le with
+    ?format=pcm16) and a text message "end" when the speaker stops. The
+    server replies with {"type": "partial"} messages as segments are
+    recognized and one {"type": "final"} message with the whole transcript.
+    Streams count against the user's 'transcribe' rate limit and are cut
+    off with an error after MAX_AUDIO_SECONDS of audio.
+    """
+    if not current_user.is_authenticated:
+        send_event(ws, 'error', error='Login required')
+        return
+
+    language = request.args.get('lang', 'en')
+    fmt = request.args.get('format', 'webm')
+    if fmt not in stt_service.DECODERS:
+        send_event(ws, 'error', error=f'Unsupported format: {fmt}')
+        return
+
+    # Same per-user budget as uploads: one token to open, one per recognized segment
+    user_id = current_user.id
+
+    def charge():
+        allowed, retry_after, _ = admission.take_token(user_id, 'transcribe')
+        if not allowed:
+            raise admission.Overloaded('Rate limit exceeded for transcribe', retry_after)
+
+    try:
+        charge()
+        transcriber = stt_service.StreamingTranscriber(language, fmt, charge=charge)
+    except admission.Overloaded as e:
+        send_event(ws, 'error', error=str(e), retry_after=e.retry_after)
+        return
+    except RuntimeError as e:
+        send_event(ws, 'error', error=str(e))
+        return
+
+    try:
+        while True:
+            message = ws.receive(timeout=POLL_SECONDS)
+            if isinstance(message, bytes):
+                transcriber.feed(message)
+                if transcriber.seconds > audio_preprocess.MAX_AUDIO_SECONDS:
+                    send_event(ws, 'error',
+                               error=f'Recording longer than {audio_preprocess.MAX_AUDIO_SECONDS:.0f} seconds')
+                    return
+            elif message is not None and is_end_message(message):
+                break
+
+            partial = transcriber.poll_partial()
+            if partial is not None:
+                send_event(ws, 'partial', text=partial)
+
+        send_event(ws, 'final', text=transcriber.finish())
+    except ConnectionClosed:
+        pass
+    except admission.Overloaded as e:
+        send_event(ws, 'error', error=str(e), retry_after=e.retry_after)
+    except Exception as e:
+        send_event(ws, 'error', error=str(e))
+    finally:
+        transcriber.close()
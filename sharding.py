@@ -0,0 +1,59 @@
+"""
+User-partitioned storage routing shared by history_db and tutor_db
+
+With STORAGE_SHARDS=N (N > 1) each user's history and tutor data lives in
+one of N SQLite files next to the main database, picked by user_id % N, so
+writes from different users no longer serialize on one file lock. With
+the default (0 or 1) everything stays in the single main file.
+
+Row ids handed out to callers stay globally unique: a shard-local id is
+encoded as local_id * N + shard, so an id alone is enough to find its
+shard (e.g. a tutor session id passed in by the client).
+"""
+import os
+import threading
+from concurrent.futures import ThreadPoolExecutor
+
+STORAGE_SHARDS = int(os.getenv('STORAGE_SHARDS', '0'))
+
+def shard_count():
+    return STORAGE_SHARDS if STORAGE_SHARDS > 1 else 1
+
+def is_sharded():
+    return shard_count() > 1
+
+def shard_for_user(user_id):
+    return int(user_id) % shard_count()
+
+def shard_path(base_path, shard):
+    """translation_history.db -> translation_history.shard03.db"""
+    root, ext = os.path.splitext(base_path)
+    return f"{root}.shard{shard:02d}{ext or '.db'}"
+
+def shard_paths(base_path):
+    return [shard_path(base_path, shard) for shard in range(shard_count())]
+
+def encode_id(local_id, shard):
+    if local_id is None:
+        return None
+    return local_id * shard_count() + shard
+
+def decode_id(global_id):
+    """Return (shard, local_id) for an id produced by encode_id"""
+    global_id = int(global_id)
+    return global_id % shard_count(), global_id // shard_count()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def fan_out(fn, shards=None):
+    """Run fn(shard) for every shard in parallel and return results in shard order"""
+    global _executor
+    shards = list(range(shard_count())) if shards is None else shards
+    if len(shards) == 1:
+        return [fn(shards[0])]
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=min(8, shard_count()), thread_name_prefix='shard')
+    return list(_executor.map(fn, shards))
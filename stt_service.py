@@ -0,0 +1,260 @@
+"""
+Speech-to-text backends and incremental (streaming) transcription
+
+Audio is handled as 16 kHz mono 16-bit PCM throughout. The backend is
+picked with STT_BACKEND:
+- "google": Google Web Speech through SpeechRecognition (default)
+- "local": deterministic offline stand-in for tests and load runs
+"""
+import os
+import shutil
+import subprocess
+import threading
+from concurrent.futures import ThreadPoolExecutor
+import admission
+import audio_preprocess
+
+STT_BACKEND = os.getenv('STT_BACKEND', 'google')
+STT_WORKERS = int(os.getenv('STT_WORKERS', '4'))
+STREAM_SEGMENT_SECONDS = float(os.getenv('STREAM_SEGMENT_SECONDS', '4'))
+FFMPEG_BINARY = os.getenv('FFMPEG_BINARY', 'ffmpeg')
+
+SAMPLE_RATE = 16000
+SAMPLE_WIDTH = 2
+BYTES_PER_SECOND = SAMPLE_RATE * SAMPLE_WIDTH
+
+_recognizer = None
+_recognizer_lock = threading.Lock()
+
+def get_recognizer():
+    """Build the shared speech Recognizer on first use"""
+    global _recognizer
+    if _recognizer is None:
+        with _recognizer_lock:
+            if _recognizer is None:
+                import speech_recognition as sr
+                recognizer = sr.Recognizer()
+                recognizer.energy_threshold = 300
+                recognizer.dynamic_energy_threshold = True
+                _recognizer = recognizer
+    return _recognizer
+
+# --- Backends ---
+
+class GoogleSTTBackend:
+    name = 'google'
+
+    def recognize(self, pcm, language):
+        """Return the transcript of a PCM segment, or '' if nothing was understood"""
+        import speech_recognition as sr
+        if not pcm:
+            return ''
+        audio = sr.AudioData(pcm, SAMPLE_RATE, SAMPLE_WIDTH)
+        try:
+            with admission.upstream('google_stt'):
+                return get_recognizer().recognize_google(audio, language=language)
+        except sr.UnknownValueError:
+            return ''
+
+class LocalSTTBackend:
+    """Offline stand-in: 'transcribes' a segment as its duration"""
+    name = 'local'
+
+    def recognize(self, pcm, language):
+        if not pcm:
+            return ''
+        return f"[{language} {len(pcm) / BYTES_PER_SECOND:.1f}s]"
+
+BACKENDS = {
+    'google': GoogleSTTBackend,
+    'local': LocalSTTBackend,
+}
+
+def get_backend(name=None):
+    return BACKENDS.get(name or STT_BACKEND, GoogleSTTBackend)()
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=STT_WORKERS, thread_name_prefix='stt')
+    return _executor
+
+def recognize_segments(segments, language, backend=None):
+    """Recognize segments in parallel and join the transcripts in order"""
+    backend = backend or get_backend()
+    if len(segments) == 1:
+        return backend.recognize(segments[0], language)
+    futures = [admission.submit(get_executor(), backend.recognize, segment, language) for segment in segments]
+    texts = [future.result() for future in futures]
+    return ' '.join(t for t in texts if t)
+
+# --- Decoders ---
+
+class RawPCMDecoder:
+    """Pass-through for clients that already send 16 kHz mono s16le"""
+
+    def __init__(self):
+        self._buffer = bytearray()
+
+    def feed(self, data):
+        self._buffer.extend(data)
+
+    def read(self):
+        data = bytes(self._buffer)
+        self._buffer.clear()
+        return data
+
+    def finish(self):
+        return self.read()
+
+    def close(self):
+        pass
+
+class FFmpegDecoder:
+    """
+    Decode a growing container stream (e.g. MediaRecorder webm/ogg chunks)
+    to PCM incrementally by piping it through one long-lived ffmpeg process.
+    """
+
+    def __init__(self):
+        binary = shutil.which(FFMPEG_BINARY)
+        if not binary:
+            raise RuntimeError('ffmpeg is required for streaming transcription')
+        self._proc = subprocess.Popen(
+            [binary, '-loglevel', 'error', '-i', 'pipe:0',
+             '-f', 's16le', '-ac', '1', '-ar', str(SAMPLE_RATE), 'pipe:1'],
+            stdin=subprocess.PIPE, stdout=subprocess.PIPE, stderr=subprocess.DEVNULL
+        )
+        self._buffer = bytearray()
+        self._lock = threading.Lock()
+        self._reader = threading.Thread(target=self._read_stdout, daemon=True)
+        self._reader.start()
+
+    def _read_stdout(self):
+        while True:
+            data = self._proc.stdout.read1(8192)
+            if not data:
+                break
+            with self._lock:
+                self._buffer.extend(data)
+
+    def feed(self, data):
+        self._proc.stdin.write(data)
+        self._proc.stdin.flush()
+
+    def read(self):
+        with self._lock:
+            data = bytes(self._buffer)
+            self._buffer.clear()
+        return data
+
+    def finish(self):
+        self._proc.stdin.close()
+        self._proc.wait(timeout=30)
+        self._reader.join(timeout=5)
+        return self.read()
+
+    def close(self):
+        if self._proc.poll() is None:
+            self._proc.kill()
+            self._proc.wait()
+
+DECODERS = {
+    'pcm16': RawPCMDecoder,
+    'webm': FFmpegDecoder,
+    'ogg': FFmpegDecoder,
+}
+
+# --- Streaming ---
+
+class StreamingTranscriber:
+    """
+    Incremental recognition over rolling segments.
+
+    Once `segment_seconds` of decoded PCM have built up, the buffer is cut
+    at its last pause (or hard-cut at twice that length if the speaker
+    never pauses) and the segment is recognized on the shared pool. Silent
+    segments are skipped. By the time the speaker stops only the last few
+    seconds are left to recognize.
+
+    `charge` is called before each segment goes to the backend and may
+    raise (e.g. admission.Overloaded) to stop the stream.
+    """
+
+    def __init__(self, language, fmt='webm', backend=None, segment_seconds=None, charge=None):
+        self.language = language
+        self.backend = backend or get_backend()
+        self.decoder = DECODERS[fmt]()
+        self.segment_bytes = int((segment_seconds or STREAM_SEGMENT_SECONDS) * SAMPLE_RATE) * SAMPLE_WIDTH
+        self.charge = charge
+        self.received_bytes = 0
+        self._pcm = bytearray()
+        self._futures = []
+        self._last_partial = ''
+
+    @property
+    def seconds(self):
+        """Decoded audio received so far"""
+        return self.received_bytes / BYTES_PER_SECOND
+
+    def _add_pcm(self, pcm):
+        self.received_bytes += len(pcm)
+        self._pcm.extend(pcm)
+
+    def _submit(self, segment):
+        if audio_preprocess.is_silent(segment):
+            return
+        if self.charge:
+            self.charge()
+        self._futures.append(admission.submit(get_executor(), self.backend.recognize, segment, self.language))
+
+    def _cut_segments(self):
+        while len(self._pcm) >= self.segment_bytes:
+            cut = audio_preprocess.last_pause_offset(bytes(self._pcm))
+            if cut is None or cut < self.segment_bytes // 2:
+                if len(self._pcm) < self.segment_bytes * 2:
+                    break  # give the speaker a moment longer to pause
+                cut = self.segment_bytes
+            segment = bytes(self._pcm[:cut])
+            del self._pcm[:cut]
+            self._submit(segment)
+
+    def feed(self, chunk):
+        self.decoder.feed(chunk)
+        self._add_pcm(self.decoder.read())
+        self._cut_segments()
+
+    def poll_partial(self):
+        """Return the transcript of finished leading segments if it changed, else None"""
+        self._add_pcm(self.decoder.read())
+        self._cut_segments()
+        texts = []
+        for future in self._futures:
+            if not future.done():
+                break
+            texts.append(future.result())
+        partial = ' '.join(t for t in texts if t)
+        if partial == self._last_partial:
+            return None
+        self._last_partial = partial
+        return partial
+
+    def finish(self):
+        """Flush the decoder, recognize the tail and return the full transcript"""
+        self._add_pcm(self.decoder.finish())
+        self._cut_segments()
+        if self._pcm:
+            self._submit(bytes(self._pcm))
+            self._pcm.clear()
+        texts = [future.result() for future in self._futures]
+        return ' '.join(t for t in texts if t)
+
+    def close(self):
+        for future in self._futures:
+            future.cancel()
+        self.decoder.close()
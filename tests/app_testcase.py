@@ -0,0 +1,48 @@
+"""Shared fixtures: throwaway databases, and an app with a logged-in client"""
+import unittest
+import sys
+import os
+import tempfile
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache
+import history_db
+import tutor_db
+from app import create_app
+
+class DatabaseTestCase(unittest.TestCase):
+    """History and tutor databases in a temporary directory, with empty caches"""
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.addCleanup(self.tmpdir.cleanup)
+        original = (history_db.DB_NAME, tutor_db.DB_NAME)
+        self.addCleanup(self._restore_databases, original)
+        history_db.DB_NAME = os.path.join(self.tmpdir.name, 'history.db')
+        tutor_db.DB_NAME = os.path.join(self.tmpdir.name, 'tutor.db')
+        cache.reset_caches()
+
+    def _restore_databases(self, original):
+        history_db.DB_NAME, tutor_db.DB_NAME = original
+        cache.reset_caches()
+
+class AppTestCase(DatabaseTestCase):
+    """DatabaseTestCase plus an app whose client is logged in as `username` (None: nobody)"""
+
+    username = 'alice'
+
+    def setUp(self):
+        super().setUp()
+        self.app = self.create_app()
+        self.client = self.app.test_client()
+        if self.username:
+            history_db.create_user(self.username, 'pw')
+            self.login(self.username)
+
+    def create_app(self):
+        return create_app({'TESTING': True})
+
+    def login(self, username, password='pw', client=None):
+        return (client or self.client).post('/login', data={'username': username, 'password': password})
@@ -0,0 +1,122 @@
+import unittest
+import sys
+import os
+import threading
+import time
+from unittest import mock
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import admission
+import translation_service
+from app_testcase import AppTestCase
+
+class TestAdmissionUnits(unittest.TestCase):
+
+    def setUp(self):
+        admission.reset()
+
+    def tearDown(self):
+        admission.reset()
+
+    def test_bucket_allows_burst_then_rejects(self):
+        bucket = admission.TokenBucket(per_minute=60, burst=2)
+        self.assertTrue(bucket.take()[0])
+        self.assertTrue(bucket.take()[0])
+        allowed, retry_after, _ = bucket.take()
+        self.assertFalse(allowed)
+        self.assertGreater(retry_after, 0)
+        self.assertLessEqual(retry_after, 1)
+
+    def test_parse_duration(self):
+        self.assertEqual(admission.parse_duration('12'), 12)
+        self.assertAlmostEqual(admission.parse_duration('2m59.5s'), 179.5)
+        self.assertAlmostEqual(admission.parse_duration('1h2m'), 3720)
+        self.assertAlmostEqual(admission.parse_duration('250ms'), 0.25)
+        self.assertIsNone(admission.parse_duration('soon'))
+
+    def test_bulk_waits_behind_interactive(self):
+        gate = admission.PriorityGate('test', capacity=2, bulk_capacity=1)
+        gate.acquire(admission.BULK, timeout=1)
+        with self.assertRaises(admission.Overloaded):
+            gate.acquire(admission.BULK, timeout=0.05)  # bulk share used up
+
+        gate.acquire(admission.INTERACTIVE, timeout=1)
+        order = []
+        waiters = [
+            threading.Thread(target=lambda: (gate.acquire(admission.BULK, 2), order.append('bulk'))),
+            threading.Thread(target=lambda: (gate.acquire(admission.INTERACTIVE, 2), order.append('interactive'))),
+        ]
+        for waiter in waiters:
+            waiter.start()
+            time.sleep(0.05)
+        self.assertEqual(gate.stats()['queued'], {'interactive': 1, 'bulk': 1})
+
+        gate.release(admission.BULK)
+        time.sleep(0.05)
+        gate.release(admission.INTERACTIVE)
+        for waiter in waiters:
+            waiter.join(2)
+        self.assertEqual(order, ['interactive', 'bulk'])
+
+    def test_pool_work_keeps_submitter_lane(self):
+        from concurrent.futures import ThreadPoolExecutor
+        with ThreadPoolExecutor(1) as pool:
+            with admission.lane(admission.BULK):
+                inherited = admission.submit(pool, admission.current_lane).result()
+                plain = pool.submit(admission.current_lane).result()
+        self.assertEqual(inherited, admission.BULK)
+        self.assertEqual(plain, admission.INTERACTIVE)
+
+    def test_exhausted_quota_blocks_calls(self):
+        admission.record_quota('groq', {
+            'x-ratelimit-limit-requests': '100',
+            'x-ratelimit-remaining-requests': '5',
+            'x-ratelimit-reset-requests': '30s',
+        })
+        with admission.upstream('groq'):
+            pass
+        with admission.lane(admission.BULK), self.assertRaises(admission.Overloaded):
+            with admission.upstream('groq'):
+                pass
+
+        admission.record_quota('groq', {'retry-after': '20'}, status_code=429)
+        with self.assertRaises(admission.Overloaded) as raised:
+            with admission.upstream('groq'):
+                pass
+        self.assertGreaterEqual(raised.exception.retry_after, 19)
+        self.assertGreater(admission.stats()['quotas']['groq']['blocked_for'], 0)
+
+class TestRateLimitedRoutes(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        admission.reset()
+        self.addCleanup(admission.reset)
+
+        patches = [
+            mock.patch.dict(admission.RATE_LIMITS, {'translate': (60, 2)}),
+            mock.patch.object(translation_service, 'call_jigsawstack',
+                              lambda text, s, t: {'translated_text': text.upper()}),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_over_limit_gets_429_with_retry_after(self):
+        codes = [self.client.post('/api/translate', json={'text': f't{i}'}).status_code for i in range(3)]
+        self.assertEqual(codes, [200, 200, 429])
+
+        response = self.client.post('/api/translate', json={'text': 'again'}, headers={'Idempotency-Key': 'r1'})
+        self.assertEqual(response.status_code, 429)
+        self.assertGreaterEqual(int(response.headers['Retry-After']), 1)
+        self.assertEqual(admission.stats()['buckets']['rejected']['translate'], 2)
+
+        # A rejected attempt is not remembered under its idempotency key
+        admission.reset()
+        retry = self.client.post('/api/translate', json={'text': 'again'}, headers={'Idempotency-Key': 'r1'})
+        self.assertEqual(retry.json['translation'], 'AGAIN')
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,63 @@
+import unittest
+import sys
+import os
+import io
+from unittest import mock
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import audio_preprocess
+from app_testcase import AppTestCase
+from audio_preprocess import trim_silence, split_at_pauses, is_silent, SAMPLE_RATE, SAMPLE_WIDTH
+
+def tone(seconds, level=4000):
+    """Square wave, loud enough to count as speech"""
+    period = [level] * 20 + [-level] * 20
+    samples = (period * int(seconds * SAMPLE_RATE / len(period) + 1))[:int(seconds * SAMPLE_RATE)]
+    return b''.join(s.to_bytes(SAMPLE_WIDTH, 'little', signed=True) for s in samples)
+
+def silence(seconds):
+    return b'\x00\x00' * int(seconds * SAMPLE_RATE)
+
+def seconds(pcm):
+    return len(pcm) / (SAMPLE_RATE * SAMPLE_WIDTH)
+
+class TestAudioPreprocess(unittest.TestCase):
+
+    def test_trim_leading_and_trailing_silence(self):
+        trimmed = trim_silence(silence(2) + tone(1) + silence(3), padding_ms=100)
+        self.assertAlmostEqual(seconds(trimmed), 1.2, places=2)
+
+    def test_all_silent_clip_is_empty(self):
+        self.assertEqual(trim_silence(silence(1)), b'')
+        self.assertTrue(is_silent(silence(1)))
+        self.assertFalse(is_silent(tone(0.1)))
+
+    def test_split_at_pauses(self):
+        """Long recordings are cut inside pauses, never longer than the limit"""
+        pcm = tone(3) + silence(0.5) + tone(3) + silence(0.5) + tone(3)
+        segments = split_at_pauses(pcm, max_segment_seconds=5)
+        self.assertEqual(len(segments), 3)
+        self.assertTrue(all(seconds(s) <= 5 for s in segments))
+
+    def test_split_hard_cuts_without_pauses(self):
+        segments = split_at_pauses(tone(12), max_segment_seconds=5)
+        self.assertEqual([round(seconds(s)) for s in segments], [5, 5, 2])
+
+class TestUploadLimit(AppTestCase):
+
+    def create_app(self):
+        with mock.patch.object(audio_preprocess, 'MAX_AUDIO_BYTES', 1000):
+            return super().create_app()
+
+    def test_oversized_upload_rejected_before_parsing(self):
+        self.assertLess(self.app.config['MAX_CONTENT_LENGTH'], 100 * 1024)
+        with mock.patch.object(audio_preprocess, 'MAX_AUDIO_BYTES', 1000), \
+                mock.patch('flask.wrappers.Request.files', new_callable=mock.PropertyMock) as files:
+            response = self.client.post('/api/transcribe', data={'audio': (io.BytesIO(b'x' * 5000), 'a.webm')})
+        self.assertEqual(response.status_code, 413)
+        files.assert_not_called()
+
+if __name__ == '__main__':
+    unittest.main()
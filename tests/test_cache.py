@@ -0,0 +1,100 @@
+import unittest
+import sys
+import os
+import tempfile
+import time
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+from cache import LRUCache, SQLiteCache
+
+class CacheContract:
+    """Behaviour both backends must share"""
+
+    def make_cache(self, **kwargs):
+        raise NotImplementedError
+
+    def test_get_set_delete(self):
+        c = self.make_cache()
+        self.assertIsNone(c.get('k'))
+        c.set('k', {'text': 'Hallo'})
+        self.assertEqual(c.get('k'), {'text': 'Hallo'})
+        c.delete('k')
+        self.assertIsNone(c.get('k'))
+
+    def test_returns_copies(self):
+        c = self.make_cache()
+        c.set('k', {'items': []})
+        c.get('k')['items'].append('x')
+        self.assertEqual(c.get('k'), {'items': []})
+
+    def test_ttl_expiry(self):
+        c = self.make_cache()
+        c.set('k', 'v', ttl=0.01)
+        time.sleep(0.02)
+        self.assertIsNone(c.get('k'))
+
+    def test_add_only_when_absent(self):
+        c = self.make_cache()
+        self.assertTrue(c.add('k', 1))
+        self.assertFalse(c.add('k', 2))
+        self.assertEqual(c.get('k'), 1)
+
+    def test_hit_rate(self):
+        c = self.make_cache()
+        c.set('k', 'v')
+        c.get('k')
+        c.get('missing')
+        stats = c.stats()
+        self.assertEqual((stats['hits'], stats['misses']), (1, 1))
+        self.assertEqual(stats['hit_rate'], 0.5)
+
+class TestLRUCache(CacheContract, unittest.TestCase):
+
+    def make_cache(self, **kwargs):
+        return LRUCache('test', **kwargs)
+
+    def test_evicts_least_recently_used(self):
+        c = self.make_cache(max_entries=2)
+        c.set('a', 1)
+        c.set('b', 2)
+        c.get('a')
+        c.set('c', 3)
+        self.assertIsNone(c.get('b'))
+        self.assertEqual(c.get('a'), 1)
+
+class TestSQLiteCache(CacheContract, unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.path = os.path.join(self.tmpdir.name, 'cache.db')
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def make_cache(self, **kwargs):
+        return SQLiteCache('test', path=self.path, **kwargs)
+
+    def test_shared_between_instances(self):
+        """Two instances on one file behave like two workers sharing the cache"""
+        worker_a = self.make_cache()
+        worker_b = self.make_cache()
+        worker_a.set('k', 'from a')
+        self.assertEqual(worker_b.get('k'), 'from a')
+        self.assertFalse(worker_b.add('k', 'from b'))
+
+        worker_b.get('missing')
+        worker_b.flush_stats()
+        stats = worker_a.stats()
+        self.assertEqual((stats['shared_hits'], stats['shared_misses']), (1, 1))
+
+    def test_evict_trims_to_max_entries(self):
+        c = self.make_cache(max_entries=3)
+        for i in range(5):
+            c.set(str(i), i)
+        c.evict()
+        self.assertEqual(c.size(), 3)
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,48 @@
+import unittest
+import sys
+import os
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import history_db
+import tutor_db
+import db_maintenance
+from app_testcase import DatabaseTestCase
+
+class TestDbMaintenance(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        history_db.init_db()
+        tutor_db.init_db()
+
+    def test_chunked_count_matches_count(self):
+        history_db.create_user('alice', 'pw')
+        for i in range(25):
+            history_db.add_entry(1, 'en', 'de', str(i), str(i))
+        conn = db_maintenance.connect(history_db.DB_NAME, readonly=True)
+        try:
+            self.assertEqual(db_maintenance.chunked_count(conn, 'history', chunk_size=4), 25)
+        finally:
+            conn.close()
+
+    def test_hot_queries_use_indexes(self):
+        """Every checked query must avoid a full table scan"""
+        self.assertEqual(db_maintenance.main(['explain', '--strict']), 0)
+
+    def test_backup_copies_rows(self):
+        history_db.create_user('alice', 'pw')
+        dest = os.path.join(self.tmpdir.name, 'backups')
+        self.assertEqual(db_maintenance.main(['--db', 'history', 'backup', dest]), 0)
+
+        backups = os.listdir(dest)
+        self.assertEqual(len(backups), 1)
+        conn = db_maintenance.connect(os.path.join(dest, backups[0]), readonly=True)
+        try:
+            self.assertEqual(conn.execute('SELECT username FROM users').fetchone()[0], 'alice')
+        finally:
+            conn.close()
+
+if __name__ == '__main__':
+    unittest.main()
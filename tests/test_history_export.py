@@ -0,0 +1,59 @@
+import unittest
+import sys
+import os
+import gzip
+import json
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import history_db
+from app_testcase import DatabaseTestCase
+from history_export import ndjson_lines, csv_lines, encode_chunks, gzip_chunks, USER_EXPORT_FIELDS
+
+class TestHistoryExport(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        history_db.init_db()
+        history_db.create_user('alice', 'pw')
+        history_db.create_user('bob', 'pw')
+
+    def test_iter_user_history_batches(self):
+        """Rows come back oldest-first across batch boundaries, only for the user"""
+        for i in range(7):
+            history_db.add_entry(1, 'en', 'de', f'hello {i}', f'hallo {i}')
+        history_db.add_entry(2, 'en', 'de', 'other', 'andere')
+
+        rows = list(history_db.iter_user_history(1, batch_size=3))
+
+        self.assertEqual([r['original_text'] for r in rows], [f'hello {i}' for i in range(7)])
+
+    def test_iter_all_history_admin_includes_username(self):
+        history_db.add_entry(1, 'en', 'de', 'a', 'b')
+        history_db.add_entry(2, 'de', 'en', 'c', 'd')
+
+        rows = list(history_db.iter_all_history_admin(batch_size=1))
+
+        self.assertEqual([r['username'] for r in rows], ['alice', 'bob'])
+
+    def test_ndjson_lines(self):
+        lines = list(ndjson_lines([{'id': 1, 'original_text': 'Grüß Gott'}]))
+        self.assertEqual(json.loads(lines[0]), {'id': 1, 'original_text': 'Grüß Gott'})
+        self.assertTrue(lines[0].endswith('\n'))
+
+    def test_csv_lines_header_and_quoting(self):
+        rows = [{'id': 1, 'timestamp': 't', 'source_lang': 'en', 'target_lang': 'de',
+                 'original_text': 'Hello, "world"', 'translated_text': 'Hallo'}]
+        lines = list(csv_lines(rows, USER_EXPORT_FIELDS))
+        self.assertEqual(lines[0].strip(), ','.join(USER_EXPORT_FIELDS))
+        self.assertIn('"Hello, ""world"""', lines[1])
+
+    def test_gzip_round_trip(self):
+        lines = (f'line {i}\n' for i in range(1000))
+        compressed = b''.join(gzip_chunks(encode_chunks(lines, flush_size=128)))
+        self.assertEqual(gzip.decompress(compressed).decode('utf-8'),
+                         ''.join(f'line {i}\n' for i in range(1000)))
+
+if __name__ == '__main__':
+    unittest.main()
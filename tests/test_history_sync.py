@@ -0,0 +1,62 @@
+import unittest
+import sys
+import os
+import gzip
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import history_db
+from app_testcase import AppTestCase
+
+class TestHistorySync(AppTestCase):
+
+    def test_not_modified_until_history_changes(self):
+        first = self.client.get('/api/history')
+        etag = first.headers['ETag']
+
+        self.assertEqual(self.client.get('/api/history', headers={'If-None-Match': etag}).status_code, 304)
+
+        history_db.add_entry(1, 'en', 'de', 'hello', 'hallo')
+        self.assertEqual(self.client.get('/api/history', headers={'If-None-Match': etag}).status_code, 200)
+
+    def test_delta_since_id(self):
+        old = history_db.add_entry(1, 'en', 'de', 'one', 'eins')
+        etag = self.client.get('/api/history').headers['ETag']
+        history_db.add_entry(1, 'en', 'de', 'two', 'zwei')
+
+        data = self.client.get(f"/api/history?since_id={old['id']}", headers={'If-None-Match': etag}).json
+
+        self.assertTrue(data['delta'])
+        self.assertEqual([e['original_text'] for e in data['history']], ['two'])
+
+    def test_clear_forces_full_response(self):
+        old = history_db.add_entry(1, 'en', 'de', 'one', 'eins')
+        etag = self.client.get('/api/history').headers['ETag']
+        history_db.clear_user_history(1)
+        history_db.add_entry(1, 'en', 'de', 'two', 'zwei')
+
+        data = self.client.get(f"/api/history?since_id={old['id']}", headers={'If-None-Match': etag}).json
+
+        self.assertFalse(data['delta'], "Client must drop entries that were cleared")
+        self.assertEqual([e['original_text'] for e in data['history']], ['two'])
+
+    def test_logout_clears_browser_copy(self):
+        page = self.client.get('/').get_data(as_text=True)
+        self.assertIn('sessionStorage.setItem(HISTORY_STORE_KEY', page)
+        self.assertNotIn('localStorage.setItem', page)
+
+        response = self.client.get('/logout')
+        self.assertEqual(response.headers['Clear-Site-Data'], '"storage"')
+
+    def test_large_responses_are_gzipped(self):
+        for i in range(50):
+            history_db.add_entry(1, 'en', 'de', f'sentence number {i}', f'Satz Nummer {i}')
+
+        response = self.client.get('/api/history', headers={'Accept-Encoding': 'gzip'})
+
+        self.assertEqual(response.headers['Content-Encoding'], 'gzip')
+        self.assertIn(b'Satz Nummer 49', gzip.decompress(response.data))
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,110 @@
+import unittest
+import sys
+import os
+import threading
+import time
+from unittest import mock
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache
+import history_db
+import tutor_db
+import idempotency
+import translation_service
+import tts_service
+from app_testcase import AppTestCase
+
+class TestIdempotency(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        self.upstream_calls = 0
+        patches = [
+            mock.patch.object(translation_service, 'call_jigsawstack', self.fake_jigsawstack),
+            mock.patch.object(tts_service, 'speculate', lambda text, lang: None),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def fake_jigsawstack(self, text, source_lang, target_lang):
+        self.upstream_calls += 1
+        time.sleep(0.2)
+        return {'translated_text': f"{text} auf Deutsch"}
+
+    def translate(self, text, key=None, client=None):
+        headers = {'Idempotency-Key': key} if key else {}
+        return (client or self.client).post('/api/translate', json={'text': text}, headers=headers)
+
+    def test_retry_replays_first_result(self):
+        first = self.translate('hello', key='k1')
+        cache.get_cache('translations').delete(cache.make_key('en', 'de', 'hello'))
+        retry = self.translate('hello', key='k1')
+
+        self.assertEqual(self.upstream_calls, 1)
+        self.assertEqual(retry.json, first.json)
+        self.assertEqual(retry.headers['Idempotent-Replayed'], 'true')
+        self.assertEqual(len(history_db.get_user_history(1)), 1)
+
+    def test_concurrent_retry_waits_for_original(self):
+        results = []
+        clients = [self.app.test_client() for _ in range(2)]
+        for client in clients:
+            self.login('alice', client=client)
+        threads = [threading.Thread(target=lambda c=c: results.append(self.translate('hi', 'k2', c)))
+                   for c in clients]
+        for thread in threads:
+            thread.start()
+        for thread in threads:
+            thread.join()
+
+        self.assertEqual(self.upstream_calls, 1)
+        self.assertEqual([r.status_code for r in results], [200, 200])
+        self.assertEqual(len(history_db.get_user_history(1)), 1)
+
+    def test_provider_fallback_is_not_replayed(self):
+        from routes import api
+        replies = iter([{'german_response': 'Entschuldigung', 'english_translation': 'Sorry', 'has_error': False},
+                        {'german_response': 'Gut!', 'english_translation': 'Good!', 'has_error': False}])
+
+        def fake_tutor(message, history, profile):
+            reply = next(replies)
+            if reply['german_response'] == 'Entschuldigung':
+                idempotency.dont_store()
+            return reply
+
+        with mock.patch.object(api, 'generate_tutor_response', fake_tutor):
+            first = self.client.post('/api/tutor/chat', json={'message': 'Hallo'}, headers={'Idempotency-Key': 'f1'})
+            retry = self.client.post('/api/tutor/chat', json={'message': 'Hallo'}, headers={'Idempotency-Key': 'f1'})
+        self.assertEqual(first.json['german_response'], 'Entschuldigung')
+        self.assertEqual(retry.json['german_response'], 'Gut!')
+        self.assertNotIn('Idempotent-Replayed', retry.headers)
+
+    def test_key_reused_for_other_body_is_rejected(self):
+        self.translate('hello', key='k3')
+        self.assertEqual(self.translate('bye', key='k3').status_code, 422)
+
+    def test_without_key_nothing_is_deduplicated(self):
+        before = idempotency.stats()['with_key']
+        self.translate('hello')
+        self.translate('hello')
+        self.assertEqual(len(history_db.get_user_history(1)), 2)
+        self.assertEqual(idempotency.stats()['with_key'], before)
+
+    def test_chat_without_session_reuses_active_session(self):
+        session_id = self.client.post('/api/tutor/init', json={}).json['session_id']
+
+        self.assertEqual(self.client.post('/api/tutor/chat', json={'session_id': session_id}).status_code, 400)
+        from routes import api
+        reply = {'german_response': 'Gut!', 'english_translation': 'Good!', 'has_error': False}
+        with mock.patch.object(api, 'generate_tutor_response', lambda message, history, profile: dict(reply)):
+            self.client.post('/api/tutor/chat', json={'message': 'Hallo'}, headers={'Idempotency-Key': 'c1'})
+            self.client.post('/api/tutor/chat', json={'message': 'Hallo'}, headers={'Idempotency-Key': 'c1'})
+
+        self.assertEqual(tutor_db.get_active_session(1)['id'], session_id)
+        self.assertEqual([m['role'] for m in tutor_db.get_session_history(session_id)], ['user', 'tutor'])
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,93 @@
+import unittest
+import sys
+import os
+import threading
+from unittest import mock
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache
+import history_db
+import passwords
+from app_testcase import AppTestCase
+
+def use_policy(testcase, method):
+    for patch in (mock.patch.object(passwords, 'PASSWORD_HASH_METHOD', method),
+                  mock.patch.object(passwords, '_policy_prefix', None)):
+        patch.start()
+        testcase.addCleanup(patch.stop)
+
+class TestPasswordHashing(unittest.TestCase):
+
+    def test_pool_and_inline_hashes_are_interchangeable(self):
+        use_policy(self, 'pbkdf2:sha256:1000')
+        pooled = passwords.hash_password('secret')
+        with mock.patch.object(passwords, 'PASSWORD_HASH_WORKERS', 0):
+            inline = passwords.hash_password('secret')
+            self.assertTrue(passwords.check_password(pooled, 'secret'))
+        self.assertTrue(passwords.check_password(inline, 'secret'))
+        self.assertFalse(passwords.check_password(inline, 'wrong'))
+
+    def test_needs_rehash_follows_policy(self):
+        use_policy(self, 'pbkdf2:sha256:1000')
+        current = passwords.hash_password('pw')
+        self.assertTrue(current.startswith('pbkdf2:sha256:1000$'))
+        self.assertFalse(passwords.needs_rehash(current))
+
+        use_policy(self, 'pbkdf2:sha256:2000')
+        self.assertTrue(passwords.needs_rehash(current))
+
+class TestLoginHashing(AppTestCase):
+
+    username = None
+
+    def test_outdated_hash_is_upgraded_on_login(self):
+        use_policy(self, 'pbkdf2:sha256:1000')
+        history_db.create_user('alice', 'pw')
+        history_db.get_user_by_id(1)  # identity is cached, the hash is not
+
+        use_policy(self, 'pbkdf2:sha256:2000')
+        self.assertEqual(self.login('alice', 'wrong').status_code, 200)
+        self.assertTrue(history_db.get_user_by_username('alice').password_hash.startswith('pbkdf2:sha256:1000$'))
+
+        self.assertEqual(self.login('alice', 'pw').status_code, 302)
+        upgraded = history_db.get_user_by_id(1).password_hash
+        self.assertTrue(upgraded.startswith('pbkdf2:sha256:2000$'))
+
+        self.client.get('/logout')
+        self.assertEqual(self.login('alice', 'pw').status_code, 302)
+        self.assertEqual(history_db.get_user_by_username('alice').password_hash, upgraded)
+
+    def test_cached_user_sees_changes_made_elsewhere(self):
+        history_db.create_user('alice', 'pw')
+        history_db.get_user_by_id(1)
+        self.assertEqual(cache.get_cache('users').get('1'), {'id': 1, 'username': 'alice'})
+
+        # Another worker changes the password and role; its cache delete never reaches us
+        conn = history_db.get_db_connection()
+        conn.execute("UPDATE users SET password_hash = ?, role = 'user' WHERE id = 1",
+                     (passwords.hash_password('new'),))
+        conn.commit()
+        conn.close()
+
+        user = history_db.get_user_by_id(1)
+        self.assertEqual(user.role, 'user')
+        self.assertFalse(history_db.verify_password(user, 'pw'))
+        self.assertTrue(history_db.verify_password(user, 'new'))
+
+    def test_login_is_turned_away_when_all_slots_are_busy(self):
+        history_db.create_user('alice', 'pw')
+        slots = threading.BoundedSemaphore(1)
+        slots.acquire()
+        with mock.patch.object(passwords, '_slots', slots), mock.patch.object(passwords, 'LOGIN_WAIT', 0.01):
+            response = self.login('alice', 'pw')
+        self.assertEqual(response.status_code, 429)
+        self.assertEqual(response.headers['Retry-After'], '2')
+        self.assertIn(b'Too many sign-ins', response.data)
+
+        slots.release()
+        self.assertEqual(self.login('alice', 'pw').status_code, 302)
+
+if __name__ == '__main__':
+    unittest.main()
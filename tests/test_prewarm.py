@@ -0,0 +1,93 @@
+import unittest
+import sys
+import os
+import io
+import json
+import tempfile
+from contextlib import redirect_stdout
+from unittest import mock
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache
+import prewarm
+import translation_service
+import tts_service
+
+CURRICULUM = {
+    'pairs': [['en', 'de']],
+    'tts': ['de'],
+    'lessons': [
+        {'name': 'Greetings', 'phrases': ['Good morning', 'Hello. Bye.', 'Good morning']},
+        {'name': 'Food', 'phrases': ['Bread', 'broken']},
+    ],
+}
+
+class TestPrewarm(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.original = (cache.CACHE_BACKEND, cache.CACHE_PATH, tts_service.TTS_CACHE_DIR)
+        cache.CACHE_BACKEND = 'sqlite'
+        cache.CACHE_PATH = os.path.join(self.tmpdir.name, 'cache.db')
+        tts_service.TTS_CACHE_DIR = os.path.join(self.tmpdir.name, 'tts')
+        cache.reset_caches()
+
+        self.curriculum = os.path.join(self.tmpdir.name, 'curriculum.json')
+        with open(self.curriculum, 'w') as f:
+            json.dump(CURRICULUM, f)
+        self.translate_calls = []
+        self.tts_calls = []
+
+    def tearDown(self):
+        cache.CACHE_BACKEND, cache.CACHE_PATH, tts_service.TTS_CACHE_DIR = self.original
+        cache.reset_caches()
+        self.tmpdir.cleanup()
+
+    def fake_jigsawstack(self, text, source_lang, target_lang):
+        self.translate_calls.append(text)
+        if text == 'broken':
+            raise ConnectionError('provider down')
+        return {'translated_text': f"DE {text}"}
+
+    def fake_mp3(self, text, lang, path):
+        self.tts_calls.append(text)
+        os.makedirs(os.path.dirname(path), exist_ok=True)
+        with open(path, 'wb') as f:
+            f.write(b'mp3')
+
+    def run_main(self, *args):
+        with mock.patch.object(translation_service, 'call_jigsawstack', self.fake_jigsawstack), \
+                mock.patch.object(tts_service, 'generate_mp3', self.fake_mp3), \
+                redirect_stdout(io.StringIO()):
+            return prewarm.main([self.curriculum, '--backoff', '0', *args])
+
+    def test_warms_translations_and_sentences(self):
+        report = os.path.join(self.tmpdir.name, 'report.json')
+        self.assertEqual(self.run_main('--report', report), 1)  # 'broken' fails
+
+        self.assertEqual(translation_service.cached_translation('Good morning', 'en', 'de'), 'DE Good morning')
+        self.assertIsNotNone(tts_service.cached_path('DE Hello.', 'de'))
+        self.assertIsNotNone(tts_service.cached_path('Bye.', 'de'))
+        self.assertEqual(self.translate_calls.count('broken'), 3)  # first try + 2 retries
+
+        with open(report) as f:
+            data = json.load(f)
+        greetings = data['lessons'][0]
+        self.assertEqual((greetings['translated'], greetings['phrases']), (2, 2))
+        self.assertEqual(greetings['speech_cached'], greetings['speech_total'])
+        self.assertEqual([f['phrase'] for f in data['failures']], ['broken'])
+
+    def test_rerun_only_retries_what_is_missing(self):
+        self.run_main()
+        self.translate_calls.clear()
+        self.tts_calls.clear()
+        cache.reset_caches()  # a fresh process sharing the same cache file
+
+        self.run_main()
+        self.assertEqual(set(self.translate_calls), {'broken'})
+        self.assertEqual(self.tts_calls, [])
+
+if __name__ == '__main__':
+    unittest.main()
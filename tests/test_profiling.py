@@ -0,0 +1,89 @@
+import unittest
+import sys
+import os
+import pstats
+import tracemalloc
+from unittest import mock
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import history_db
+import profiling
+from app_testcase import AppTestCase
+
+class TestProfiling(AppTestCase):
+
+    username = 'admin'
+
+    def create_app(self):
+        patch = mock.patch.object(profiling, 'PROFILE_DIR', os.path.join(self.tmpdir.name, 'profiles'))
+        patch.start()
+        self.addCleanup(patch.stop)
+        return super().create_app()
+
+    def setUp(self):
+        super().setUp()
+        history_db.create_user('bob', 'pw')
+
+    def tearDown(self):
+        profiling.disarm()
+
+    def test_nothing_captured_when_disarmed(self):
+        self.client.get('/api/history')
+        self.assertEqual(profiling.list_captures(), [])
+
+    def test_captures_matching_endpoint_then_disarms(self):
+        profiling.arm(endpoint='api.get_history', requests=2, memory=True, top=5)
+
+        self.client.get('/api/admin/cache/stats')
+        for _ in range(3):
+            self.client.get('/api/history')
+
+        captures = profiling.list_captures()
+        self.assertEqual(len(captures), 2)
+        self.assertIsNone(profiling.get_plan())
+        self.assertFalse(tracemalloc.is_tracing())
+
+        capture = captures[0]
+        self.assertEqual(capture['endpoint'], 'api.get_history')
+        self.assertEqual(capture['status'], 200)
+        self.assertLessEqual(len(capture['top_functions']), 5)
+        self.assertIn('peak_bytes', capture['memory'])
+        pstats.Stats(profiling.artifact_path(capture['name'], 'pstats'))
+        tracemalloc.Snapshot.load(profiling.artifact_path(capture['name'], 'tracemalloc'))
+
+    def test_streamed_response_profiled_until_body_is_sent(self):
+        for i in range(50):
+            history_db.add_entry(1, 'en', 'de', f'hello {i}', f'hallo {i}')
+        profiling.arm(endpoint='api.export_history', requests=1, memory=False)
+
+        response = self.client.get('/api/history/export?format=csv')
+        self.assertEqual(profiling.list_captures(), [])  # body not consumed yet
+        body = response.get_data()
+        response.close()
+
+        self.assertIn(b'hallo 49', body)
+        capture = profiling.list_captures()[0]
+        self.assertEqual(capture['endpoint'], 'api.export_history')
+        stats = pstats.Stats(profiling.artifact_path(capture['name'], 'pstats')).stats
+        self.assertTrue(any(filename.endswith('history_export.py') for filename, _, _ in stats))
+
+    def test_user_filter(self):
+        profiling.arm(user_id=2, requests=1, memory=False)
+        self.client.get('/api/history')
+        self.assertEqual(profiling.list_captures(), [])
+
+    def test_dashboard_arm_and_download(self):
+        response = self.client.post('/admin/profiling', data={'endpoint': 'api.get_history', 'requests': '1'})
+        self.assertEqual(response.status_code, 302)
+        self.client.get('/api/history')
+
+        name = profiling.list_captures()[0]['name']
+        page = self.client.get('/admin').get_data(as_text=True)
+        self.assertIn('/api/history', page)
+        self.assertEqual(self.client.get(f'/admin/profiling/{name}.pstats').status_code, 200)
+        self.assertEqual(self.client.get('/admin/profiling/..%2Farmed.json').status_code, 404)
+
+if __name__ == '__main__':
+    unittest.main()
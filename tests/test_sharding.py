@@ -0,0 +1,110 @@
+import unittest
+import json
+import sys
+import os
+import io
+from contextlib import redirect_stdout
+from unittest import mock
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import cache
+import sharding
+import history_db
+import tutor_db
+import db_maintenance
+from app_testcase import DatabaseTestCase
+
+class TestSharding(DatabaseTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patch = mock.patch.object(sharding, 'STORAGE_SHARDS', 4)
+        patch.start()
+        self.addCleanup(patch.stop)
+        history_db.init_db()
+        tutor_db.init_db()
+        for name in ('alice', 'bob', 'carol'):
+            history_db.create_user(name, 'pw')
+
+    def test_ids_round_trip(self):
+        for shard in range(4):
+            self.assertEqual(sharding.decode_id(sharding.encode_id(17, shard)), (shard, 17))
+
+    def test_history_lands_in_user_shard(self):
+        history_db.add_entry(1, 'en', 'de', 'one', 'eins')
+        history_db.add_entry(2, 'en', 'de', 'two', 'zwei')
+
+        for user_id in (1, 2):
+            path = sharding.shard_path(history_db.DB_NAME, sharding.shard_for_user(user_id))
+            conn = db_maintenance.connect(path, readonly=True)
+            try:
+                owners = {row[0] for row in conn.execute('SELECT user_id FROM history')}
+            finally:
+                conn.close()
+            self.assertEqual(owners, {user_id})
+
+    def test_since_id_and_clear_stay_per_user(self):
+        first = history_db.add_entry(1, 'en', 'de', 'one', 'eins')
+        history_db.add_entry(1, 'en', 'de', 'two', 'zwei')
+        history_db.add_entry(2, 'en', 'de', 'other', 'andere')
+
+        delta = history_db.get_user_history(1, since_id=first['id'])
+        self.assertEqual([e['original_text'] for e in delta], ['two'])
+
+        history_db.clear_user_history(1)
+        self.assertEqual(history_db.get_user_history(1), [])
+        self.assertEqual(len(history_db.get_user_history(2)), 1)
+
+    def test_admin_views_fan_out(self):
+        for user_id in (1, 2, 3):
+            history_db.add_entry(user_id, 'en', 'de', f'text {user_id}', 'x')
+
+        stats = {s['username']: s['translation_count'] for s in history_db.get_user_stats()}
+        self.assertEqual(stats, {'alice': 1, 'bob': 1, 'carol': 1})
+
+        everything = history_db.get_all_history_admin()
+        self.assertEqual({e['username'] for e in everything}, {'alice', 'bob', 'carol'})
+        self.assertEqual(len({e['id'] for e in everything}), 3)
+        self.assertEqual(len(list(history_db.iter_all_history_admin(batch_size=1))), 3)
+
+    def test_tutor_session_routes_by_id(self):
+        session_id = tutor_db.create_session(3)
+        tutor_db.add_message(session_id, 'user', 'Hallo')
+
+        self.assertEqual(tutor_db.get_active_session(3)['id'], session_id)
+        history = tutor_db.get_session_history(session_id)
+        self.assertEqual([m['content'] for m in history], ['Hallo'])
+        self.assertEqual(history[0]['session_id'], session_id)
+
+    def test_weakness_append_ignores_stale_cached_profile(self):
+        tutor_db.get_profile(2)  # now cached in this worker
+        # Another worker appends; its cache delete never reaches us
+        tutor_db.update_profile(2, weaknesses=['der Hund'])
+        cache.get_cache('tutor_profiles').set('2', dict(tutor_db.get_profile(2), weaknesses='[]'))
+
+        self.assertTrue(tutor_db.add_weakness(2, 'dem Mann', limit=2))
+        self.assertFalse(tutor_db.add_weakness(2, 'die Frau', limit=2))
+        self.assertEqual(json.loads(tutor_db.get_profile(2)['weaknesses']), ['der Hund', 'dem Mann'])
+
+    def test_shard_migrate_moves_single_file_data(self):
+        sharding.STORAGE_SHARDS = 0
+        tutor_db.init_db()
+        history_db.add_entry(2, 'en', 'de', 'before', 'vorher')
+        session_id = tutor_db.create_session(2)
+        tutor_db.add_message(session_id, 'user', 'Hallo')
+
+        sharding.STORAGE_SHARDS = 4
+        with redirect_stdout(io.StringIO()):
+            self.assertEqual(db_maintenance.main(['shard-migrate']), 0)
+
+        self.assertEqual([e['original_text'] for e in history_db.get_user_history(2)], ['before'])
+        version = history_db.get_history_version(2)
+        self.assertEqual(version['cleared_version'], version['version'])
+        self.assertGreater(version['version'], 1)
+        moved = tutor_db.get_active_session(2)
+        self.assertEqual([m['content'] for m in tutor_db.get_session_history(moved['id'])], ['Hallo'])
+
+if __name__ == '__main__':
+    unittest.main()
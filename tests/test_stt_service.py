@@ -0,0 +1,78 @@
+import unittest
+import sys
+import os
+import time
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import stt_service
+from stt_service import StreamingTranscriber, LocalSTTBackend, BYTES_PER_SECOND
+
+LOUD = (4000).to_bytes(2, 'little', signed=True)
+SILENCE = b'\x00\x00'
+
+class TestStreamingTranscriber(unittest.TestCase):
+
+    def make(self, segment_seconds=1):
+        return StreamingTranscriber('de', fmt='pcm16', backend=LocalSTTBackend(),
+                                    segment_seconds=segment_seconds)
+
+    def wait_for_partial(self, transcriber):
+        for _ in range(50):
+            partial = transcriber.poll_partial()
+            if partial is not None:
+                return partial
+            time.sleep(0.01)
+        return None
+
+    def test_partials_before_end_of_speech(self):
+        """Full segments are recognized while audio is still arriving"""
+        transcriber = self.make()
+        transcriber.feed(LOUD * int(BYTES_PER_SECOND * 1.5))  # three seconds, no pauses
+
+        self.assertEqual(self.wait_for_partial(transcriber), '[de 1.0s] [de 1.0s]')
+        self.assertIsNone(transcriber.poll_partial(), "Unchanged partials are not repeated")
+        transcriber.close()
+
+    def test_final_includes_tail(self):
+        transcriber = self.make()
+        transcriber.feed(LOUD * int(BYTES_PER_SECOND * 0.75))
+        self.assertEqual(transcriber.finish(), '[de 1.5s]', "Short clips stay in one segment")
+        transcriber.close()
+
+    def test_segments_cut_at_pauses_and_silence_skipped(self):
+        transcriber = self.make()
+        speech = LOUD * int(BYTES_PER_SECOND * 0.4)  # 0.8 s
+        pause = SILENCE * int(BYTES_PER_SECOND * 0.25)  # 0.5 s
+        audio = speech + pause + speech + pause + SILENCE * BYTES_PER_SECOND
+        chunk = BYTES_PER_SECOND // 10  # fed as 100 ms chunks, like a live recorder
+        for i in range(0, len(audio), chunk):
+            transcriber.feed(audio[i:i + chunk])
+
+        # One segment per utterance, the trailing silence is never sent
+        self.assertEqual(transcriber.finish().count('[de'), 2)
+        transcriber.close()
+
+    def test_each_segment_is_charged(self):
+        charges = []
+        def charge():
+            charges.append(1)
+            if len(charges) > 2:
+                raise RuntimeError('over budget')
+        transcriber = StreamingTranscriber('de', fmt='pcm16', backend=LocalSTTBackend(),
+                                           segment_seconds=1, charge=charge)
+        transcriber.feed(SILENCE * BYTES_PER_SECOND)  # silent segments are free
+        transcriber.feed(LOUD * int(BYTES_PER_SECOND * 1.5))
+        self.assertEqual(len(charges), 2)
+        self.assertAlmostEqual(transcriber.seconds, 5.0)
+
+        with self.assertRaises(RuntimeError):
+            transcriber.finish()  # the tail is a third segment
+        transcriber.close()
+
+    def test_backend_selection(self):
+        self.assertIsInstance(stt_service.get_backend('local'), LocalSTTBackend)
+
+if __name__ == '__main__':
+    unittest.main()
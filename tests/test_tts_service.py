@@ -0,0 +1,231 @@
+import unittest
+import sys
+import os
+import tempfile
+import time
+import threading
+from unittest import mock
+
+# Add parent directory to path to import modules
+sys.path.append(os.path.dirname(os.path.dirname(os.path.abspath(__file__))))
+
+import admission
+import cache
+import tts_service
+from app_testcase import AppTestCase
+
+class TestTtsStreaming(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+
+    def tearDown(self):
+        self.tmpdir.cleanup()
+
+    def fake_synthesize(self, text, lang):
+        """Later sentences finish first, to prove output stays in order"""
+        time.sleep(0.05 / (len(text) + 1))
+        path = os.path.join(self.tmpdir.name, f"{abs(hash((text, lang)))}.mp3")
+        with open(path, 'wb') as f:
+            f.write(f"<{text}>".encode('utf-8'))
+        return path
+
+    def test_split_sentences(self):
+        self.assertEqual(tts_service.split_sentences("Hallo! Wie geht's? Gut."),
+                         ["Hallo!", "Wie geht's?", "Gut."])
+
+    def test_split_long_sentence_at_word_boundary(self):
+        chunks = tts_service.split_sentences("eins zwei drei vier", max_chars=10)
+        self.assertTrue(all(len(c) <= 10 for c in chunks))
+        self.assertEqual(" ".join(chunks), "eins zwei drei vier")
+
+    def test_split_long_word_is_hard_cut_at_limit(self):
+        word = "Donaudampfschifffahrtsgesellschaftskapitän"
+        chunks = tts_service.split_sentences(word, max_chars=10)
+        self.assertEqual(max(len(c) for c in chunks), 10)
+        self.assertEqual("".join(chunks), word)
+
+    def test_stream_keeps_sentence_order(self):
+        with mock.patch.object(tts_service, 'synthesize', self.fake_synthesize):
+            audio = b''.join(tts_service.stream_speech("A. Bb. Ccc. Dddd.", 'de', window=4))
+        self.assertEqual(audio, b"<A.><Bb.><Ccc.><Dddd.>")
+
+class TestSpeculativeTts(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        self.original_dir = tts_service.TTS_CACHE_DIR
+        tts_service.TTS_CACHE_DIR = self.tmpdir.name
+        tts_service._speculations.clear()
+        cache.reset_caches()
+        self.generated = []
+        self.release = threading.Event()
+
+    def tearDown(self):
+        self.release.set()
+        tts_service.get_executor().submit(lambda: None).result()
+        tts_service.get_speculation_executor().submit(lambda: None).result()
+        tts_service.TTS_CACHE_DIR = self.original_dir
+        tts_service._speculations.clear()
+        cache.reset_caches()
+        self.tmpdir.cleanup()
+
+    def slow_mp3(self, text, lang, path):
+        self.generated.append(text)
+        self.release.wait(5)
+        with open(path, 'wb') as f:
+            f.write(text.encode('utf-8'))
+
+    def test_speculation_runs_in_bulk_lane(self):
+        lanes = []
+        def record_lane(text, lang, path):
+            lanes.append(admission.current_lane())
+            with open(path, 'wb') as f:
+                f.write(b'mp3')
+        with mock.patch.object(tts_service, 'generate_mp3', record_lane):
+            audio_id = tts_service.speculate("Hallo! Wie geht's?", 'de')
+            for future in tts_service._speculations[audio_id]['futures']:
+                future.result(5)
+            tts_service.synthesize("Gut, danke.", 'de')
+        self.assertEqual(lanes, [admission.BULK, admission.BULK, admission.INTERACTIVE])
+
+    def test_request_joins_speculative_synthesis(self):
+        with mock.patch.object(tts_service, 'generate_mp3', self.slow_mp3):
+            audio_id = tts_service.speculate("Das ist toll! Was möchtest du kaufen?", 'de')
+            self.assertIsNotNone(audio_id)
+            self.assertTrue(tts_service.claim_speculation(audio_id))
+
+            streamed = []
+            reader = threading.Thread(target=lambda: streamed.extend(
+                tts_service.stream_speech("Das ist toll! Was möchtest du kaufen?", 'de')))
+            reader.start()
+            time.sleep(0.1)
+            self.release.set()
+            reader.join(5)
+
+        self.assertEqual(b''.join(streamed).decode('utf-8'), "Das ist toll!Was möchtest du kaufen?")
+        self.assertEqual(sorted(self.generated), ["Das ist toll!", "Was möchtest du kaufen?"])
+
+    def test_speculation_yields_to_waiting_listeners(self):
+        gate = admission.get_gate('gtts')
+        with mock.patch.dict(gate.waiting, {admission.INTERACTIVE: 1}):
+            self.assertIsNone(tts_service.speculate("Hallo.", 'de'))
+        self.assertFalse(tts_service._speculations)
+
+    def test_listener_does_not_inherit_queued_speculation(self):
+        admission.reset()
+        self.addCleanup(admission.reset)
+        patches = [
+            mock.patch.object(tts_service, 'TTS_BACKEND', 'local'),
+            mock.patch.dict(admission.UPSTREAM_LIMITS, {'gtts': (1, 1)}),
+            mock.patch.dict(admission.LANE_WAIT, {admission.INTERACTIVE: 5, admission.BULK: 0.2}),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+        gate = admission.get_gate('gtts')
+        gate.acquire(admission.INTERACTIVE, 1)
+        audio_id = tts_service.speculate("Guten Morgen.", 'de')
+        [speculation] = tts_service._speculations[audio_id]['futures']
+        time.sleep(0.05)
+        self.assertFalse(tts_service._inflight)
+
+        result = []
+        listener = threading.Thread(target=lambda: result.append(tts_service.synthesize("Guten Morgen.", 'de')))
+        listener.start()
+        with self.assertRaises(admission.Overloaded):
+            speculation.result(5)
+        gate.release(admission.INTERACTIVE)
+        listener.join(5)
+        self.assertTrue(result and os.path.exists(result[0]))
+
+    def test_capacity_and_waste_are_counted(self):
+        before = tts_service.speculation_stats()
+        with mock.patch.object(tts_service, 'generate_mp3', self.slow_mp3), \
+                mock.patch.object(tts_service, 'TTS_SPECULATIVE_MAX', 1):
+            self.assertIsNotNone(tts_service.speculate("Eins.", 'de'))
+            self.assertIsNone(tts_service.speculate("Zwei.", 'de'))
+            self.release.set()
+            tts_service.synthesize("Eins.", 'de')
+            for job in list(tts_service._speculations.values()):
+                for future in job['futures']:
+                    future.result()
+
+        with mock.patch.object(tts_service, 'SPECULATION_TTL', 0):
+            after = tts_service.speculation_stats()
+        self.assertEqual(after['skipped'] - before['skipped'], 1)
+        self.assertEqual(after['wasted'] - before['wasted'], 1)
+        self.assertEqual(after['wasted_clips'] - before['wasted_clips'], 1)
+        self.assertEqual(after['pending'], 0)
+
+class TestLocalTtsBackend(unittest.TestCase):
+
+    def setUp(self):
+        self.tmpdir = tempfile.TemporaryDirectory()
+        patches = [
+            mock.patch.object(tts_service, 'TTS_BACKEND', 'local'),
+            mock.patch.object(tts_service, 'TTS_CACHE_DIR', self.tmpdir.name),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+        cache.reset_caches()
+
+    def tearDown(self):
+        cache.reset_caches()
+        self.tmpdir.cleanup()
+
+    def test_writes_silent_mp3_without_network(self):
+        with mock.patch.dict(sys.modules, {'gtts': None}):
+            path = tts_service.synthesize('Guten Morgen, wie geht es dir?', 'de')
+        with open(path, 'rb') as f:
+            data = f.read()
+        self.assertTrue(data.startswith(b'\xff\xfb'))
+        self.assertEqual(len(data) % len(tts_service.SILENT_FRAME), 0)
+        self.assertEqual(os.listdir(self.tmpdir.name), [os.path.basename(path)])
+
+class TestSpeechStreamEndpoint(AppTestCase):
+
+    def setUp(self):
+        super().setUp()
+        patches = [
+            mock.patch.object(tts_service, 'TTS_BACKEND', 'local'),
+            mock.patch.object(tts_service, 'TTS_CACHE_DIR', self.tmpdir.name),
+        ]
+        for patch in patches:
+            patch.start()
+            self.addCleanup(patch.stop)
+
+    def test_long_text_is_streamed_by_short_id(self):
+        text = "Schöne Grüße aus München, übermorgen fahren wir zurück. " * 60
+        registered = self.client.post('/api/text-to-speech/stream', json={'text': text, 'lang': 'de'}).get_json()
+        self.assertLess(len(registered['audio_url']), 80)
+        self.assertNotIn('?', registered['audio_url'])
+
+        response = self.client.get(registered['audio_url'])
+        self.assertEqual(response.status_code, 200)
+        self.assertEqual(response.mimetype, 'audio/mpeg')
+        self.assertTrue(response.get_data().startswith(b'\xff\xfb'))
+
+    def test_streamed_body_keeps_the_request_lane(self):
+        lanes = []
+        def record_lane(text, lang, path):
+            lanes.append(admission.current_lane())
+            with open(path, 'wb') as f:
+                f.write(b'mp3')
+        text = "Eins. Zwei. Drei. Vier. Fünf. Sechs."
+        audio_id = self.client.post('/api/text-to-speech/stream', json={'text': text, 'lang': 'de'}).get_json()['audio_id']
+        with mock.patch.object(tts_service, 'generate_mp3', record_lane):
+            response = self.client.get(f'/api/text-to-speech/stream/{audio_id}',
+                                       headers={'X-Request-Priority': 'bulk'})
+            # The view has returned; the rest of the body is synthesized while draining
+            self.assertEqual(response.get_data(), b'mp3' * 6)
+        self.assertEqual(lanes, [admission.BULK] * 6)
+
+    def test_unknown_id_is_not_found(self):
+        self.assertEqual(self.client.get('/api/text-to-speech/stream/deadbeef').status_code, 404)
+        self.assertEqual(self.client.post('/api/text-to-speech/stream', json={'lang': 'de'}).status_code, 400)
+
+if __name__ == '__main__':
+    unittest.main()
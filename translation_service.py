@@ -0,0 +1,57 @@
+import os
+import admission
+import cache
+import idempotency
+
+JIGSAWSTACK_API_KEY = os.getenv("JIGSAWSTACK_API_KEY")
+JIGSAWSTACK_URL = os.getenv("JIGSAWSTACK_URL", "https://jigsawstack.com/api/v1/ai/translate")
+
+def extract_translation(result):
+    """Pick the translated text out of a JigsawStack response, or None"""
+    if isinstance(result, dict):
+        for key in ["translation", "translated_text", "result"]:
+            if key in result:
+                return result[key]
+    return None
+
+def call_jigsawstack(text, source_lang, target_lang):
+    """Translate text with JigsawStack and return the raw JSON result"""
+    import requests
+
+    payload = {
+        "text": text,
+        "source_language": source_lang,
+        "target_language": target_lang
+    }
+    
+    headers = {
+        "Content-Type": "application/json",
+        "x-api-key": JIGSAWSTACK_API_KEY
+    }
+    
+    with admission.upstream('jigsawstack'):
+        response = requests.post(JIGSAWSTACK_URL, json=payload, headers=headers)
+    admission.check_response('jigsawstack', response)
+    response.raise_for_status()
+    return response.json()
+
+def cached_translation(text, source_lang, target_lang):
+    """Return the cached translation, or None without calling the provider"""
+    return cache.get_cache('translations').get(cache.make_key(source_lang, target_lang, text))
+
+def translate(text, source_lang, target_lang):
+    """Translate text, serving repeated phrases from the shared cache"""
+    cached = cached_translation(text, source_lang, target_lang)
+    if cached is not None:
+        return cached
+    
+    result = call_jigsawstack(text, source_lang, target_lang)
+    translation = extract_translation(result)
+    
+    if not translation:
+        # Unexpected payload: show it, but don't cache or replay it
+        idempotency.dont_store()
+        return str(result)
+    
+    cache.get_cache('translations').set(cache.make_key(source_lang, target_lang, text), translation)
+    return translation
@@ -0,0 +1,337 @@
+import contextlib
+import contextvars
+import functools
+import os
+import re
+import tempfile
+import threading
+import time
+from concurrent.futures import Future, ThreadPoolExecutor
+from datetime import datetime
+import admission
+import cache
+
+# "gtts" (default), or "local": offline stand-in that writes silent MP3 frames
+TTS_BACKEND = os.getenv('TTS_BACKEND', 'gtts')
+TTS_CACHE_DIR = os.getenv('TTS_CACHE_DIR', 'tts_cache')
+TTS_CACHE_MAX_MB = int(os.getenv('TTS_CACHE_MAX_MB', '512'))
+PRUNE_EVERY = 50
+
+# Streaming: shared synthesis pool, and how far one reply may run ahead of playback
+TTS_WORKERS = int(os.getenv('TTS_WORKERS', '4'))
+TTS_STREAM_WINDOW = int(os.getenv('TTS_STREAM_WINDOW', '3'))
+MAX_CHUNK_CHARS = 200
+READ_SIZE = 16 * 1024
+
+# Speculative synthesis of tutor replies: its own small pool (so it never
+# queues ahead of a listener on the streaming pool), max jobs running at
+# once, max sentences per reply, and how long an unclaimed result counts
+# as pending
+TTS_SPECULATIVE_WORKERS = int(os.getenv('TTS_SPECULATIVE_WORKERS', '2'))
+TTS_SPECULATIVE_MAX = int(os.getenv('TTS_SPECULATIVE_MAX', '8'))
+SPECULATIVE_MAX_SENTENCES = 6
+SPECULATION_TTL = 120
+
+SENTENCE_END = re.compile(r'(?<=[.!?…;:])\s+')
+
+_generated = 0
+_generated_lock = threading.Lock()
+
+# One silent MPEG-1 Layer III frame (128 kbps, 44.1 kHz, mono), about 26 ms
+SILENT_FRAME = bytes([0xFF, 0xFB, 0x90, 0xC4]) + bytes(413)
+
+def write_local_speech(text, fp):
+    """Offline stand-in: roughly one frame of silence per character"""
+    fp.write(SILENT_FRAME * max(10, len(text)))
+
+def generate_mp3(text, lang, path):
+    """Synthesize text with the TTS backend and atomically place the MP3 at path"""
+    os.makedirs(os.path.dirname(path) or '.', exist_ok=True)
+    if TTS_BACKEND == 'local':
+        write_speech = functools.partial(write_local_speech, text)
+    else:
+        from gtts import gTTS
+        write_speech = gTTS(text=text, lang=lang, slow=False).write_to_fp
+    
+    # Write next to the target then rename, so other workers never see half a file
+    with tempfile.NamedTemporaryFile(dir=os.path.dirname(path) or '.', suffix='.part', delete=False) as tmp:
+        tmp_path = tmp.name
+        try:
+            with contextlib.nullcontext() if _holding_gtts.get() else admission.upstream('gtts'):
+                write_speech(tmp)
+        except Exception:
+            tmp.close()
+            os.unlink(tmp_path)
+            raise
+    os.replace(tmp_path, path)
+
+_inflight = {}
+_inflight_lock = threading.Lock()
+# Set while a speculative job already holds its gTTS slot (see _speculate_sentence)
+_holding_gtts = contextvars.ContextVar('holding_gtts', default=False)
+
+def synthesize(text, lang):
+    """Return the path of an MP3 for text, generating it only on a cache miss"""
+    key = cache.make_key(lang, text)
+    tts_cache = cache.get_cache('tts')
+    
+    meta = tts_cache.get(key)
+    if meta and os.path.exists(meta['path']):
+        return meta['path']
+    
+    # Single flight: a request for text that is already being generated
+    # (e.g. speculatively) waits for that result instead of starting again
+    with _inflight_lock:
+        future = _inflight.get(key)
+        owner = future is None
+        if owner:
+            future = _inflight[key] = Future()
+    if not owner:
+        return future.result()
+    
+    try:
+        path = _generate(key, text, lang, tts_cache)
+        future.set_result(path)
+        return path
+    except BaseException as e:
+        future.set_exception(e)
+        raise
+    finally:
+        with _inflight_lock:
+            del _inflight[key]
+
+def _generate(key, text, lang, tts_cache):
+    global _generated
+    path = os.path.join(TTS_CACHE_DIR, f"{key}.mp3")
+    if not os.path.exists(path):
+        generate_mp3(text, lang, path)
+        with _generated_lock:
+            _generated += 1
+            due = _generated % PRUNE_EVERY == 0
+        if due:
+            prune_audio_dir()
+    
+    tts_cache.set(key, {
+        'path': path,
+        'lang': lang,
+        'bytes': os.path.getsize(path),
+        'created_at': datetime.now().strftime('%Y-%m-%d %H:%M:%S')
+    })
+    return path
+
+def cached_path(text, lang):
+    """Path of an already generated MP3 for text, or None"""
+    path = os.path.join(TTS_CACHE_DIR, f"{cache.make_key(lang, text)}.mp3")
+    return path if os.path.exists(path) else None
+
+def prune_audio_dir(max_bytes=None):
+    """Delete the oldest cached MP3s until the directory fits in max_bytes"""
+    max_bytes = TTS_CACHE_MAX_MB * 1024 * 1024 if max_bytes is None else max_bytes
+    try:
+        entries = [e for e in os.scandir(TTS_CACHE_DIR) if e.is_file() and e.name.endswith('.mp3')]
+    except FileNotFoundError:
+        return 0
+    
+    entries.sort(key=lambda e: e.stat().st_mtime)
+    total = sum(e.stat().st_size for e in entries)
+    removed = 0
+    for entry in entries:
+        if total <= max_bytes:
+            break
+        try:
+            size = entry.stat().st_size
+            os.unlink(entry.path)
+        except FileNotFoundError:
+            continue
+        total -= size
+        removed += 1
+    return removed
+
+def split_sentences(text, max_chars=MAX_CHUNK_CHARS):
+    """Split text into sentence-sized chunks no longer than max_chars"""
+    chunks = []
+    for sentence in SENTENCE_END.split(text.strip()):
+        sentence = sentence.strip()
+        while len(sentence) > max_chars:
+            # Break overly long sentences at the last comma or space that fits
+            cut = max(sentence.rfind(',', 0, max_chars), sentence.rfind(' ', 0, max_chars))
+            # Keep the delimiter with the first part; with none, hard-cut at the limit
+            end = cut + 1 if cut > 0 else max_chars
+            chunks.append(sentence[:end].strip())
+            sentence = sentence[end:].strip()
+        if sentence:
+            chunks.append(sentence)
+    return chunks
+
+_executor = None
+_executor_lock = threading.Lock()
+
+def get_executor():
+    global _executor
+    if _executor is None:
+        with _executor_lock:
+            if _executor is None:
+                _executor = ThreadPoolExecutor(max_workers=TTS_WORKERS, thread_name_prefix='tts')
+    return _executor
+
+_speculation_executor = None
+
+def get_speculation_executor():
+    global _speculation_executor
+    if _speculation_executor is None:
+        with _executor_lock:
+            if _speculation_executor is None:
+                _speculation_executor = ThreadPoolExecutor(max_workers=TTS_SPECULATIVE_WORKERS,
+                                                           thread_name_prefix='tts-speculative')
+    return _speculation_executor
+
+def stream_speech(text, lang, window=TTS_STREAM_WINDOW):
+    """
+    Yield MP3 bytes for text sentence by sentence, in order.
+
+    Up to `window` sentences are synthesized in parallel on the shared pool;
+    each one is cached on its own, so a sentence repeated in another reply
+    is served from disk. MP3 frames concatenate, so the client can start
+    playing as soon as the first sentence arrives.
+
+    The caller's lane is captured now: a streamed response is drained after
+    the view (and its admission.lane block) has returned.
+    """
+    return _stream_sentences(split_sentences(text), lang, window, contextvars.copy_context())
+
+def _stream_sentences(sentences, lang, window, context):
+    executor = get_executor()
+    pending = []
+    next_index = 0
+    
+    try:
+        while next_index < len(sentences) or pending:
+            while next_index < len(sentences) and len(pending) < window:
+                pending.append(admission.submit(executor, synthesize, sentences[next_index], lang, context=context))
+                next_index += 1
+            
+            path = pending.pop(0).result()
+            with open(path, 'rb') as audio:
+                while True:
+                    data = audio.read(READ_SIZE)
+                    if not data:
+                        break
+                    yield data
+    finally:
+        # Client went away or a chunk failed: don't synthesize the rest
+        for future in pending:
+            future.cancel()
+
+# --- Stream ids ---
+# The text to stream is registered once and fetched by a short id, so long
+# replies never travel in a URL (request-line limits, access logs)
+
+def speech_id(text, lang):
+    return cache.make_key('speech', lang, text)[:24]
+
+def register_speech(text, lang):
+    """Remember text under a short id for the stream endpoint"""
+    audio_id = speech_id(text, lang)
+    cache.get_cache('speech').set(audio_id, {'text': text, 'lang': lang})
+    return audio_id
+
+def registered_speech(audio_id):
+    """(text, lang) registered under audio_id; None if expired or registered in another worker"""
+    entry = cache.get_cache('speech').get(audio_id)
+    return (entry['text'], entry['lang']) if entry else None
+
+# --- Speculative synthesis ---
+
+_speculations = {}
+_speculation_lock = threading.Lock()
+_speculation_stats = {'started': 0, 'claimed': 0, 'skipped': 0, 'wasted': 0, 'wasted_clips': 0}
+
+def speculate(text, lang):
+    """
+    Start synthesizing text in the background before anyone asks for it.
+
+    Returns an audio id to pass back with the TTS request (which is then
+    served from the finished or still running synthesis), or None when
+    TTS_SPECULATIVE_MAX jobs are already running or interactive TTS calls
+    are queueing for gTTS. Only the first SPECULATIVE_MAX_SENTENCES
+    sentences are generated ahead, on the speculation pool.
+    """
+    _expire_speculations()
+    audio_id = speech_id(text, lang)
+    sentences = split_sentences(text)[:SPECULATIVE_MAX_SENTENCES]
+    # Sentences already on disk cost nothing and don't count as speculative work
+    fresh = [sentence for sentence in sentences if cached_path(sentence, lang) is None]
+    
+    with _speculation_lock:
+        if audio_id in _speculations:
+            return audio_id
+        running = sum(1 for job in _speculations.values() if not all(f.done() for f in job['futures']))
+        busy = admission.get_gate('gtts').stats()['queued'][admission.INTERACTIVE]
+        if running >= TTS_SPECULATIVE_MAX or busy:
+            _speculation_stats['skipped'] += 1
+            return None
+        # Nobody is waiting for this yet, so it queues behind interactive calls
+        with admission.lane(admission.BULK):
+            futures = [admission.submit(get_speculation_executor(), _speculate_sentence, sentence, lang)
+                       for sentence in fresh]
+        _speculations[audio_id] = {
+            'created': time.monotonic(),
+            'claimed': False,
+            'futures': futures,
+        }
+        _speculation_stats['started'] += 1
+    return audio_id
+
+def _speculate_sentence(text, lang):
+    """synthesize for a speculative job: wait for a gTTS slot before going in flight
+
+    A listener asking for the same sentence joins the in-flight result, so
+    the job must not become visible while it still queues in the bulk lane;
+    until it holds a slot the listener synthesizes in its own lane instead.
+    """
+    if cached_path(text, lang) is not None:
+        return synthesize(text, lang)
+    with _inflight_lock:
+        future = _inflight.get(cache.make_key(lang, text))
+    if future is not None:
+        return future.result()
+    with admission.upstream('gtts'):
+        token = _holding_gtts.set(True)
+        try:
+            return synthesize(text, lang)
+        finally:
+            _holding_gtts.reset(token)
+
+def claim_speculation(audio_id):
+    """Mark a speculative result as used; False if unknown (expired or another worker)"""
+    with _speculation_lock:
+        job = _speculations.get(audio_id)
+        if job is None:
+            return False
+        if not job['claimed']:
+            job['claimed'] = True
+            _speculation_stats['claimed'] += 1
+        return True
+
+def _expire_speculations():
+    """Forget old jobs, counting the clips of unclaimed ones as wasted work"""
+    now = time.monotonic()
+    with _speculation_lock:
+        for audio_id, job in list(_speculations.items()):
+            if now - job['created'] < SPECULATION_TTL:
+                continue
+            if not job['claimed']:
+                _speculation_stats['wasted'] += 1
+                _speculation_stats['wasted_clips'] += sum(
+                    1 for f in job['futures'] if f.done() and not f.cancelled() and f.exception() is None)
+            del _speculations[audio_id]
+
+def speculation_stats():
+    """Counters for this worker process only: a reply claimed through another worker counts as wasted here"""
+    _expire_speculations()
+    with _speculation_lock:
+        stats = dict(_speculation_stats)
+        stats['pending'] = len(_speculations)
+    decided = stats['claimed'] + stats['wasted']
+    stats['claim_rate'] = stats['claimed'] / decided if decided else None
+    return stats
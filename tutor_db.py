@@ -1,20 +1,38 @@
 import sqlite3
 import json
 from datetime import datetime
+import cache
+import sharding
 
 DB_NAME = "tutor.db"
 
-def get_db_connection():
-    conn = sqlite3.connect(DB_NAME)
+def _connect(path):
+    conn = sqlite3.connect(path)
     conn.row_factory = sqlite3.Row
     return conn
 
+def get_db_connection(shard=0):
+    """Connection to one shard file (the main file if unsharded)"""
+    if sharding.is_sharded():
+        return _connect(sharding.shard_path(DB_NAME, shard))
+    return _connect(DB_NAME)
+
+def get_user_connection(user_id):
+    return get_db_connection(sharding.shard_for_user(user_id))
+
 def init_db():
-    conn = get_db_connection()
+    # Every shard holds the full schema; sessions and messages of a user share a file
+    for shard in range(sharding.shard_count()):
+        _init_shard(shard)
+
+def _init_shard(shard):
+    conn = get_db_connection(shard)
     c = conn.cursor()
     
     # Enable FK
     c.execute("PRAGMA foreign_keys = ON")
+    c.execute("PRAGMA auto_vacuum = INCREMENTAL")
+    c.execute("PRAGMA journal_mode = WAL")
     
     # User Profile (One per user)
     c.execute('''
@@ -52,26 +70,36 @@ def init_db():
         )
     ''')
     
+    c.execute('CREATE INDEX IF NOT EXISTS idx_tutor_sessions_user ON tutor_sessions (user_id, is_active, id)')
+    c.execute('CREATE INDEX IF NOT EXISTS idx_tutor_messages_session ON tutor_messages (session_id, id)')
+    
     conn.commit()
     conn.close()
 
 # --- Profiles ---
 
 def get_profile(user_id):
-    conn = get_db_connection()
+    profiles_cache = cache.get_cache('tutor_profiles')
+    profile = profiles_cache.get(str(user_id))
+    if profile is not None:
+        return profile
+    
+    conn = get_user_connection(user_id)
     c = conn.cursor()
     c.execute('SELECT * FROM user_profiles WHERE user_id = ?', (user_id,))
     row = c.fetchone()
     conn.close()
     
     if row:
-        return dict(row)
+        profile = dict(row)
+        profiles_cache.set(str(user_id), profile)
+        return profile
     else:
         # Create default profile if none exists
         return create_profile(user_id)
 
 def create_profile(user_id):
-    conn = get_db_connection()
+    conn = get_user_connection(user_id)
     c = conn.cursor()
     now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     try:
@@ -80,10 +108,11 @@ def create_profile(user_id):
     except sqlite3.IntegrityError:
         pass # Already exists
     conn.close()
+    cache.get_cache('tutor_profiles').delete(str(user_id))
     return {'user_id': user_id, 'level': 'A1', 'weaknesses': '[]', 'goals': '[]', 'last_active': now}
 
 def update_profile(user_id, weaknesses=None, goals=None, level=None):
-    conn = get_db_connection()
+    conn = get_user_connection(user_id)
     c = conn.cursor()
     
     updates = []
@@ -110,13 +139,39 @@ def update_profile(user_id, weaknesses=None, goals=None, level=None):
         
         c.execute(query, params)
         conn.commit()
+        cache.get_cache('tutor_profiles').delete(str(user_id))
         
     conn.close()
 
+def add_weakness(user_id, weakness, limit=5):
+    """Append to the weaknesses list unless it already holds limit entries
+
+    Reads and writes in one write transaction, straight from the database:
+    the cached profile may be stale, and another worker may be appending at
+    the same time.
+    """
+    get_profile(user_id)  # make sure the row exists
+    conn = get_user_connection(user_id)
+    try:
+        conn.execute('BEGIN IMMEDIATE')
+        row = conn.execute('SELECT weaknesses FROM user_profiles WHERE user_id = ?', (user_id,)).fetchone()
+        weaknesses = json.loads(row['weaknesses'])
+        if len(weaknesses) >= limit:
+            return False
+        weaknesses.append(weakness)
+        conn.execute('UPDATE user_profiles SET weaknesses = ?, last_active = ? WHERE user_id = ?',
+                     (json.dumps(weaknesses), datetime.now().strftime('%Y-%m-%d %H:%M:%S'), user_id))
+        conn.commit()
+    finally:
+        conn.close()
+    cache.get_cache('tutor_profiles').delete(str(user_id))
+    return True
+
 # --- Sessions ---
 
 def create_session(user_id, task_type='free_chat'):
-    conn = get_db_connection()
+    shard = sharding.shard_for_user(user_id)
+    conn = get_db_connection(shard)
     c = conn.cursor()
     now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     
@@ -125,23 +180,30 @@ def create_session(user_id, task_type='free_chat'):
     
     c.execute('INSERT INTO tutor_sessions (user_id, start_time, task_type) VALUES (?, ?, ?)',
               (user_id, now, task_type))
-    session_id = c.lastrowid
+    # Encoded so the id alone routes later messages to this shard
+    session_id = sharding.encode_id(c.lastrowid, shard)
     conn.commit()
     conn.close()
     return session_id
 
 def get_active_session(user_id):
-    conn = get_db_connection()
+    shard = sharding.shard_for_user(user_id)
+    conn = get_db_connection(shard)
     c = conn.cursor()
     c.execute('SELECT * FROM tutor_sessions WHERE user_id = ? AND is_active = 1 ORDER BY id DESC LIMIT 1', (user_id,))
     row = c.fetchone()
     conn.close()
-    return dict(row) if row else None
+    if not row:
+        return None
+    session = dict(row)
+    session['id'] = sharding.encode_id(session['id'], shard)
+    return session
 
 # --- Messages ---
 
 def add_message(session_id, role, content, correction=None):
-    conn = get_db_connection()
+    shard, local_session_id = sharding.decode_id(session_id)
+    conn = get_db_connection(shard)
     c = conn.cursor()
     now = datetime.now().strftime('%Y-%m-%d %H:%M:%S')
     
@@ -150,13 +212,14 @@ def add_message(session_id, role, content, correction=None):
     c.execute('''
         INSERT INTO tutor_messages (session_id, role, content, correction_json, timestamp)
         VALUES (?, ?, ?, ?, ?)
-    ''', (session_id, role, content, correction_json, now))
+    ''', (local_session_id, role, content, correction_json, now))
     
     conn.commit() 
     conn.close()
 
 def get_session_history(session_id, limit=20):
-    conn = get_db_connection()
+    shard, local_session_id = sharding.decode_id(session_id)
+    conn = get_db_connection(shard)
     c = conn.cursor()
     # Get last N messages
     c.execute('''
@@ -166,10 +229,17 @@ def get_session_history(session_id, limit=20):
             ORDER BY id DESC 
             LIMIT ?
         ) ORDER BY id ASC
-    ''', (session_id, limit))
+    ''', (local_session_id, limit))
     rows = c.fetchall()
     conn.close()
-    return [dict(row) for row in rows]
+    
+    messages = []
+    for row in rows:
+        message = dict(row)
+        message['id'] = sharding.encode_id(message['id'], shard)
+        message['session_id'] = sharding.encode_id(message['session_id'], shard)
+        messages.append(message)
+    return messages
 
 if __name__ == "__main__":
     init_db()